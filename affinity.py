@@ -0,0 +1,355 @@
+"""Sparse producer x performer affinity matrices built from produce_songs.
+
+An AffinityMatrix counts the events between each row entity (say, each
+performer) and each column entity (each producer) in a scipy CSR matrix,
+aggregated by the database and indexed with numpy, so memory grows with the
+number of distinct pairs rather than rows x columns.  Rows are weighted
+(raw counts, binary, log or TF-IDF), scaled to unit length and compared by
+cosine similarity.  Every row's top-k most similar rows are found in blocks
+of rows, keeping each block's dense similarity matrix under BLOCK_CELLS.
+
+refresh() reads only events added since the last build.  Counts only grow,
+so the rows whose neighbours can change are those similar to a row whose
+weighted vector changed; only they are recomputed.  If events were deleted,
+or TF-IDF weights shift because rows were added, the neighbours are
+recomputed in full.  State is saved to AFFINITY_DIR between seed runs,
+with sums of the ids in the events it was built from; if the database's
+events up to the last one seen no longer match them (say, after a reseed into
+a fresh database), the matrix is rebuilt from scratch.
+"""
+
+import os
+
+import numpy as np
+from scipy import sparse
+
+from model import ProduceSong, db
+
+WEIGHTINGS = ("count", "binary", "log", "tfidf")
+
+# Most similarity scores held in memory at once while finding top-k rows.
+BLOCK_CELLS = 4 * 1024 * 1024
+
+# Saved matrices, next to this file unless AFFINITY_DIR is set.
+AFFINITY_DIR = os.environ.get(
+    "AFFINITY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "affinity_cache")
+)
+
+
+def event_counts(row_column, column_column, after_event_id=0):
+    """Return arrays of (row id, column id, event count) for events after
+    after_event_id.
+    """
+
+    counts = db.session.query(
+        row_column, column_column, db.func.count()
+    ).filter(
+        ProduceSong.event_id > after_event_id
+    ).group_by(
+        row_column, column_column
+    ).all()
+
+    counts = np.array(counts, dtype=np.int64).reshape(-1, 3)
+
+    return counts[:, 0], counts[:, 1], counts[:, 2]
+
+
+def weight(counts, weighting="tfidf"):
+    """Return counts weighted by weighting, with rows scaled to unit length."""
+
+    weighted = counts.astype(np.float64)
+
+    if weighting == "binary":
+        weighted.data[:] = 1
+    elif weighting == "log":
+        weighted.data = np.log1p(weighted.data)
+    elif weighting == "tfidf":
+        # Columns that appear in many rows say little about any one of them.
+        document_frequency = np.bincount(weighted.indices,
+                                         minlength=weighted.shape[1])
+        idf = np.log((1 + weighted.shape[0]) / (1 + document_frequency)) + 1
+        weighted.data = np.log1p(weighted.data) * idf[weighted.indices]
+    elif weighting != "count":
+        raise ValueError(f"Unknown weighting {weighting!r}, "
+                         f"expected one of {', '.join(WEIGHTINGS)}")
+
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+
+    return sparse.diags(1 / norms).dot(weighted).tocsr()
+
+
+def top_k_similar(normalized, k, rows=None):
+    """Return (neighbours, similarities) for rows (default all rows).
+
+    neighbours[i] holds the positions of the k rows most cosine-similar to
+    rows[i], most similar first, padded with -1 where fewer than k rows have
+    any similarity.
+    """
+
+    n = normalized.shape[0]
+
+    if rows is None:
+        rows = np.arange(n)
+
+    neighbours = np.full((len(rows), k), -1, dtype=np.int64)
+    similarities = np.zeros((len(rows), k))
+    top_count = min(k, n - 1)
+
+    if top_count < 1 or not len(rows):
+        return neighbours, similarities
+
+    transposed = normalized.T.tocsr()
+    block_size = max(1, BLOCK_CELLS // n)
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        block_similarities = normalized[block].dot(transposed).toarray()
+
+        # A row isn't its own neighbour.
+        block_similarities[np.arange(len(block)), block] = 0
+
+        top = np.argpartition(-block_similarities, top_count - 1,
+                              axis=1)[:, :top_count]
+
+        # Most similar first, ties broken by position.
+        top.sort(axis=1)
+        top_similarities = np.take_along_axis(block_similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_similarities = np.take_along_axis(top_similarities, order, axis=1)
+
+        top[top_similarities <= 0] = -1
+        top_similarities[top_similarities <= 0] = 0
+
+        neighbours[start:start + len(block), :top_count] = top
+        similarities[start:start + len(block), :top_count] = top_similarities
+
+    return neighbours, similarities
+
+
+class AffinityMatrix(object):
+    """Event counts between row_key and column_key entities, with each row's
+    k most similar rows.
+
+    row_key and column_key are "producer_id" or "performer_id".
+    """
+
+    def __init__(self, row_key, column_key, weighting="tfidf", k=5):
+        self.row_key = row_key
+        self.column_key = column_key
+        self.weighting = weighting
+        self.k = k
+
+        self.row_ids = np.empty(0, dtype=np.int64)
+        self.column_ids = np.empty(0, dtype=np.int64)
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+
+        # Ids (not positions) of each row's neighbours, padded with -1.
+        self.neighbour_ids = np.empty((0, k), dtype=np.int64)
+        self.similarities = np.empty((0, k))
+
+        self.last_event_id = 0
+        self.event_count = 0
+        self.checksum = [0, 0, 0]
+
+    def _event_columns(self):
+        return (getattr(ProduceSong, self.row_key),
+                getattr(ProduceSong, self.column_key))
+
+    def _event_totals(self):
+        """Return the number of events and the highest event id."""
+
+        event_count, last_event_id = db.session.query(
+            db.func.count(ProduceSong.event_id), db.func.max(ProduceSong.event_id)
+        ).one()
+
+        return event_count, last_event_id or 0
+
+    def _event_checksum(self, last_event_id):
+        """Return the sums of the event, row and column ids of the events up
+        to last_event_id.
+        """
+
+        row_column, column_column = self._event_columns()
+
+        sums = db.session.query(
+            db.func.sum(ProduceSong.event_id), db.func.sum(row_column),
+            db.func.sum(column_column)
+        ).filter(
+            ProduceSong.event_id <= last_event_id
+        ).one()
+
+        return [int(total or 0) for total in sums]
+
+    def _add_counts(self, row_ids, column_ids, counts):
+        """Add event counts, growing the matrix for new ids.
+
+        Returns the positions of the rows and columns added to.
+        """
+
+        all_row_ids = np.union1d(self.row_ids, row_ids)
+        all_column_ids = np.union1d(self.column_ids, column_ids)
+
+        old = self.counts.tocoo()
+        old_rows = np.searchsorted(all_row_ids, self.row_ids)
+        old_columns = np.searchsorted(all_column_ids, self.column_ids)
+        new_rows = np.searchsorted(all_row_ids, row_ids)
+        new_columns = np.searchsorted(all_column_ids, column_ids)
+
+        # Duplicate (row, column) entries are summed.
+        self.counts = sparse.csr_matrix(
+            (np.concatenate([old.data, counts]),
+             (np.concatenate([old_rows[old.row], new_rows]),
+              np.concatenate([old_columns[old.col], new_columns]))),
+            shape=(len(all_row_ids), len(all_column_ids))
+        )
+
+        neighbour_ids = np.full((len(all_row_ids), self.k), -1, dtype=np.int64)
+        similarities = np.zeros((len(all_row_ids), self.k))
+        neighbour_ids[old_rows] = self.neighbour_ids
+        similarities[old_rows] = self.similarities
+
+        self.row_ids, self.column_ids = all_row_ids, all_column_ids
+        self.neighbour_ids, self.similarities = neighbour_ids, similarities
+
+        return np.unique(new_rows), np.unique(new_columns)
+
+    def _update_neighbours(self, normalized, rows=None):
+        """Recompute the neighbours of rows (default all rows)."""
+
+        neighbours, similarities = top_k_similar(normalized, self.k, rows)
+
+        neighbour_ids = np.where(neighbours >= 0,
+                                 self.row_ids[np.maximum(neighbours, 0)], -1)
+
+        if rows is None:
+            self.neighbour_ids, self.similarities = neighbour_ids, similarities
+        else:
+            self.neighbour_ids[rows] = neighbour_ids
+            self.similarities[rows] = similarities
+
+    def build(self):
+        """Build the matrix and every row's neighbours from all events."""
+
+        self.__init__(self.row_key, self.column_key, self.weighting, self.k)
+        self.event_count, self.last_event_id = self._event_totals()
+        self.checksum = self._event_checksum(self.last_event_id)
+
+        self._add_counts(*event_counts(*self._event_columns()))
+        self._update_neighbours(weight(self.counts, self.weighting))
+
+        return self
+
+    def refresh(self):
+        """Apply events added since the last build or refresh.
+
+        Returns the number of rows whose neighbours were recomputed.
+        """
+
+        event_count, last_event_id = self._event_totals()
+
+        # The events counted so far have changed, or belong to another
+        # database: start again.
+        if self._event_checksum(self.last_event_id) != self.checksum:
+            self.build()
+            return len(self.row_ids)
+
+        if event_count == self.event_count and last_event_id == self.last_event_id:
+            return 0
+
+        row_ids, column_ids, counts = event_counts(*self._event_columns(),
+                                                   after_event_id=self.last_event_id)
+
+        # Events were deleted or renumbered: start again.
+        if last_event_id < self.last_event_id or \
+                event_count != self.event_count + counts.sum():
+            self.build()
+            return len(self.row_ids)
+
+        row_count = len(self.row_ids)
+        changed_rows, changed_columns = self._add_counts(row_ids, column_ids,
+                                                         counts)
+        self.event_count, self.last_event_id = event_count, last_event_id
+        self.checksum = self._event_checksum(last_event_id)
+
+        normalized = weight(self.counts, self.weighting)
+
+        # TF-IDF weights every column by the number of rows.
+        if self.weighting == "tfidf" and len(self.row_ids) != row_count:
+            self._update_neighbours(normalized)
+            return len(self.row_ids)
+
+        # Rows whose weighted vectors changed: the rows with new events, and
+        # under TF-IDF every row using a column whose weight changed.
+        if self.weighting == "tfidf":
+            changed_rows = np.union1d(
+                changed_rows,
+                self.counts[:, changed_columns].tocsr().nonzero()[0]
+            )
+
+        # Their own neighbours, and those of every row similar to them.
+        similar = normalized.dot(normalized[changed_rows].T.tocsr())
+        rows = np.union1d(changed_rows, np.unique(similar.nonzero()[0]))
+
+        self._update_neighbours(normalized, rows)
+
+        return len(rows)
+
+    def related(self):
+        """Return {row id: ids of its most similar rows, most similar first}."""
+
+        return {int(row_id): [int(i) for i in neighbour_ids if i >= 0]
+                for row_id, neighbour_ids in zip(self.row_ids, self.neighbour_ids)}
+
+    def filename(self, directory=AFFINITY_DIR):
+        return os.path.join(directory, f"{self.row_key}_{self.column_key}.npz")
+
+    def save(self, directory=AFFINITY_DIR):
+        """Save the matrix and neighbours for a later refresh."""
+
+        os.makedirs(directory, exist_ok=True)
+
+        np.savez(self.filename(directory),
+                 row_ids=self.row_ids,
+                 column_ids=self.column_ids,
+                 data=self.counts.data,
+                 indices=self.counts.indices,
+                 indptr=self.counts.indptr,
+                 neighbour_ids=self.neighbour_ids,
+                 similarities=self.similarities,
+                 events=np.array([self.event_count, self.last_event_id]),
+                 checksum=np.array(self.checksum, dtype=np.int64),
+                 weighting=np.array(self.weighting))
+
+    def load(self, directory=AFFINITY_DIR):
+        """Load saved state; return False if there is none for these settings."""
+
+        filename = self.filename(directory)
+
+        if not os.path.exists(filename):
+            return False
+
+        saved = np.load(filename)
+
+        # Saved before checksums were kept: no way to tell whose events.
+        if "checksum" not in saved.files:
+            return False
+
+        if str(saved["weighting"]) != self.weighting or \
+                saved["neighbour_ids"].shape[1] != self.k:
+            return False
+
+        self.row_ids = saved["row_ids"]
+        self.column_ids = saved["column_ids"]
+        self.counts = sparse.csr_matrix(
+            (saved["data"], saved["indices"], saved["indptr"]),
+            shape=(len(self.row_ids), len(self.column_ids))
+        )
+        self.neighbour_ids = saved["neighbour_ids"]
+        self.similarities = saved["similarities"]
+        self.event_count, self.last_event_id = (int(n) for n in saved["events"])
+        self.checksum = [int(total) for total in saved["checksum"]]
+
+        return True
@@ -0,0 +1,268 @@
+"""In-memory prefix index for /autocomplete.json.
+
+Every producer and performer name and song and album title is normalised and
+kept in one sorted list, so the matches for a prefix are a contiguous run
+found with a binary search.  Producer and performer names are also indexed
+from each of their words, so "oba" finds "Barack Obama".  Song and album
+titles are only indexed from the start, to keep the index small for large
+catalogs.
+
+Matches are ordered exact match first, then by popularity (number of
+produce_songs events), then alphabetically.  For one and two character
+prefixes, which match most of the catalog, the top matches are precomputed.
+
+The index is built once per worker from the catalog tables and rebuilt in
+the background when seed.py bumps the catalog version.  Lookups don't query
+the catalog; at most every VERSION_CHECK_INTERVAL seconds one reads the
+catalog version.
+"""
+
+import bisect
+import threading
+import time
+from concurrent.futures import Future
+
+from model import Album, CatalogVersion, Performer, Producer, ProduceSong, Song, db
+
+# Entity type, id column, name column, produce_songs column for popularity,
+# URL prefix and whether to index every word of the name.
+AUTOCOMPLETE_COLUMNS = [
+    ("producer", Producer.producer_id, Producer.producer_name,
+     ProduceSong.producer_id, "/producers/", True),
+    ("performer", Performer.performer_id, Performer.performer_name,
+     ProduceSong.performer_id, "/performers/", True),
+    ("song", Song.song_id, Song.song_title, ProduceSong.song_id, "/songs/",
+     False),
+    ("album", Album.album_id, Album.album_title, ProduceSong.album_id,
+     "/albums/", False),
+]
+
+# Most matches returned per lookup.
+MAX_LIMIT = 20
+
+# Keys examined past the start of a prefix's run; bounds the cost of a lookup.
+SCAN_LIMIT = 256
+
+# Prefixes at most this long have their top matches precomputed.
+SHORT_PREFIX_LENGTH = 2
+
+# Seconds between checks of the catalog version.
+VERSION_CHECK_INTERVAL = 30
+
+
+def normalize(text):
+    """Return text lowercased with runs of whitespace collapsed."""
+
+    return " ".join(text.lower().split())
+
+
+class PrefixIndex(object):
+    """Sorted-array prefix index over catalog names.
+
+    entities is a list of (entity_type, entity_id, name, url, popularity).
+    """
+
+    def __init__(self, entities, word_indexed_types=()):
+        self.entities = entities
+
+        # Each entity's normalised name and popularity, by ref, for ranking.
+        self.normalized = []
+        self.popularity = []
+
+        keyed = []
+
+        for ref, (entity_type, entity_id, name, url, popularity) in enumerate(entities):
+            key = normalize(name)
+            keyed.append((key, ref))
+            self.normalized.append(key)
+            self.popularity.append(popularity)
+
+            if entity_type in word_indexed_types:
+                words = key.split(" ")
+
+                for i in range(1, len(words)):
+                    keyed.append((" ".join(words[i:]), ref))
+
+        keyed.sort()
+
+        self.keys = [key for key, ref in keyed]
+        self.refs = [ref for key, ref in keyed]
+        self.short_prefixes = self._top_short_prefixes()
+
+    def _rank(self, ref, key):
+        """Sort key: exact matches, then most popular, then alphabetical."""
+
+        return (self.normalized[ref] != key, -self.popularity[ref],
+                self.entities[ref][2], ref)
+
+    def _top_short_prefixes(self):
+        """Return the top MAX_LIMIT refs for every short prefix, ranked as
+        lookups rank longer prefixes.
+
+        The keys sharing a prefix are contiguous, so each prefix length is
+        one pass over the keys, keeping only the current prefix's best
+        MAX_LIMIT ranks in order.
+        """
+
+        top = {}
+
+        for length in range(1, SHORT_PREFIX_LENGTH + 1):
+            prefix, best, members = None, [], set()
+
+            for key, ref in zip(self.keys, self.refs):
+                if len(key) < length:
+                    continue
+
+                if key[:length] != prefix:
+                    if prefix is not None:
+                        top[prefix] = [rank[-1] for rank in best]
+
+                    prefix, best, members = key[:length], [], set()
+
+                # A name indexed from several of its words counts once; one
+                # already dropped ranks below everything kept.
+                if ref in members:
+                    continue
+
+                rank = self._rank(ref, prefix)
+
+                if len(best) == MAX_LIMIT:
+                    if rank > best[-1]:
+                        continue
+
+                    members.discard(best.pop()[-1])
+
+                bisect.insort(best, rank)
+                members.add(ref)
+
+            if prefix is not None:
+                top[prefix] = [rank[-1] for rank in best]
+
+        return top
+
+    def lookup(self, query, limit=10):
+        """Return up to limit entities whose name starts with query."""
+
+        key = normalize(query)
+
+        if not key:
+            return []
+
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        if key in self.short_prefixes:
+            refs = self.short_prefixes[key]
+        else:
+            start = bisect.bisect_left(self.keys, key)
+            refs = []
+
+            for i in range(start, min(start + SCAN_LIMIT, len(self.keys))):
+                if not self.keys[i].startswith(key):
+                    break
+
+                refs.append(self.refs[i])
+
+            refs = sorted(set(refs), key=lambda ref: self._rank(ref, key))
+
+        return [self.entities[ref] for ref in refs[:limit]]
+
+
+def load_entities():
+    """Return (entity_type, entity_id, name, url, popularity) for the catalog."""
+
+    entities = []
+
+    for entity_type, id_column, name_column, event_column, url, _ in AUTOCOMPLETE_COLUMNS:
+        popularity = dict(
+            db.session.query(event_column, db.func.count())
+                      .group_by(event_column)
+        )
+
+        for entity_id, name in db.session.query(id_column, name_column):
+            entities.append((entity_type, entity_id, name,
+                             f"{url}{entity_id}", popularity.get(entity_id, 0)))
+
+    return entities
+
+
+class AutocompleteService(object):
+    """Holds a worker's PrefixIndex and keeps it in step with the catalog."""
+
+    def __init__(self, app):
+        self.app = app
+        self.index = None
+        self.version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._building = None
+
+    def build(self):
+        """Build the index from the catalog tables and swap it in."""
+
+        with self.app.app_context():
+            version = CatalogVersion.current()
+            word_indexed_types = [entity_type for entity_type, *_, words
+                                  in AUTOCOMPLETE_COLUMNS if words]
+
+            index = PrefixIndex(load_entities(), word_indexed_types)
+            db.session.remove()
+
+        self.index, self.version = index, version
+        self._checked_at = time.monotonic()
+
+    def build_in_background(self):
+        """Build the index on a daemon thread, unless a build is running;
+        return the running build's Future.
+
+        Builds run off the request's thread: scoped sessions are per thread,
+        and build() removes its session when done, which would detach the
+        request's objects.
+        """
+
+        with self._lock:
+            if self._building is not None:
+                return self._building
+
+            future = self._building = Future()
+
+        def rebuild():
+            try:
+                self.build()
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(None)
+            finally:
+                with self._lock:
+                    self._building = None
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+        return future
+
+    def refresh_if_stale(self):
+        """Rebuild in the background if the catalog version has changed.
+
+        The version is checked at most every VERSION_CHECK_INTERVAL seconds;
+        lookups keep using the current index until the new one is ready.
+        """
+
+        if time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = time.monotonic()
+
+        if CatalogVersion.current() != self.version:
+            self.build_in_background()
+
+    def lookup(self, query, limit=10):
+        """Return the top matches for query, building the index if needed."""
+
+        if self.index is None:
+            # Wait for the build started as the worker warmed up, if any.
+            self.build_in_background().result()
+        else:
+            self.refresh_if_stale()
+
+        return self.index.lookup(query, limit)
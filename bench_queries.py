@@ -0,0 +1,122 @@
+"""Micro-benchmark the hot queries with and without the compiled query cache.
+
+Times each query function behind the detail pages, chart endpoints and
+search, first rebuilding and recompiling its query on every call (baked
+queries turned off on the session, search statements dropped before each
+call), then with queries built and compiled once.  Every call runs against
+the database either way, so the difference is the Python-side cost of
+building and compiling queries.
+
+    $ python3 bench_queries.py --db-uri postgresql:///music --calls 1000
+"""
+
+import argparse
+import time
+
+import search
+from model import Album, CatalogVersion, Performer, Producer, ProduceSong
+from model import Song, connect_to_db, db
+
+
+def hot_queries(ids, names):
+    """Return (name, function) for each hot query, with arguments bound."""
+
+    from charts import performer_frequency, producer_frequency
+    from charts import producer_productivity
+    from server import album_timeline, get_or_404
+
+    return [
+        ("CatalogVersion.current", CatalogVersion.current),
+        ("get_or_404(Producer)", lambda: get_or_404(Producer, ids["producer"])),
+        ("album_timeline(producer)",
+         lambda: album_timeline(ProduceSong.producer_id, ids["producer"])),
+        ("album_timeline(performer)",
+         lambda: album_timeline(ProduceSong.performer_id, ids["performer"])),
+        ("producer_frequency", lambda: producer_frequency(ids["producer"])),
+        ("performer_frequency", lambda: performer_frequency(ids["performer"])),
+        ("producer_productivity", lambda: producer_productivity(ids["producer"])),
+        ("search_catalog", lambda: search.search_catalog(names["search"])),
+        ("Producer.get_producer_songs",
+         lambda: Producer.get_producer_songs(names["producer"])),
+        ("Performer.get_performer_songs",
+         lambda: Performer.get_performer_songs(names["performer"])),
+        ("Song.get_song_producers", lambda: Song.get_song_producers(names["song"])),
+        ("Album.get_album_producers",
+         lambda: Album.get_album_producers(names["album"])),
+    ]
+
+
+def time_calls(function, calls, cached):
+    """Return the mean seconds per call of function over calls calls."""
+
+    # A fresh session for each run, with baked queries on or off.
+    db.session.remove()
+    db.session.configure(enable_baked_queries=cached)
+
+    function()
+
+    started = time.perf_counter()
+
+    for _ in range(calls):
+        if not cached:
+            search._search_statements.clear()
+            search._compiled_searches.clear()
+
+        function()
+
+        # Drop loaded objects, so each call loads them as a request would.
+        db.session.expunge_all()
+
+    return (time.perf_counter() - started) / calls
+
+
+def bench_queries(calls):
+    """Return (name, uncached seconds, cached seconds) per hot query."""
+
+    producer = Producer.query.order_by(Producer.producer_id).first()
+    performer = Performer.query.order_by(Performer.performer_id).first()
+    song = Song.query.order_by(Song.song_id).first()
+    album = Album.query.order_by(Album.album_id).first()
+
+    ids = {"producer": producer.producer_id, "performer": performer.performer_id}
+    names = {
+        "producer": producer.producer_name,
+        "performer": performer.performer_name,
+        "song": song.song_title,
+        "album": album.album_title,
+        "search": producer.producer_name[:3],
+    }
+
+    results = []
+
+    for name, function in hot_queries(ids, names):
+        uncached = time_calls(function, calls, cached=False)
+        cached = time_calls(function, calls, cached=True)
+        results.append((name, uncached, cached))
+
+    db.session.remove()
+    db.session.configure(enable_baked_queries=True)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default="postgresql:///music",
+                        help="database to query, with the catalog loaded")
+    parser.add_argument("--calls", type=int, default=500,
+                        help="calls timed per query and mode")
+    args = parser.parse_args()
+
+    from server import app
+
+    connect_to_db(app, args.db_uri)
+
+    with app.app_context():
+        results = bench_queries(args.calls)
+
+    print(f"{'query':32} {'rebuilt us':>11} {'cached us':>10} {'saved us':>9}")
+
+    for name, uncached, cached in results:
+        print(f"{name:32} {uncached * 1e6:11.0f} {cached * 1e6:10.0f} "
+              f"{(uncached - cached) * 1e6:9.0f}")
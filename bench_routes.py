@@ -0,0 +1,251 @@
+"""Benchmark every route in server.py against a seeded database.
+
+Optionally loads a catalog (see generate_catalog.py) first, then requests each
+route repeatedly through Flask's test client and records latency percentiles
+and throughput.  The page cache is off unless --page-cache is given, so
+repeated requests time the views, their queries and templates rather than
+cache hits.  Results are written as JSON; pass --baseline with an earlier
+results file to see the change per route and fail on regressions.
+
+    $ python3 generate_catalog.py --out bench_data
+    $ python3 bench_routes.py --db-uri sqlite:///bench.db --load bench_data
+    $ python3 bench_routes.py --db-uri sqlite:///bench.db \\
+          --baseline bench_results.json --out bench_results_new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from model import Album, Performer, Producer, ProduceSong, Song, connect_to_db, db
+from server import app, pages
+
+# Search terms: a common single letter, a common word and a rare string.
+SEARCH_TERMS = ["a", "love", "zzqx"]
+
+
+def pick_ids():
+    """Return ids for detail pages: the busiest and a typical entity."""
+
+    def busiest(column):
+        return db.session.query(column).group_by(column).order_by(
+            db.func.count().desc()
+        ).limit(1).scalar()
+
+    return {
+        "producer": busiest(ProduceSong.producer_id),
+        "performer": busiest(ProduceSong.performer_id),
+        "song": busiest(ProduceSong.song_id),
+        "typical_producer": db.session.query(db.func.max(Producer.producer_id)).scalar(),
+        "typical_performer": db.session.query(db.func.max(Performer.performer_id)).scalar(),
+    }
+
+
+def build_routes(ids):
+    """Return (name, url) for every route to benchmark."""
+
+    list_pages = db.session.query(db.func.count(Song.song_id)).scalar() // 100
+
+    routes = [
+        ("homepage", "/"),
+        ("producer_list", "/producers"),
+        ("producer_list_deep", "/producers?page=50"),
+        ("performer_list", "/performers"),
+        ("song_list", "/songs"),
+        ("song_list_deep", f"/songs?page={max(list_pages, 1)}"),
+        ("album_list", "/albums"),
+        ("producer_detail", f"/producers/{ids['producer']}"),
+        ("producer_detail_typical", f"/producers/{ids['typical_producer']}"),
+        ("performer_detail", f"/performers/{ids['performer']}"),
+        ("song_detail", f"/songs/{ids['song']}"),
+        ("producer_charts", f"/producers/{ids['producer']}/charts.json"),
+        ("performer_charts", f"/performers/{ids['performer']}/charts.json"),
+        ("graph_data", "/data.json"),
+        ("graph_path", f"/path.json?from=producer-{ids['producer']}"
+                       f"&to=performer-{ids['typical_performer']}"),
+        ("producer_bubbles", "/producer_bubbles.json"),
+        ("producer_bubbles_years",
+         "/producer_bubbles.json?year_from=2000&year_to=2010"),
+    ]
+
+    for term in SEARCH_TERMS:
+        routes.append((f"search_{term}", f"/search_result?search_str={term}"))
+        routes.append((f"autocomplete_{term}", f"/autocomplete.json?q={term}"))
+
+    return routes
+
+
+def time_route(url, requests):
+    """Request url repeatedly; return per-request latencies and error count."""
+
+    client = app.test_client()
+    latencies = []
+    errors = 0
+
+    for _ in range(requests):
+        start_time = time.perf_counter()
+
+        try:
+            response = client.get(url)
+            failed = response.status_code >= 400
+            response.close()
+        except Exception:
+            failed = True
+
+        latencies.append(time.perf_counter() - start_time)
+        errors += failed
+
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    """Return the value at fraction (0-1) of the sorted values."""
+
+    ordered = sorted(values)
+
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def bench_route(url, requests, concurrency):
+    """Return latency and throughput statistics for one route."""
+
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda _: time_route(url, requests),
+            range(concurrency)
+        ))
+
+    elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for result, _ in results for latency in result]
+    errors = sum(errors for _, errors in results)
+
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "throughput_rps": len(latencies) / elapsed,
+    }
+
+
+def catalog_size():
+    """Return row counts for each table."""
+
+    return {model.__tablename__: model.query.count()
+            for model in (Producer, Performer, Song, Album, ProduceSong)}
+
+
+def git_revision():
+    """Return the current commit, if run from a git checkout."""
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change in p95 per route; return the routes that regressed."""
+
+    regressions = []
+
+    for name, stats in results["routes"].items():
+        before = baseline["routes"].get(name)
+
+        if not before:
+            continue
+
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        flag = ""
+
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        print(f"{name:28} p95 {before['p95_ms']:9.2f}ms -> "
+              f"{stats['p95_ms']:9.2f}ms ({change:+.0%}){flag}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default="postgresql:///music_bench")
+    parser.add_argument("--load", metavar="DIR",
+                        help="create the tables and bulk load DIR first")
+    parser.add_argument("--requests", type=int, default=20,
+                        help="requests per route per client")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="clients requesting each route at once")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p95 slowdown that counts as a regression")
+    parser.add_argument("--page-cache", action="store_true",
+                        help="serve repeated requests from the page cache")
+    args = parser.parse_args()
+
+    if not args.page_cache:
+        pages.size = 0
+
+    connect_to_db(app, args.db_uri)
+
+    if args.load:
+        import seed
+
+        db.create_all()
+        seed.bulk_load({
+            table_name: os.path.join(args.load, filename)
+            for table_name, filename in [("producers", "producers.txt"),
+                                         ("performers", "performers.txt"),
+                                         ("songs", "songs.txt"),
+                                         ("albums", "albums.txt"),
+                                         ("produce_songs", "events.txt")]
+        })
+        seed.publish_catalog()
+
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "database": db.engine.dialect.name,
+        "catalog": catalog_size(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "page_cache": args.page_cache,
+        "routes": {},
+    }
+
+    for name, url in build_routes(pick_ids()):
+        stats = bench_route(url, args.requests, args.concurrency)
+        results["routes"][name] = stats
+
+        print(f"{name:28} p50 {stats['p50_ms']:9.2f}ms  "
+              f"p95 {stats['p95_ms']:9.2f}ms  "
+              f"{stats['throughput_rps']:8.1f} req/s  "
+              f"errors {stats['errors']}")
+
+    with open(args.out, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
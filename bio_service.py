@@ -0,0 +1,268 @@
+"""Cached, non-blocking performer bios from the Genius API.
+
+Pages never wait on Genius.  BioService.get returns whatever bio is cached
+(an in-process LRU, backed by the performer_bios table) straight away, and
+if the bio is missing or older than BIO_TTL queues a refresh on a small
+thread pool: stale-while-revalidate.  A bio found missing is remembered
+for MISSING_BIO_TTL seconds, so views of it don't query the table and
+queue a refresh every time.  Refreshes time out after
+REQUEST_TIMEOUT, and after FAILURE_THRESHOLD failures in a row a circuit
+breaker stops calling Genius for BREAKER_COOLDOWN seconds.
+
+Set GENIUS_API_URL to point the service somewhere else, e.g. the stub server
+this module runs as a script:
+
+    python bio_service.py 8001
+    GENIUS_API_URL=http://localhost:8001/api python server.py
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from model import PerformerBio, db
+
+logger = logging.getLogger(__name__)
+
+GENIUS_API_URL = os.environ.get("GENIUS_API_URL", "https://genius.com/api")
+
+# Seconds a bio is served before it is refreshed in the background.
+BIO_TTL = 24 * 60 * 60
+
+# Seconds before a bio found missing is looked up (and fetched) again.
+MISSING_BIO_TTL = 60
+
+# Bios kept in memory per worker.
+LRU_SIZE = 2048
+
+# (connect, read) timeouts for calls to Genius, in seconds.
+REQUEST_TIMEOUT = (2, 5)
+
+# Threads refreshing bios per worker.
+REFRESH_WORKERS = 4
+
+# Failures in a row that open the circuit breaker, and seconds it stays open.
+FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache holding at most size items."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+
+            self._items.move_to_end(key)
+
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+class CircuitBreaker(object):
+    """Stops calls to a failing service until cooldown seconds have passed.
+
+    After threshold failures in a row the breaker opens; once cooldown has
+    passed one call is let through, and its result closes or reopens it.
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Half open: let this call through, and hold the rest back
+                # until it has succeeded or failed.
+                self.opened_at = time.monotonic()
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def fetch_bio(performer_id, api_url=GENIUS_API_URL):
+    """Return the performer's bio from Genius ("" if Genius has none).
+
+    Raises requests.RequestException if Genius can't be reached or errors.
+    """
+
+    response = requests.get(f"{api_url}/artists/{performer_id}",
+                            timeout=REQUEST_TIMEOUT)
+
+    # An unknown artist is an answer, not a failure.
+    if response.status_code == 404:
+        return ""
+
+    response.raise_for_status()
+    j = response.json()
+
+    # If the call is successful and the bio JSON key exists, return that key
+    # value (description_preview); otherwise, return an empty string.
+    if j.get("meta", {}).get("status") != 200:
+        return ""
+
+    return j["response"]["artist"].get("description_preview") or ""
+
+
+class BioService(object):
+    """Serves performer bios from cache, refreshing them in the background."""
+
+    def __init__(self, app, api_url=GENIUS_API_URL):
+        self.app = app
+        self.api_url = api_url
+        self.cache = LRUCache(LRU_SIZE)
+        self.breaker = CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def get(self, performer_id):
+        """Return the cached bio for performer_id ("" if none yet).
+
+        Never calls Genius; a missing or stale bio is refreshed in the
+        background for later requests.
+        """
+
+        cached = self.cache.get(performer_id)
+
+        # A missing bio is cached as (None, when it was found missing).
+        if cached is not None and cached[0] is None:
+            if time.monotonic() - cached[1] < MISSING_BIO_TTL:
+                return ""
+
+            cached = None
+
+        if cached is None:
+            row = db.session.query(
+                PerformerBio.bio, PerformerBio.fetched_at
+            ).filter(
+                PerformerBio.performer_id == performer_id
+            ).first()
+
+            if row is None:
+                self.cache.set(performer_id, (None, time.monotonic()))
+                self.refresh_in_background(performer_id)
+                return ""
+
+            cached = (row.bio, row.fetched_at)
+            self.cache.set(performer_id, cached)
+
+        bio, fetched_at = cached
+
+        if (datetime.datetime.now() - fetched_at).total_seconds() > BIO_TTL:
+            self.refresh_in_background(performer_id)
+
+        return bio
+
+    def refresh_in_background(self, performer_id):
+        """Queue a refresh of performer_id's bio, unless one is queued."""
+
+        with self._lock:
+            if performer_id in self._pending:
+                return
+            self._pending.add(performer_id)
+
+        self._executor.submit(self._refresh, performer_id)
+
+    def _refresh(self, performer_id):
+        try:
+            if not self.breaker.allow():
+                return
+
+            try:
+                bio = fetch_bio(performer_id, self.api_url)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self.breaker.record_failure()
+                logger.warning("Fetching bio for performer %s failed: %s",
+                               performer_id, e)
+                return
+
+            self.breaker.record_success()
+            self.store(performer_id, bio)
+        finally:
+            with self._lock:
+                self._pending.discard(performer_id)
+
+    def store(self, performer_id, bio):
+        """Cache bio in memory and in the performer_bios table."""
+
+        fetched_at = datetime.datetime.now()
+        self.cache.set(performer_id, (bio, fetched_at))
+
+        with self.app.app_context():
+            db.session.merge(PerformerBio(performer_id=performer_id, bio=bio,
+                                          fetched_at=fetched_at))
+            db.session.commit()
+            db.session.remove()
+
+
+if __name__ == "__main__":
+    # Serve canned Genius artist responses, for running the app offline.
+
+    import sys
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+
+    class StubGeniusHandler(BaseHTTPRequestHandler):
+        """Answers /api/artists/<id> with a placeholder bio."""
+
+        def do_GET(self):
+            artist_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = json.dumps({
+                "meta": {"status": 200},
+                "response": {"artist": {
+                    "id": artist_id,
+                    "description_preview": f"Stub bio for artist {artist_id}.",
+                }},
+            }).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"Stub Genius API on http://localhost:{port}/api")
+    HTTPServer(("", port), StubGeniusHandler).serve_forever()
@@ -0,0 +1,225 @@
+"""Per-producer activity behind /producer_bubbles.json.
+
+Every producer's number of songs, number of performers and active years are
+computed from produce_songs in one vectorised pass: the database reduces the
+events to distinct producer-song-year and producer-performer-year rows, which
+are streamed FETCH_ROWS at a time into integer arrays and counted with
+bincount.  The unfiltered totals are kept per worker until the
+catalog changes; year-filtered totals are recomputed from the distinct rows
+and the most recently used kept in a small cache, shared by a worker's
+threads under a lock.
+"""
+
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from model import Producer, ProduceSong, Song, db
+
+# Producers returned when the request doesn't say, and the most it may ask for.
+DEFAULT_TOP = 200
+MAX_TOP = 2000
+
+# Year-filtered totals kept per worker.
+FILTER_CACHE_SIZE = 32
+
+# Rows read from the database at a time.
+FETCH_ROWS = 10000
+
+
+class ProducerActivity(object):
+    """Song counts, performer counts and active years per producer.
+
+    producers is (ids, names) sorted by id; song_rows and performer_rows
+    are arrays of distinct (producer id, song id, release year or 0) and
+    (producer id, performer id, release year or 0) rows.
+    """
+
+    def __init__(self, producers, song_rows, performer_rows):
+        producer_ids, producer_names = producers
+
+        self.producer_ids = np.asarray(producer_ids, dtype=np.int64)
+        self.names = list(producer_names)
+
+        song_rows = np.asarray(song_rows, dtype=np.int64).reshape(-1, 3)
+        self.song_producers = np.searchsorted(self.producer_ids, song_rows[:, 0])
+        self.song_years = song_rows[:, 2]
+
+        performer_rows = np.asarray(performer_rows, dtype=np.int64).reshape(-1, 3)
+        self.performer_producers = np.searchsorted(self.producer_ids,
+                                                   performer_rows[:, 0])
+        self.performer_ids = performer_rows[:, 1]
+        self.performer_years = performer_rows[:, 2]
+
+        self.totals = self._totals(None, None)
+        self._filtered = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _totals(self, year_from, year_to):
+        """Return (song counts, performer counts, first years, last years)
+        per producer, counting songs released in [year_from, year_to].
+        """
+
+        count = len(self.producer_ids)
+
+        song_mask = self._year_mask(self.song_years, year_from, year_to)
+        song_counts = np.bincount(self.song_producers[song_mask], minlength=count)
+
+        performer_mask = self._year_mask(self.performer_years, year_from, year_to)
+        pairs = np.unique(np.stack([self.performer_producers[performer_mask],
+                                    self.performer_ids[performer_mask]], axis=1),
+                          axis=0)
+        performer_counts = np.bincount(pairs[:, 0], minlength=count)
+
+        # First and last known release year: sort by (producer, year) and
+        # take each producer's ends.
+        dated = song_mask & (self.song_years > 0)
+        producers, years = self.song_producers[dated], self.song_years[dated]
+        order = np.lexsort((years, producers))
+        producers, years = producers[order], years[order]
+
+        first_years = np.zeros(count, dtype=np.int64)
+        last_years = np.zeros(count, dtype=np.int64)
+        first_years[producers[::-1]] = years[::-1]
+        last_years[producers] = years
+
+        return song_counts, performer_counts, first_years, last_years
+
+    @staticmethod
+    def _year_mask(years, year_from, year_to):
+        mask = np.ones(len(years), dtype=bool)
+
+        if year_from is not None:
+            mask &= years >= year_from
+        if year_to is not None:
+            mask &= years <= year_to
+
+        return mask
+
+    def totals_for(self, year_from=None, year_to=None):
+        """Return _totals for a year range, cached."""
+
+        if year_from is None and year_to is None:
+            return self.totals
+
+        key = (year_from, year_to)
+
+        with self._lock:
+            totals = self._filtered.get(key)
+
+            if totals is not None:
+                self._filtered.move_to_end(key)
+                return totals
+
+        # Computed outside the lock; two threads may both compute a range.
+        totals = self._totals(year_from, year_to)
+
+        with self._lock:
+            self._filtered[key] = totals
+            self._filtered.move_to_end(key)
+
+            if len(self._filtered) > FILTER_CACHE_SIZE:
+                self._filtered.popitem(last=False)
+
+        return totals
+
+    def bubbles(self, top=DEFAULT_TOP, year_from=None, year_to=None):
+        """Return the d3 pack layout's root for the top producers by songs."""
+
+        top = min(max(top, 1), MAX_TOP)
+        song_counts, performer_counts, first_years, last_years = \
+            self.totals_for(year_from, year_to)
+
+        active = np.flatnonzero(song_counts > 0)
+
+        if len(active) > top:
+            active = active[np.argpartition(-song_counts[active], top - 1)[:top]]
+
+        active = active[np.lexsort((active, -song_counts[active]))]
+
+        # Colour by the decade the producer started in, whatever the filter,
+        # so a producer keeps its colour.
+        started = self.totals[2]
+        children = []
+
+        for position in active.tolist():
+            first_year = int(first_years[position]) or None
+            last_year = int(last_years[position]) or None
+
+            children.append({
+                "name": self.names[position],
+                "value": int(song_counts[position]),
+                "performers": int(performer_counts[position]),
+                "first_year": first_year,
+                "last_year": last_year,
+                "domain": f"{started[position] // 10 * 10}s"
+                          if started[position] else "unknown",
+                "link": f"/producers/{self.producer_ids[position]}",
+            })
+
+        return {
+            "name": "producers",
+            "children": children,
+            "total": int((song_counts > 0).sum()),
+        }
+
+
+def fetch_array(query, columns):
+    """Return query's rows of columns integers as an array, streamed from
+    the database FETCH_ROWS at a time rather than loaded as a list.
+    """
+
+    result = db.session.connection().execution_options(
+        stream_results=True
+    ).execute(query.statement)
+
+    rows = np.empty((FETCH_ROWS, columns), dtype=np.int64)
+    count = 0
+
+    while True:
+        batch = result.fetchmany(FETCH_ROWS)
+
+        if not batch:
+            break
+
+        if count + len(batch) > len(rows):
+            grown = np.empty((2 * len(rows), columns), dtype=np.int64)
+            grown[:count] = rows[:count]
+            rows = grown
+
+        rows[count:count + len(batch)] = np.fromiter(
+            itertools.chain.from_iterable(batch), dtype=np.int64,
+            count=len(batch) * columns
+        ).reshape(-1, columns)
+        count += len(batch)
+
+    return rows[:count]
+
+
+def load_producer_activity():
+    """Return the catalog's ProducerActivity."""
+
+    producers = db.session.query(
+        Producer.producer_id, Producer.producer_name
+    ).order_by(Producer.producer_id).all()
+
+    release_year = db.func.coalesce(Song.song_release_year, 0)
+
+    # A song has one release year, so each producer-song row has one too.
+    song_rows = db.session.query(
+        ProduceSong.producer_id, ProduceSong.song_id, release_year
+    ).join(
+        Song, Song.song_id == ProduceSong.song_id
+    ).distinct()
+
+    performer_rows = db.session.query(
+        ProduceSong.producer_id, ProduceSong.performer_id, release_year
+    ).join(
+        Song, Song.song_id == ProduceSong.song_id
+    ).distinct()
+
+    return ProducerActivity(tuple(zip(*producers)) or ((), ()),
+                            fetch_array(song_rows, 3),
+                            fetch_array(performer_rows, 3))
@@ -0,0 +1,84 @@
+"""Per-worker values built from the catalog, rebuilt when it changes.
+
+A CatalogCache holds whatever its load function returns (a graph, a set of
+aggregates) and rebuilds it when seed.py bumps the catalog version, which is
+checked at most every VERSION_CHECK_INTERVAL seconds.
+"""
+
+import threading
+import time
+
+from model import CatalogVersion, db
+
+# Seconds between checks of the catalog version.
+VERSION_CHECK_INTERVAL = 30
+
+
+class CatalogCache(object):
+    """Holds load()'s result for the current catalog version."""
+
+    def __init__(self, app, load):
+        self.app = app
+        self.load = load
+        self.value = None
+        self.version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Call load() and swap its result in."""
+
+        with self.app.app_context():
+            version = CatalogVersion.current()
+            value = self.load()
+            db.session.remove()
+
+        self.value, self.version = value, version
+        self._checked_at = time.monotonic()
+
+    def build_and_wait(self):
+        """Build on another thread and wait for it.
+
+        Scoped sessions are per thread, and build() removes its session when
+        done; run on a request's thread, that would detach the request's
+        objects.
+        """
+
+        errors = []
+
+        def build():
+            try:
+                self.build()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=build)
+        thread.start()
+        thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def refresh_if_stale(self):
+        """Rebuild if the catalog version has changed."""
+
+        if time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = time.monotonic()
+
+        if CatalogVersion.current() != self.version:
+            with self._lock:
+                self.build_and_wait()
+
+    def get(self):
+        """Return the current value, building it if needed."""
+
+        if self.value is None:
+            with self._lock:
+                if self.value is None:
+                    self.build_and_wait()
+        else:
+            self.refresh_if_stale()
+
+        return self.value
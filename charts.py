@@ -0,0 +1,162 @@
+"""Chart.js datasets for the producer and performer pages.
+
+Everything a page's charts need comes back from one id-addressed URL, so
+responses can be cached by URL.  The same data always gives the same bytes:
+each label's colour is derived from the label itself.  Responses carry an
+ETag and Last-Modified from the catalog version, and conditional requests
+for an unchanged catalog get a 304 without any chart queries.
+"""
+
+import hashlib
+
+from flask import current_app, jsonify, request
+from sqlalchemy import bindparam
+from werkzeug.http import is_resource_modified
+
+from model import CatalogVersion, Performer, Producer, ProducerPerformerCount
+from model import ProducerYearCount, bakery, db
+
+# Seconds browsers and proxies may reuse a chart response without asking.
+CHART_MAX_AGE = 300
+
+# Release years outside this range come from bad Genius data.
+FIRST_YEAR = 1900
+LAST_YEAR = 2019
+
+
+def label_color(label):
+    """Return an rgba() colour for label, the same every time."""
+
+    red, green, blue = hashlib.md5(label.encode("utf-8")).digest()[:3]
+
+    return f"rgba({red},{green},{blue},1)"
+
+
+def donut_chart(label_counts):
+    """Return Chart.js doughnut data for (label, count) pairs."""
+
+    return {
+        "labels": [label for label, count in label_counts],
+        "datasets": [
+            {
+                "data": [count for label, count in label_counts],
+                "backgroundColor": [label_color(label)
+                                    for label, count in label_counts],
+            }
+        ]
+    }
+
+
+def producer_frequency(producer_id):
+    """Return donut data of the producer's songs per performer."""
+
+    query = bakery(lambda session: session.query(
+        Performer.performer_name,
+        db.func.sum(ProducerPerformerCount.song_count)
+    ).join(
+        ProducerPerformerCount,
+        ProducerPerformerCount.performer_id == Performer.performer_id
+    ).filter(
+        ProducerPerformerCount.producer_id == bindparam("producer_id")
+    ).group_by(
+        Performer.performer_name
+    ).order_by(
+        Performer.performer_name
+    ))
+
+    return donut_chart(query(db.session()).params(producer_id=producer_id).all())
+
+
+def performer_frequency(performer_id):
+    """Return donut data of the performer's songs per producer."""
+
+    query = bakery(lambda session: session.query(
+        Producer.producer_name,
+        db.func.sum(ProducerPerformerCount.song_count)
+    ).join(
+        ProducerPerformerCount,
+        ProducerPerformerCount.producer_id == Producer.producer_id
+    ).filter(
+        ProducerPerformerCount.performer_id == bindparam("performer_id")
+    ).group_by(
+        Producer.producer_name
+    ).order_by(
+        Producer.producer_name
+    ))
+
+    return donut_chart(query(db.session()).params(performer_id=performer_id).all())
+
+
+def producer_productivity(producer_id):
+    """Return line chart data of the producer's songs per release year."""
+
+    query = bakery(lambda session: session.query(
+        ProducerYearCount.song_release_year, ProducerYearCount.song_count
+    ).filter(
+        ProducerYearCount.producer_id == bindparam("producer_id"),
+        ProducerYearCount.song_release_year > FIRST_YEAR,
+        ProducerYearCount.song_release_year < LAST_YEAR
+    ).order_by(
+        ProducerYearCount.song_release_year
+    ))
+
+    year_counts = query(db.session()).params(producer_id=producer_id).all()
+
+    return {
+        "labels": [year for year, count in year_counts],
+        "datasets": [
+            {
+                "label": "Number of Songs Produced",
+                "fill": True,
+                "lineTension": 0.5,
+                "backgroundColor": "rgba(0,255,0,0.1)",
+                "borderColor": "rgba(220,220,220,1)",
+                "borderCapStyle": 'butt',
+                "borderDash": [],
+                "borderDashOffset": 0.0,
+                "borderJoinStyle": 'miter',
+                "pointBorderColor": "rgba(220,220,220,1)",
+                "pointBackgroundColor": "green",
+                "pointBorderWidth": 1,
+                "pointHoverRadius": 5,
+                "pointHoverBackgroundColor": "green",
+                "pointHoverBorderColor": "rgba(220,220,220,1)",
+                "pointHoverBorderWidth": 2,
+                "pointRadius": 3,
+                "pointHitRadius": 10,
+                "data": [count for year, count in year_counts],
+                "spanGaps": False
+            }
+        ]
+    }
+
+
+def cached_json(key, make_data):
+    """Return make_data() as JSON, or 304 if the client's copy is current.
+
+    key names the resource (e.g. "producer-5-charts"); with the catalog
+    version it makes the ETag, so make_data only runs when the client has
+    no copy for this version.
+    """
+
+    catalog_version = bakery(
+        lambda session: session.query(CatalogVersion)
+    )(db.session()).get(1)
+    version = catalog_version.version if catalog_version else 0
+    last_modified = catalog_version.updated_at.replace(microsecond=0) \
+        if catalog_version else None
+
+    etag = f"{key}-v{version}"
+
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=last_modified):
+        response = jsonify(make_data())
+    else:
+        response = current_app.response_class(status=304)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = CHART_MAX_AGE
+
+    return response
@@ -0,0 +1,160 @@
+"""Fail if a hot query in server.py plans a sequential scan.
+
+Requests the pages and JSON endpoints below with the test client, records
+every SELECT they run and asks the database for each one's plan.  On
+Postgres, sequential scans are disabled while planning, so a Seq Scan in a
+plan means no index can serve the query, however small the tables are now.
+SQLite plans are checked for full table scans the same way.
+
+    $ python3 check_plans.py --db-uri postgresql:///music
+"""
+
+import argparse
+import re
+import sys
+
+from flask import has_request_context
+from sqlalchemy import event
+
+from model import Performer, Producer, Song, connect_to_db, db
+
+# Route name and URL template, filled in with an existing id of each type.
+HOT_ROUTES = [
+    ("producer_list", "/producers?page=2&per_page=20"),
+    ("producer_detail", "/producers/{producer_id}"),
+    ("producer_charts", "/producers/{producer_id}/charts.json"),
+    ("performer_list", "/performers?page=2&per_page=20"),
+    ("performer_detail", "/performers/{performer_id}"),
+    ("performer_charts", "/performers/{performer_id}/charts.json"),
+    ("song_list", "/songs?page=2&per_page=20"),
+    ("song_detail", "/songs/{song_id}"),
+    ("album_list", "/albums?page=2&per_page=20"),
+    ("search", "/search_result?search_str=the"),
+]
+
+# Substring search is served by the trigram indexes, which only Postgres has.
+POSTGRES_ONLY_ROUTES = {"search"}
+
+
+class StatementRecorder(object):
+    """Records the SELECTs run while handling requests."""
+
+    def __init__(self):
+        self.route = None
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        if has_request_context() and \
+                statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            self.statements.append((self.route, statement, parameters))
+
+
+def plan_seq_scans(connection, statement, parameters):
+    """Return the tables statement's plan reads with a sequential scan."""
+
+    cursor = connection.cursor()
+    tables = set(db.metadata.tables)
+
+    if db.engine.dialect.name == "postgresql":
+        cursor.execute("SET enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0][0]["Plan"]
+
+        scans = []
+        nodes = [plan]
+
+        while nodes:
+            node = nodes.pop()
+
+            if node["Node Type"] == "Seq Scan" and node["Relation Name"] in tables:
+                scans.append(node["Relation Name"])
+
+            nodes.extend(node.get("Plans", []))
+
+        return scans
+
+    cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+
+    scans = []
+
+    for row in cursor.fetchall():
+        match = re.match(r"SCAN (?:TABLE )?(\w+)", row[-1])
+
+        if match and match.group(1) in tables and "INDEX" not in row[-1]:
+            scans.append(match.group(1))
+
+    return scans
+
+
+def check_plans(app):
+    """Request every hot route; return [(route, table, statement)] for each
+    sequential scan planned.
+    """
+
+    ids = {
+        "producer_id": db.session.query(db.func.min(Producer.producer_id)).scalar(),
+        "performer_id": db.session.query(db.func.min(Performer.performer_id)).scalar(),
+        "song_id": db.session.query(db.func.min(Song.song_id)).scalar(),
+    }
+    db.session.remove()
+
+    recorder = StatementRecorder()
+    event.listen(db.engine, "before_cursor_execute", recorder)
+
+    client = app.test_client()
+
+    try:
+        for route, url in HOT_ROUTES:
+            if route in POSTGRES_ONLY_ROUTES and db.engine.dialect.name != "postgresql":
+                print(f"Skipping {route}: needs Postgres")
+                continue
+
+            recorder.route = route
+            response = client.get(url.format(**ids))
+
+            if response.status_code >= 400:
+                print(f"{route}: {url.format(**ids)} returned {response.status_code}")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", recorder)
+
+    scans = []
+    seen = set()
+    connection = db.engine.raw_connection()
+
+    try:
+        for route, statement, parameters in recorder.statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+
+            for table in plan_seq_scans(connection, statement, parameters):
+                scans.append((route, table, statement))
+    finally:
+        connection.rollback()
+        connection.close()
+
+    return scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default="postgresql:///music",
+                        help="database to check, with the catalog loaded")
+    args = parser.parse_args()
+
+    from server import app
+
+    connect_to_db(app, args.db_uri)
+
+    with app.app_context():
+        scans = check_plans(app)
+
+    for route, table, statement in scans:
+        print(f"{route}: sequential scan of {table} in")
+        print(f"    {' '.join(statement.split())[:300]}")
+
+    if scans:
+        sys.exit(1)
+
+    print("No sequential scans planned.")
@@ -0,0 +1,74 @@
+"""Fail if a hot route runs an N+1, queries from a template or goes over its
+query budget.
+
+Requests every route in check_plans.HOT_ROUTES with the test client and the
+query guard (query_guard.py) raising, and reports each route that fails.
+
+    $ python3 check_queries.py --db-uri postgresql:///music
+"""
+
+import argparse
+import sys
+
+from check_plans import HOT_ROUTES
+from model import Performer, Producer, Song, connect_to_db, db
+from query_guard import QueryGuardError, init_query_guard
+
+
+def check_queries(app):
+    """Request every hot route; return [(route, problem)] for each failure."""
+
+    ids = {
+        "producer_id": db.session.query(db.func.min(Producer.producer_id)).scalar(),
+        "performer_id": db.session.query(db.func.min(Performer.performer_id)).scalar(),
+        "song_id": db.session.query(db.func.min(Song.song_id)).scalar(),
+    }
+    db.session.remove()
+
+    if not app.config.get("QUERY_GUARD"):
+        init_query_guard(app, "raise")
+
+    app.config["QUERY_GUARD"] = "raise"
+    app.testing = True
+
+    client = app.test_client()
+    failures = []
+
+    for route, url in HOT_ROUTES:
+        try:
+            response = client.get(url.format(**ids))
+        except QueryGuardError as e:
+            failures.append((route, str(e)))
+            continue
+        except Exception as e:
+            failures.append((route, f"{url.format(**ids)} raised "
+                                    f"{type(e).__name__}: {e}"))
+            continue
+
+        if response.status_code >= 400:
+            failures.append((route, f"{url.format(**ids)} returned "
+                                    f"{response.status_code}"))
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default="postgresql:///music",
+                        help="database to check, with the catalog loaded")
+    args = parser.parse_args()
+
+    from server import app
+
+    connect_to_db(app, args.db_uri)
+
+    with app.app_context():
+        failures = check_queries(app)
+
+    for route, problem in failures:
+        print(f"{route}: {problem}")
+
+    if failures:
+        sys.exit(1)
+
+    print(f"All {len(HOT_ROUTES)} routes within their query budgets.")
@@ -0,0 +1,269 @@
+"""Engine settings from the environment, and reads routed to replicas.
+
+connect_to_db() in model.py configures every engine with the pool settings
+below, each read from an environment variable:
+
+    DATABASE_URL            primary database (postgresql:///music)
+    DB_POOL_SIZE            connections kept open per process (5)
+    DB_MAX_OVERFLOW         extra connections allowed under load (10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (30)
+    DB_POOL_RECYCLE         seconds before a connection is replaced (1800)
+    DB_PRE_PING             test connections as they're checked out (1)
+    DB_CONNECT_TIMEOUT      seconds to wait for a new connection (10)
+    DB_STATEMENT_TIMEOUT    milliseconds a statement may run, 0 for no
+                            limit (0); Postgres only
+
+Given replica URIs (wsgi.py passes DATABASE_REPLICA_URLS, comma-separated),
+sessions send SELECTs to a replica and everything else to the primary.  A
+session sticks to one replica until its transaction ends, and once it has
+written anything it reads from the primary too, so it sees its own writes.
+Replicas are health-checked with SELECT 1 every REPLICA_CHECK_INTERVAL
+seconds, on a thread of its own so no request waits on a check, and take
+reads once they've passed their first check; with none up, reads go to the
+primary.
+
+Pool settings don't apply to SQLite, whose pool has no size; demo_replicas.py
+tries out the routing with SQLite files as the primary and replicas.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import CompoundSelect, Select
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql:///music")
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_PRE_PING = os.environ.get("DB_PRE_PING", "1") == "1"
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 10))
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+
+# Seconds between health checks of each replica, and before a replica that
+# failed one is tried again.
+REPLICA_CHECK_INTERVAL = 10
+
+
+def engine_options(drivername):
+    """Return create_engine() keyword arguments for a database driver."""
+
+    options = {"pool_pre_ping": DB_PRE_PING}
+
+    if drivername.startswith("sqlite"):
+        return options
+
+    options.update({
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    })
+
+    if drivername.startswith("postgresql"):
+        connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+
+        if DB_STATEMENT_TIMEOUT:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+
+        options["connect_args"] = connect_args
+
+    return options
+
+
+class Replica(object):
+    """One read replica: its bind key, whether it passed its last check
+    (None before the first), and whether a check is running.
+    """
+
+    def __init__(self, bind_key):
+        self.bind_key = bind_key
+        self.healthy = None
+        self.checking = False
+        self.checked_at = 0
+
+
+class ReplicaSet(object):
+    """The app's read replicas, handed out in turn while they're healthy."""
+
+    def __init__(self, db, app, bind_keys):
+        self.db = db
+        self.app = app
+        self.replicas = [Replica(bind_key) for bind_key in bind_keys]
+        self._turns = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+
+    def engine(self, replica):
+        return self.db.get_engine(self.app, bind=replica.bind_key)
+
+    def check(self, replica):
+        """Run SELECT 1 on replica and record whether it worked.
+
+        Runs on a thread started by choose(), which claimed the check.
+        """
+
+        error = None
+
+        try:
+            with self.engine(replica).connect() as connection:
+                connection.execute("SELECT 1")
+        except Exception as e:
+            error = e
+
+        with self._lock:
+            if error is not None and replica.healthy is not False:
+                logger.warning("Replica %s is down: %s", replica.bind_key, error)
+            elif error is None and replica.healthy is False:
+                logger.warning("Replica %s is back up", replica.bind_key)
+
+            replica.healthy = error is None
+            replica.checking = False
+            replica.checked_at = time.monotonic()
+
+    def mark_down(self, engine):
+        """Stop reading from the replica using engine until its next check."""
+
+        for replica in self.replicas:
+            if self.engine(replica) is not engine:
+                continue
+
+            with self._lock:
+                if replica.healthy:
+                    logger.warning("Replica %s lost its connection",
+                                   replica.bind_key)
+                    replica.healthy = False
+                    replica.checked_at = time.monotonic()
+
+    def choose(self):
+        """Return the next healthy replica's engine, or None if none are up.
+
+        Replicas due a check get one in the background; until it finishes,
+        they're used (or skipped) as their last check found them.
+        """
+
+        chosen = None
+        due = []
+
+        with self._lock:
+            now = time.monotonic()
+
+            for _ in range(len(self.replicas)):
+                replica = next(self._turns)
+
+                # Claimed under the lock, so only one request starts it.
+                if not replica.checking and \
+                        now - replica.checked_at >= REPLICA_CHECK_INTERVAL:
+                    replica.checking = True
+                    due.append(replica)
+
+                if replica.healthy:
+                    chosen = replica
+                    break
+
+        for replica in due:
+            threading.Thread(target=self.check, args=(replica,),
+                             daemon=True).start()
+
+        return None if chosen is None else self.engine(chosen)
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to a replica and writes to the primary."""
+
+    def __init__(self, db, **options):
+        self._replica_engine = None
+        self._wrote = False
+
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get("db_replicas")
+
+        if replicas is None or self._flushing or self._wrote:
+            return SignallingSession.get_bind(self, mapper, clause)
+
+        is_read = isinstance(clause, (Select, CompoundSelect)) and \
+            getattr(clause, "_for_update_arg", None) is None
+
+        if not is_read:
+            # Anything but a plain SELECT may write.
+            if clause is not None:
+                self._wrote = True
+
+            return SignallingSession.get_bind(self, mapper, clause)
+
+        if self._replica_engine is None:
+            self._replica_engine = replicas.choose()
+
+        return self._replica_engine or SignallingSession.get_bind(self, mapper,
+                                                                  clause)
+
+    def reset_routing(self):
+        """Let the next transaction pick a replica afresh."""
+
+        self._replica_engine = None
+        self._wrote = False
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def after_flush(session, flush_context):
+    session._wrote = True
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.reset_routing()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with environment-driven engine settings and
+    RoutingSession.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        result = SQLAlchemy.apply_driver_hacks(self, app, info, options)
+
+        for key, value in engine_options(info.drivername).items():
+            options.setdefault(key, value)
+
+        return result
+
+    def init_replicas(self, app, replica_uris):
+        """Route the app's reads to replica_uris (none turns routing off)."""
+
+        bind_keys = [f"replica_{number}" for number in range(len(replica_uris))]
+
+        binds = {key: uri
+                 for key, uri in (app.config.get("SQLALCHEMY_BINDS") or {}).items()
+                 if not key.startswith("replica_")}
+        binds.update(zip(bind_keys, replica_uris))
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+        if not replica_uris:
+            app.extensions.pop("db_replicas", None)
+            return
+
+        replicas = ReplicaSet(self, app, bind_keys)
+        app.extensions["db_replicas"] = replicas
+
+        # A dropped replica connection takes the replica out of rotation.
+        for replica in replicas.replicas:
+            engine = replicas.engine(replica)
+
+            def handle_error(context, replicas=replicas, engine=engine):
+                if context.is_disconnect:
+                    replicas.mark_down(engine)
+
+            event.listen(engine, "handle_error", handle_error)
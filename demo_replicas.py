@@ -0,0 +1,80 @@
+"""Show reads routed to replicas (db_routing.py), with SQLite files standing
+in for the primary and a replica.
+
+Each file's producers table holds one producer named after the database, so
+each read shows which database answered it.  A second replica, in a
+directory that doesn't exist, stays down throughout.
+
+    $ python3 demo_replicas.py
+"""
+
+import os
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import create_engine
+
+from model import Producer, connect_to_db, db
+
+
+def make_database(path, name):
+    """Create a SQLite file at path holding one producer called name."""
+
+    engine = create_engine(f"sqlite:///{path}")
+    Producer.__table__.create(engine)
+    engine.execute(Producer.__table__.insert(), producer_id=1,
+                   producer_name=name)
+    engine.dispose()
+
+
+def read():
+    """Return the name of the database the session reads from."""
+
+    return db.session.query(Producer.producer_name).filter_by(producer_id=1).scalar()
+
+
+def wait_for_checks(replicas):
+    """Wait for the replicas' running health checks to finish."""
+
+    while any(replica.checking for replica in replicas.replicas):
+        time.sleep(0.01)
+
+
+def demo(directory):
+    primary_path = os.path.join(directory, "primary.db")
+    replica_path = os.path.join(directory, "replica.db")
+    make_database(primary_path, "primary")
+    make_database(replica_path, "replica")
+
+    app = Flask(__name__)
+    connect_to_db(app, f"sqlite:///{primary_path}", [
+        f"sqlite:///{replica_path}",
+        f"sqlite:///{os.path.join(directory, 'missing', 'replica.db')}",
+    ])
+    replicas = app.extensions["db_replicas"]
+
+    with app.app_context():
+        print(f"Before any health check: read from {read()}")
+        db.session.commit()
+
+        wait_for_checks(replicas)
+        for replica in replicas.replicas:
+            print(f"{replica.bind_key}: {'up' if replica.healthy else 'down'}")
+
+        for turn in range(3):
+            print(f"Read {turn + 1}: read from {read()}")
+            db.session.commit()
+
+        db.session.add(Producer(producer_id=2, producer_name="written"))
+        db.session.flush()
+        print(f"After a write in the transaction: read from {read()}")
+        db.session.rollback()
+
+        print(f"In the next transaction: read from {read()}")
+        db.session.remove()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        demo(directory)
@@ -0,0 +1,197 @@
+"""Generate a synthetic catalog in seed_data format.
+
+Writes producers.txt, performers.txt, songs.txt, albums.txt and events.txt at
+whatever size is asked for, so the app can be loaded and benchmarked at real
+scale.  Popularity is Zipf distributed: a few producers and performers account
+for most songs, and most have only a handful, as in the Genius data.
+
+    $ python3 generate_catalog.py --producers 10000 --performers 20000 \\
+          --songs 2000000 --albums 150000 --events 5000000 --out bench_data
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+# Words for names and titles, so that search terms hit realistic numbers of
+# rows.
+SYLLABLES = ["ba", "ko", "ri", "zo", "ne", "ta", "lu", "mi", "sha", "dre",
+             "kay", "von", "el", "jo", "qua", "yo", "fi", "ra", "den", "mo"]
+
+WORDS = ["love", "night", "money", "dream", "fire", "city", "heart", "gold",
+         "rain", "summer", "street", "crazy", "blue", "forever", "home",
+         "lights", "party", "gone", "young", "wild", "sky", "time", "run",
+         "real", "star", "ocean", "high", "slow", "dance", "stay"]
+
+# Rows written per chunk.
+CHUNK_SIZE = 100000
+
+
+def zipf_choice(rng, n, size, exponent):
+    """Return size indexes into range(n), Zipf distributed by rank."""
+
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    weights /= weights.sum()
+
+    return rng.choice(n, size=size, p=weights)
+
+
+def make_name(rng, syllables=(2, 4)):
+    """Return a made-up artist name."""
+
+    words = []
+
+    for _ in range(rng.randint(1, 3)):
+        count = rng.randint(syllables[0], syllables[1] + 1)
+        words.append("".join(rng.choice(SYLLABLES, size=count)).capitalize())
+
+    return " ".join(words)
+
+
+def make_title(rng):
+    """Return a made-up song or album title."""
+
+    count = rng.randint(1, 5)
+
+    return " ".join(rng.choice(WORDS, size=count)).capitalize()
+
+
+def release_years(rng, size):
+    """Return release years between 1960 and 2019, weighted to recent years."""
+
+    return 2019 - np.minimum(rng.exponential(12, size=size).astype(int), 59)
+
+
+def write_producers(path, rng, count):
+    with open(path, "w") as producer_file:
+        for producer_id in range(1, count + 1):
+            producer_file.write(
+                f"{producer_id}|{make_name(rng)}|"
+                f"https://images.example.com/producers/{producer_id}.jpg|\n"
+            )
+
+
+def write_performers(path, rng, count):
+    with open(path, "w") as performer_file:
+        for performer_id in range(1, count + 1):
+            performer_file.write(
+                f"{performer_id}|{make_name(rng)}|"
+                f"https://images.example.com/performers/{performer_id}.jpg\n"
+            )
+
+
+def write_albums(path, rng, count):
+    """Write albums; return each album's release year."""
+
+    years = release_years(rng, count)
+    months = rng.randint(1, 13, size=count)
+    days = rng.randint(1, 29, size=count)
+
+    with open(path, "w") as album_file:
+        for i in range(count):
+            album_file.write(
+                f"{i + 1}|{make_title(rng)}|"
+                f"https://images.example.com/albums/{i + 1}.jpg|"
+                f"{years[i]}|{months[i]}|{days[i]}\n"
+            )
+
+    return years
+
+
+def write_songs(path, rng, count, album_years, song_albums):
+    """Write songs; singles get their own release year."""
+
+    years = release_years(rng, count)
+    has_album = song_albums > 0
+    years[has_album] = album_years[song_albums[has_album] - 1]
+    months = rng.randint(1, 13, size=count)
+    days = rng.randint(1, 29, size=count)
+
+    # A small share of rows carry the Genius API's missing date values.
+    missing = rng.random_sample(count) < 0.02
+
+    with open(path, "w") as song_file:
+        for i in range(count):
+            if missing[i]:
+                date_fields = "None|None|None|None"
+            else:
+                date_fields = (f"{years[i]}-{months[i]:02d}-{days[i]:02d}|"
+                               f"{years[i]}|{months[i]}|{days[i]}")
+
+            song_file.write(f"{i + 1}|{make_title(rng)}|{date_fields}|\n")
+
+
+def write_events(path, rng, events, song_count, producer_count,
+                 song_performers, song_albums, exponent):
+    """Write produce_songs events.
+
+    Every song gets at least one producer (while events last); the rest go to
+    Zipf-popular songs, so hits end up with many producers.
+    """
+
+    with open(path, "w") as event_file:
+        for start in range(0, events, CHUNK_SIZE):
+            size = min(CHUNK_SIZE, events - start)
+
+            songs = np.arange(start, start + size)
+            extra = songs >= song_count
+            songs[extra] = zipf_choice(rng, song_count, int(extra.sum()),
+                                       exponent)
+            producers = zipf_choice(rng, producer_count, size, exponent) + 1
+
+            lines = []
+
+            for producer, song in zip(producers, songs):
+                album = song_albums[song]
+                lines.append(f"{producer}|{song_performers[song]}|{song + 1}|"
+                             f"{album if album else ''}\n")
+
+            event_file.writelines(lines)
+
+
+def generate(out_dir, producers, performers, songs, albums, events,
+             exponent=1.1, seed=0, album_share=0.7):
+    """Write a complete synthetic catalog to out_dir."""
+
+    rng = np.random.RandomState(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    write_producers(os.path.join(out_dir, "producers.txt"), rng, producers)
+    write_performers(os.path.join(out_dir, "performers.txt"), rng, performers)
+
+    album_years = write_albums(os.path.join(out_dir, "albums.txt"), rng, albums)
+
+    # Albums belong to one performer; songs on an album share its performer,
+    # singles get their own.
+    album_performers = zipf_choice(rng, performers, albums, exponent) + 1
+
+    song_albums = np.where(rng.random_sample(songs) < album_share,
+                           zipf_choice(rng, albums, songs, 0.6) + 1, 0)
+    song_performers = zipf_choice(rng, performers, songs, exponent) + 1
+    on_album = song_albums > 0
+    song_performers[on_album] = album_performers[song_albums[on_album] - 1]
+
+    write_songs(os.path.join(out_dir, "songs.txt"), rng, songs, album_years,
+                song_albums)
+    write_events(os.path.join(out_dir, "events.txt"), rng, events, songs,
+                 producers, song_performers, song_albums, exponent)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--producers", type=int, default=10000)
+    parser.add_argument("--performers", type=int, default=20000)
+    parser.add_argument("--songs", type=int, default=200000)
+    parser.add_argument("--albums", type=int, default=20000)
+    parser.add_argument("--events", type=int, default=500000)
+    parser.add_argument("--exponent", type=float, default=1.1,
+                        help="Zipf exponent for producer/performer popularity")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_data")
+    args = parser.parse_args()
+
+    generate(args.out, args.producers, args.performers, args.songs,
+             args.albums, args.events, args.exponent, args.seed)
+
+    print(f"Wrote catalog to {args.out}/")
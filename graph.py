@@ -0,0 +1,502 @@
+"""In-memory producer-performer collaboration graph behind /data.json.
+
+Producers and performers are nodes; a producer and a performer share an
+edge if the producer worked on one of the performer's songs, weighted by
+the number of such events.  The graph is built straight from produce_songs
+(aggregated per producer, performer and release year by the database) into
+CSR arrays: a node's neighbours are indices[indptr[node]:indptr[node + 1]],
+heaviest edge first, and edge_pairs maps each entry back to its
+producer-performer pair.  Year filters reweight pairs from the per-year
+counts with one bincount.
+
+Subgraphs (an ego network, or the top nodes by weighted degree) are cut to
+at most max_nodes nodes and max_edges edges, so /data.json stays small
+however large the catalog is.
+
+shortest_path() finds how two producers or performers are connected with a
+bidirectional breadth-first search, always expanding the side whose frontier
+has fewer edges, within hop and time limits.
+
+Each worker builds the graph once per catalog version, with a CatalogCache.
+"""
+
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from model import Performer, Producer, ProduceSong, Song, db
+
+NODE_TYPES = ("producer", "performer")
+
+# Nodes and edges returned when the request doesn't say, and the most it may
+# ask for.
+DEFAULT_NODES = 100
+DEFAULT_EDGES = 500
+MAX_NODES = 500
+MAX_EDGES = 2000
+
+# Furthest an ego network reaches from its centre.
+MAX_DEPTH = 2
+
+# Longest path searched for by default and at most, and the seconds a path
+# search may take.
+DEFAULT_HOPS = 6
+MAX_HOPS = 8
+PATH_TIME_LIMIT = 0.05
+
+# Songs listed for each step of a path.
+SONGS_PER_LINK = 3
+
+
+class CollaborationGraph(object):
+    """CSR adjacency over producers and performers.
+
+    producers and performers are (ids, names) sorted by id.  events are
+    arrays of (producer id, performer id, release year or 0, event count).
+    """
+
+    def __init__(self, producers, performers, events):
+        producer_ids, producer_names = producers
+        performer_ids, performer_names = performers
+
+        self.producer_ids = np.asarray(producer_ids, dtype=np.int64)
+        self.performer_ids = np.asarray(performer_ids, dtype=np.int64)
+        self.names = list(producer_names) + list(performer_names)
+
+        # Producers are nodes 0..P-1, performers P..P+Q-1.
+        self.producer_count = len(self.producer_ids)
+        self.node_count = self.producer_count + len(self.performer_ids)
+
+        event_producers, event_performers, years, counts = events
+
+        sources = np.searchsorted(self.producer_ids, event_producers)
+        targets = self.producer_count + np.searchsorted(self.performer_ids,
+                                                        event_performers)
+
+        # One pair per producer and performer, with its per-year counts.
+        pair_keys, self.year_pairs = np.unique(
+            sources * self.node_count + targets, return_inverse=True
+        )
+        self.year_pairs = self.year_pairs.ravel()
+        self.years = np.asarray(years, dtype=np.int64)
+        self.year_counts = np.asarray(counts, dtype=np.int64)
+
+        self.pair_sources = pair_keys // self.node_count
+        self.pair_targets = pair_keys % self.node_count
+        self.pair_weights = np.bincount(self.year_pairs, weights=self.year_counts,
+                                        minlength=len(pair_keys))
+
+        # Both directions of every pair, grouped by node, heaviest first.
+        ends = np.concatenate([self.pair_sources, self.pair_targets])
+        others = np.concatenate([self.pair_targets, self.pair_sources])
+        pairs = np.concatenate([np.arange(len(pair_keys))] * 2)
+        order = np.lexsort((others, -self.pair_weights[pairs], ends))
+
+        self.indptr = np.concatenate([
+            [0], np.cumsum(np.bincount(ends, minlength=self.node_count))
+        ]).astype(np.int64)
+        self.indices = others[order]
+        self.edge_pairs = pairs[order]
+
+    @property
+    def edge_count(self):
+        return len(self.pair_weights)
+
+    def node(self, node_type, entity_id):
+        """Return the node for a producer or performer id, or None."""
+
+        ids, offset = ((self.producer_ids, 0) if node_type == "producer"
+                       else (self.performer_ids, self.producer_count))
+
+        position = np.searchsorted(ids, entity_id)
+
+        if position < len(ids) and ids[position] == entity_id:
+            return offset + int(position)
+
+        return None
+
+    def node_type(self, node):
+        return "producer" if node < self.producer_count else "performer"
+
+    def entity_id(self, node):
+        if node < self.producer_count:
+            return int(self.producer_ids[node])
+
+        return int(self.performer_ids[node - self.producer_count])
+
+    def weights(self, year_from=None, year_to=None):
+        """Return every pair's event count, counting only songs released
+        in [year_from, year_to] if either is given.
+        """
+
+        if year_from is None and year_to is None:
+            return self.pair_weights
+
+        mask = self.years > 0
+
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= self.years <= year_to
+
+        return np.bincount(self.year_pairs[mask], weights=self.year_counts[mask],
+                           minlength=self.edge_count)
+
+    def row_entries(self, nodes):
+        """Return (CSR entries, the node each belongs to) for nodes' edges."""
+
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        lengths = ends - starts
+
+        entries = (np.repeat(starts - np.cumsum(lengths) + lengths, lengths) +
+                   np.arange(lengths.sum()))
+
+        return entries, np.repeat(nodes, lengths)
+
+    def neighbours(self, node, weights):
+        """Return (neighbour nodes, edge weights), heaviest first."""
+
+        start, end = self.indptr[node], self.indptr[node + 1]
+        edge_weights = weights[self.edge_pairs[start:end]]
+        neighbours = self.indices[start:end]
+
+        if weights is not self.pair_weights:
+            order = np.argsort(-edge_weights, kind="stable")
+            neighbours, edge_weights = neighbours[order], edge_weights[order]
+
+        active = edge_weights > 0
+
+        return neighbours[active], edge_weights[active]
+
+    def degrees(self, weights):
+        """Return every node's weighted degree."""
+
+        return (np.bincount(self.pair_sources, weights=weights,
+                            minlength=self.node_count) +
+                np.bincount(self.pair_targets, weights=weights,
+                            minlength=self.node_count))
+
+    def ego_nodes(self, centre, depth, max_nodes, weights):
+        """Return up to max_nodes nodes within depth hops of centre, closest
+        and most heavily connected first, and whether any were left out.
+        """
+
+        nodes = [centre]
+        seen = {centre}
+        frontier = [centre]
+
+        for _ in range(min(depth, MAX_DEPTH)):
+            next_frontier = []
+
+            for node in frontier:
+                for neighbour in self.neighbours(node, weights)[0]:
+                    neighbour = int(neighbour)
+
+                    if neighbour in seen:
+                        continue
+
+                    if len(nodes) >= max_nodes:
+                        return nodes, True
+
+                    seen.add(neighbour)
+                    nodes.append(neighbour)
+                    next_frontier.append(neighbour)
+
+            frontier = next_frontier
+
+        return nodes, False
+
+    def top_nodes(self, max_nodes, weights, node_type=None):
+        """Return the max_nodes nodes with the highest weighted degree, and
+        whether any were left out.
+        """
+
+        degrees = self.degrees(weights)
+
+        if node_type == "producer":
+            degrees[self.producer_count:] = 0
+        elif node_type == "performer":
+            degrees[:self.producer_count] = 0
+
+        candidates = np.flatnonzero(degrees > 0)
+        truncated = len(candidates) > max_nodes
+
+        if truncated:
+            top = np.argpartition(-degrees[candidates], max_nodes - 1)[:max_nodes]
+            candidates = candidates[top]
+
+        nodes = candidates[np.lexsort((candidates, -degrees[candidates]))]
+
+        return [int(node) for node in nodes], truncated
+
+    def subgraph_edges(self, nodes, max_edges, weights):
+        """Return (source, target, weight) for the heaviest max_edges edges
+        between nodes.
+        """
+
+        selected = np.zeros(self.node_count, dtype=bool)
+        selected[nodes] = True
+
+        # Every node's producer-side edges: each pair is seen once.
+        producers = np.array([node for node in nodes
+                              if node < self.producer_count], dtype=np.int64)
+        entries, sources = self.row_entries(producers)
+        targets = self.indices[entries]
+        edge_weights = weights[self.edge_pairs[entries]]
+
+        keep = selected[targets] & (edge_weights > 0)
+        sources, targets, edge_weights = (sources[keep], targets[keep],
+                                          edge_weights[keep])
+
+        if len(edge_weights) > max_edges:
+            top = np.argsort(-edge_weights, kind="stable")[:max_edges]
+            sources, targets, edge_weights = (sources[top], targets[top],
+                                              edge_weights[top])
+
+        return list(zip(sources.tolist(), targets.tolist(),
+                        edge_weights.astype(np.int64).tolist()))
+
+    def node_json(self, node):
+        """Return a node's id ("producer-5"), name, type and page."""
+
+        return {
+            "id": f"{self.node_type(node)}-{self.entity_id(node)}",
+            "name": self.names[node],
+            "parent": self.node_type(node),
+            "link": f"/{self.node_type(node)}s/{self.entity_id(node)}",
+        }
+
+    def parse_node(self, node_id):
+        """Return the node for an id like "producer-5", or None."""
+
+        node_type, _, entity_id = node_id.partition("-")
+
+        if node_type not in NODE_TYPES or not entity_id.isdigit():
+            return None
+
+        return self.node(node_type, int(entity_id))
+
+    def to_json(self, nodes, edges, truncated):
+        """Return the D3 {"nodes": [...], "paths": [...]} for a subgraph.
+
+        Paths refer to nodes by their position in the nodes list.
+        """
+
+        positions = {node: i for i, node in enumerate(nodes)}
+
+        return {
+            "nodes": [self.node_json(node) for node in nodes],
+            "paths": [
+                {"source": positions[source], "target": positions[target],
+                 "value": weight}
+                for source, target, weight in edges
+            ],
+            "truncated": truncated,
+        }
+
+    def shortest_path(self, source, target, max_hops=DEFAULT_HOPS,
+                      time_limit=PATH_TIME_LIMIT):
+        """Return (nodes on a shortest path from source to target, reason).
+
+        The path is None if there is none within max_hops hops, with reason
+        "no path" or "timed out" (if the search ran past time_limit
+        seconds).
+        """
+
+        if source == target:
+            return [source], None
+
+        deadline = time.perf_counter() + time_limit
+
+        # Each side's parent of every node reached: -2 unreached, -1 root.
+        parents = [np.full(self.node_count, -2, dtype=np.int64),
+                   np.full(self.node_count, -2, dtype=np.int64)]
+        parents[0][source] = -1
+        parents[1][target] = -1
+        frontiers = [np.array([source]), np.array([target])]
+
+        for _ in range(min(max_hops, MAX_HOPS)):
+            if time.perf_counter() > deadline:
+                return None, "timed out"
+
+            # Expand whichever side has fewer edges to follow.
+            sizes = [(self.indptr[frontier + 1] - self.indptr[frontier]).sum()
+                     for frontier in frontiers]
+            side = 0 if sizes[0] <= sizes[1] else 1
+
+            entries, sources = self.row_entries(frontiers[side])
+            reached = self.indices[entries]
+
+            new = parents[side][reached] == -2
+            reached, first = np.unique(reached[new], return_index=True)
+            parents[side][reached] = sources[new][first]
+
+            met = reached[parents[1 - side][reached] != -2]
+
+            if len(met):
+                meeting = int(met[0])
+                path = []
+
+                node = meeting
+                while node != -1:
+                    path.append(node)
+                    node = int(parents[0][node])
+
+                path.reverse()
+
+                node = int(parents[1][meeting])
+                while node != -1:
+                    path.append(node)
+                    node = int(parents[1][node])
+
+                return path, None
+
+            if not len(reached):
+                return None, "no path"
+
+            frontiers[side] = reached
+
+        return None, "no path"
+
+    def subgraph(self, centre=None, depth=1, max_nodes=DEFAULT_NODES,
+                 max_edges=DEFAULT_EDGES, year_from=None, year_to=None,
+                 node_type=None):
+        """Return D3 JSON for centre's ego network, or for the top nodes by
+        weighted degree if centre is None.
+        """
+
+        max_nodes = min(max(max_nodes, 1), MAX_NODES)
+        max_edges = min(max(max_edges, 0), MAX_EDGES)
+        weights = self.weights(year_from, year_to)
+
+        if centre is None:
+            nodes, truncated = self.top_nodes(max_nodes, weights, node_type)
+        else:
+            nodes, truncated = self.ego_nodes(centre, depth, max_nodes, weights)
+
+        edges = self.subgraph_edges(nodes, max_edges + 1, weights)
+        truncated = truncated or len(edges) > max_edges
+
+        return self.to_json(nodes, edges[:max_edges], truncated)
+
+
+def linking_songs(pairs, limit=SONGS_PER_LINK):
+    """Return {(producer id, performer id): [(song id, song title)]} with up
+    to limit songs for each pair.
+    """
+
+    if not pairs:
+        return {}
+
+    pair_songs = db.session.query(
+        ProduceSong.producer_id,
+        ProduceSong.performer_id,
+        Song.song_id,
+        Song.song_title
+    ).join(
+        Song, Song.song_id == ProduceSong.song_id
+    ).filter(
+        db.or_(*[db.and_(ProduceSong.producer_id == producer_id,
+                         ProduceSong.performer_id == performer_id)
+                 for producer_id, performer_id in pairs])
+    ).distinct().subquery()
+
+    # Number each pair's songs, so the database returns just limit of them.
+    numbered = db.session.query(
+        pair_songs,
+        db.func.row_number().over(
+            partition_by=(pair_songs.c.producer_id, pair_songs.c.performer_id),
+            order_by=(pair_songs.c.song_title, pair_songs.c.song_id)
+        ).label("song_number")
+    ).subquery()
+
+    songs = db.session.query(
+        numbered.c.producer_id,
+        numbered.c.performer_id,
+        numbered.c.song_id,
+        numbered.c.song_title
+    ).filter(
+        numbered.c.song_number <= limit
+    ).order_by(
+        numbered.c.song_title, numbered.c.song_id
+    ).all()
+
+    linked = defaultdict(list)
+
+    for producer_id, performer_id, song_id, song_title in songs:
+        linked[producer_id, performer_id].append((song_id, song_title))
+
+    return linked
+
+
+def path_json(graph, path, reason):
+    """Return /path.json's response for a path from shortest_path."""
+
+    if path is None:
+        return {"found": False, "reason": reason, "path": [], "links": []}
+
+    pairs = []
+
+    for source, target in zip(path, path[1:]):
+        producer, performer = sorted((source, target))
+        pairs.append((graph.entity_id(producer), graph.entity_id(performer)))
+
+    songs = linking_songs(pairs)
+    weights = graph.pair_weights
+
+    links = []
+
+    for i, (source, target) in enumerate(zip(path, path[1:])):
+        producer, performer = sorted((source, target))
+        neighbours = graph.indices[graph.indptr[producer]:graph.indptr[producer + 1]]
+        entry = graph.indptr[producer] + int(np.flatnonzero(neighbours == performer)[0])
+
+        links.append({
+            "source": i,
+            "target": i + 1,
+            "song_count": int(weights[graph.edge_pairs[entry]]),
+            "songs": [
+                {"song_id": song_id, "song_title": song_title,
+                 "link": f"/songs/{song_id}"}
+                for song_id, song_title in songs.get(pairs[i], [])
+            ],
+        })
+
+    return {
+        "found": True,
+        "hops": len(path) - 1,
+        "path": [graph.node_json(node) for node in path],
+        "links": links,
+    }
+
+
+def load_graph():
+    """Return a CollaborationGraph of the catalog."""
+
+    producers = db.session.query(
+        Producer.producer_id, Producer.producer_name
+    ).order_by(Producer.producer_id).all()
+
+    performers = db.session.query(
+        Performer.performer_id, Performer.performer_name
+    ).order_by(Performer.performer_id).all()
+
+    events = db.session.query(
+        ProduceSong.producer_id,
+        ProduceSong.performer_id,
+        db.func.coalesce(Song.song_release_year, 0),
+        db.func.count(ProduceSong.event_id)
+    ).join(
+        Song, Song.song_id == ProduceSong.song_id
+    ).group_by(
+        ProduceSong.producer_id, ProduceSong.performer_id, Song.song_release_year
+    ).all()
+
+    events = np.array(events, dtype=np.int64).reshape(-1, 4)
+
+    return CollaborationGraph(
+        tuple(zip(*producers)) or ((), ()),
+        tuple(zip(*performers)) or ((), ()),
+        events.T
+    )
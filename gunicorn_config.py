@@ -0,0 +1,42 @@
+"""gunicorn settings for serving wsgi:app.
+
+    $ WEB_WORKERS=8 WEB_THREADS=4 gunicorn -c gunicorn_config.py wsgi:app
+
+The app is imported once in the master (preload_app) and forked, so workers
+share its memory and start without re-importing anything.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:5000")
+
+# One worker per core unless told otherwise, each with a few threads for
+# requests waiting on the database.
+workers = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+
+# Recycle workers now and then, staggered, to bound memory growth.
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections."""
+
+    from wsgi import dispose_engine
+
+    dispose_engine()
+
+
+def child_exit(server, worker):
+    """Drop an exited worker's live metrics (see metrics.py)."""
+
+    if "prometheus_multiproc_dir" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,59 @@
+"""Deferred imports for the app's heavyweight services.
+
+The recommender (numpy and scipy), the Genius client (requests) and the
+collaboration graph and bubble aggregates (numpy) are only needed by the
+detail pages and the D3 endpoints.  server.py reaches them through the
+stand-ins below, so a worker imports their modules the first time a request
+uses them rather than at boot, and one serving only lists, search and
+charts never imports them at all.
+"""
+
+import importlib
+import threading
+
+
+class LazyService(object):
+    """Stands in for module_name.class_name(*args), built on first use.
+
+    Attribute access goes to the service, which is built, importing its
+    module, the first time any attribute is asked for.
+    """
+
+    def __init__(self, module_name, class_name, *args):
+        self._module_name = module_name
+        self._class_name = class_name
+        self._args = args
+        self._service = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._service is not None
+
+    def _get(self):
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    module = importlib.import_module(self._module_name)
+                    self._service = getattr(module, self._class_name)(*self._args)
+
+        return self._service
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__.
+        return getattr(self._get(), name)
+
+
+def lazy_function(module_name, function_name):
+    """Return a function calling module_name.function_name, importing the
+    module on the first call.
+    """
+
+    def call(*args, **kwargs):
+        module = importlib.import_module(module_name)
+
+        return getattr(module, function_name)(*args, **kwargs)
+
+    call.__name__ = function_name
+
+    return call
@@ -0,0 +1,148 @@
+"""Prometheus metrics for every route, served on /metrics.
+
+For each request, by endpoint, this records the latency, the number of SQL
+queries, the time spent in them and the rows and ORM objects they loaded
+(counted by query_stats.py through SQLAlchemy engine and mapper events),
+and for each template the time taken to render it.  Requests slower than
+SLOW_REQUEST_SECONDS are logged with their slowest statements, so hot paths
+can be found in production without the debug toolbar.
+
+Under gunicorn, set prometheus_multiproc_dir to an empty directory so
+/metrics reports the totals of all the workers rather than whichever one
+answers.
+"""
+
+import logging
+import os
+import time
+
+from flask import Response, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry
+from prometheus_client import Histogram, generate_latest, multiprocess
+
+from query_stats import after_response, current_stats
+
+logger = logging.getLogger(__name__)
+
+# Requests taking longer than this many seconds are logged with their SQL.
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 1.0))
+
+# Statements logged per slow request, slowest first.
+SLOW_REQUEST_STATEMENTS = 5
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to handle a request.",
+    ["endpoint", "method", "status"]
+)
+REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements run per request.",
+    ["endpoint"], buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64, 128, float("inf"))
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "db_seconds_per_request", "Time spent in SQL per request.",
+    ["endpoint"]
+)
+REQUEST_ROWS = Histogram(
+    "db_rows_per_request", "Rows read per request.",
+    ["endpoint"], buckets=(0, 10, 100, 1000, 10000, 100000, float("inf"))
+)
+REQUEST_OBJECTS = Histogram(
+    "orm_objects_per_request", "ORM objects loaded per request.",
+    ["endpoint"], buckets=(0, 10, 100, 1000, 10000, 100000, float("inf"))
+)
+TEMPLATE_RENDER_SECONDS = Histogram(
+    "template_render_seconds", "Time to render a template.",
+    ["template"]
+)
+
+
+def _endpoint():
+    # Unrouted URLs share a label, so they can't grow the label set.
+    return request.endpoint or "unmatched"
+
+
+def _start_timer():
+    g.metrics_started_at = time.perf_counter()
+
+
+@after_response
+def _record_request(response):
+    started_at = g.get("metrics_started_at")
+
+    if started_at is None:
+        return response
+
+    elapsed = time.perf_counter() - started_at
+    endpoint = _endpoint()
+
+    REQUEST_LATENCY.labels(endpoint, request.method,
+                           str(response.status_code)).observe(elapsed)
+
+    stats = current_stats()
+
+    if stats is not None:
+        REQUEST_QUERIES.labels(endpoint).observe(stats.queries)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(stats.sql_seconds)
+        REQUEST_ROWS.labels(endpoint).observe(stats.rows)
+        REQUEST_OBJECTS.labels(endpoint).observe(stats.objects)
+
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        log_slow_request(elapsed, stats)
+
+    return response
+
+
+def log_slow_request(elapsed, stats):
+    """Log the current request with its slowest SQL statements."""
+
+    if stats is None:
+        logger.warning("Slow request %s: %.3fs", request.full_path, elapsed)
+        return
+
+    lines = [f"Slow request {request.full_path}: {elapsed:.3f}s, "
+             f"{stats.queries} queries in {stats.sql_seconds:.3f}s, "
+             f"{stats.rows} rows"]
+
+    slowest = sorted(stats.statements, key=lambda statement: statement[1],
+                     reverse=True)
+
+    for statement, seconds in slowest[:SLOW_REQUEST_STATEMENTS]:
+        lines.append(f"    {seconds:.3f}s  {' '.join(statement.split())[:300]}")
+
+    logger.warning("\n".join(lines))
+
+
+def _start_template(app, template, context, **extra):
+    if has_request_context():
+        g.setdefault("template_started_at", []).append(time.perf_counter())
+
+
+def _finish_template(app, template, context, **extra):
+    if not has_request_context() or not g.get("template_started_at"):
+        return
+
+    elapsed = time.perf_counter() - g.template_started_at.pop()
+    TEMPLATE_RENDER_SECONDS.labels(template.name or "string").observe(elapsed)
+
+
+def metrics_response():
+    """Return the metrics in Prometheus' text format."""
+
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """Record metrics for app's requests and templates."""
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_finish_template, app)
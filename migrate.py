@@ -0,0 +1,124 @@
+"""Bring a database created by an earlier model.py up to date.
+
+New tables are created with db.create_all(); changes to existing tables are
+the migrations below, each applied once, in order, in its own transaction,
+and recorded in schema_migrations.
+
+    $ python3 migrate.py
+"""
+
+import datetime
+
+from sqlalchemy import inspect
+
+from model import SchemaMigration, connect_to_db, db
+from summary import refresh_summaries
+
+
+def integer_release_years(connection):
+    """Store song release years as integers instead of text."""
+
+    columns = {column["name"]: column["type"]
+               for column in inspect(connection).get_columns("songs")}
+
+    if connection.dialect.name == "postgresql":
+        if columns["song_release_year"].python_type is int:
+            return
+
+        # Anything but a four digit year was never a usable year.
+        connection.execute("""
+            ALTER TABLE songs ALTER COLUMN song_release_year TYPE integer
+            USING CASE WHEN song_release_year ~ '^[0-9]{4}$'
+                       THEN song_release_year::integer END
+        """)
+        connection.execute("""
+            ALTER TABLE producer_year_counts
+            ALTER COLUMN song_release_year TYPE integer
+            USING song_release_year::integer
+        """)
+    else:
+        # SQLite keeps whatever type each value has; convert the values.
+        connection.execute("""
+            UPDATE songs SET song_release_year =
+                CASE WHEN song_release_year GLOB '[0-9][0-9][0-9][0-9]'
+                     THEN CAST(song_release_year AS INTEGER) END
+        """)
+
+    refresh_summaries(connection, years_only=True)
+
+
+def missing_indexes(connection):
+    """Create the indexes declared in model.py that the database lacks."""
+
+    inspector = inspect(connection)
+
+    # The trigram indexes need pg_trgm.
+    if connection.dialect.name == "postgresql":
+        connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for table in db.metadata.sorted_tables:
+        existing = set(index["name"] for index in inspector.get_indexes(table.name))
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            print(f"Creating {index.name}")
+            index.create(connection)
+
+
+def versioned_related_entities(connection):
+    """Key related entities by catalog version too, so seed.py can store the
+    next version's before bumping the version.
+    """
+
+    # Derived data: recreate the table and let the next seed fill it.
+    table = db.metadata.tables["related_entities"]
+    table.drop(connection, checkfirst=True)
+    table.create(connection)
+
+
+# Applied in this order; never rename or reorder applied migrations.
+MIGRATIONS = [
+    ("0001_integer_release_years", integer_release_years),
+    ("0002_missing_indexes", missing_indexes),
+    ("0003_versioned_related_entities", versioned_related_entities),
+]
+
+
+def migrate():
+    """Apply every migration not yet applied; return their names."""
+
+    db.create_all()
+
+    applied = set(name for name, in db.session.query(SchemaMigration.name))
+    db.session.commit()
+
+    newly_applied = []
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+
+        with db.engine.begin() as connection:
+            migration(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                name=name, applied_at=datetime.datetime.now()
+            ))
+
+        newly_applied.append(name)
+
+    # Refresh planner statistics for the new types and indexes.
+    if newly_applied and db.engine.dialect.name == "postgresql":
+        db.engine.execute("ANALYZE")
+
+    return newly_applied
+
+
+if __name__ == "__main__":
+    from server import app
+
+    connect_to_db(app)
+
+    for name in migrate() or ["Nothing to migrate."]:
+        print(name)
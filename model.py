@@ -1,9 +1,33 @@
 """Models and database functions for music db."""
 
-from flask_sqlalchemy import SQLAlchemy
+import datetime
 
-# Instantiate SQLAlchemy object, bound to variable "db".
-db = SQLAlchemy()
+from sqlalchemy import DDL, bindparam, event
+from sqlalchemy.ext import baked
+
+from db_routing import DATABASE_URL, RoutingSQLAlchemy
+
+# Instantiate SQLAlchemy object, bound to variable "db".  Engines take their
+# pool settings from the environment, and reads can go to replicas; see
+# db_routing.py.
+db = RoutingSQLAlchemy()
+
+# Compiled queries for the hot paths.  A baked query is built and compiled to
+# SQL on its first call and cached by the code of the functions building it;
+# later calls only bind new parameters.  Functions building a baked query
+# must not change it with anything but bindparam() values.
+bakery = baked.bakery()
+
+
+def trigram_index(table_name, column_name):
+    """Return a trigram GIN index, which Postgres uses for ILIKE '%term%'.
+
+    Other databases get a plain index on the column.
+    """
+
+    return db.Index(f"ix_{table_name}_{column_name}_trgm", column_name,
+                    postgresql_using="gin",
+                    postgresql_ops={column_name: "gin_trgm_ops"})
 
 
 ##############################################################################
@@ -14,6 +38,11 @@ class Producer(db.Model):
     """Producer model."""
 
     __tablename__ = "producers"
+    __table_args__ = (
+        trigram_index("producers", "producer_name"),
+        # Serves the alphabetized, keyset paginated list page.
+        db.Index("ix_producers_producer_name_producer_id", "producer_name", "producer_id"),
+    )
 
     # Primary keys are inherently unique.
     producer_id = db.Column(db.Integer, nullable=False, primary_key=True)
@@ -38,13 +67,21 @@ class Producer(db.Model):
     @classmethod
     def get_producer_songs(cls, producer_name):
 
-        return cls.query.filter(cls.producer_name == producer_name).options(db.joinedload("songs")).first()
+        query = bakery(lambda session: session.query(cls).options(db.joinedload("songs")))
+        query += lambda q: q.filter(cls.producer_name == bindparam("producer_name"))
+
+        return query(db.session()).params(producer_name=producer_name).first()
 
 
 class Performer(db.Model):
     """Performer model."""
 
     __tablename__ = "performers"
+    __table_args__ = (
+        trigram_index("performers", "performer_name"),
+        # Serves the alphabetized, keyset paginated list page.
+        db.Index("ix_performers_performer_name_performer_id", "performer_name", "performer_id"),
+    )
 
     performer_id = db.Column(db.Integer, nullable=False, primary_key=True)
     performer_name = db.Column(db.Text, nullable=False)
@@ -60,19 +97,27 @@ class Performer(db.Model):
     @classmethod
     def get_performer_songs(cls, performer_name):
 
-        return cls.query.filter(cls.performer_name == performer_name).options(db.joinedload("songs")).first()
+        query = bakery(lambda session: session.query(cls).options(db.joinedload("songs")))
+        query += lambda q: q.filter(cls.performer_name == bindparam("performer_name"))
+
+        return query(db.session()).params(performer_name=performer_name).first()
 
 
 class Song(db.Model):
     """Song model."""
 
     __tablename__ = "songs"
+    __table_args__ = (
+        trigram_index("songs", "song_title"),
+        # Serves the alphabetized, keyset paginated list page.
+        db.Index("ix_songs_song_title_song_id", "song_title", "song_id"),
+    )
 
     song_id = db.Column(db.Integer, nullable=False, primary_key=True)
     song_title = db.Column(db.Text, nullable=False)
     apple_music_player_url = db.Column(db.Text, nullable=True)
     song_release_date = db.Column(db.DateTime, nullable=True)
-    song_release_year = db.Column(db.Text, nullable=True)
+    song_release_year = db.Column(db.Integer, nullable=True)
     # song_release_month = db.Column(db.DateTime, nullable=True)
     # song_release_day = db.Column(db.DateTime, nullable=True)
 
@@ -82,13 +127,21 @@ class Song(db.Model):
     @classmethod
     def get_song_producers(cls, song_title):
 
-        return cls.query.filter(cls.song_title == song_title).options(db.joinedload("producers")).all()
+        query = bakery(lambda session: session.query(cls).options(db.joinedload("producers")))
+        query += lambda q: q.filter(cls.song_title == bindparam("song_title"))
+
+        return query(db.session()).params(song_title=song_title).all()
 
 
 class Album(db.Model):
     """Album model."""
 
     __tablename__ = "albums"
+    __table_args__ = (
+        trigram_index("albums", "album_title"),
+        # Serves the alphabetized, keyset paginated list page.
+        db.Index("ix_albums_album_title_album_id", "album_title", "album_id"),
+    )
 
     album_id = db.Column(db.Integer, nullable=False, primary_key=True)
     album_title = db.Column(db.Text, nullable=False)
@@ -104,13 +157,29 @@ class Album(db.Model):
     @classmethod
     def get_album_producers(cls, album_title):
 
-        return cls.query.filter(cls.album_title == album_title).options(db.joinedload("producers")).all()
+        query = bakery(lambda session: session.query(cls).options(db.joinedload("producers")))
+        query += lambda q: q.filter(cls.album_title == bindparam("album_title"))
+
+        return query(db.session()).params(album_title=album_title).all()
 
 
 class ProduceSong(db.Model):
     """ProduceSong model."""
 
     __tablename__ = "produce_songs"
+    __table_args__ = (
+        # One covering index per access path: a producer's or performer's
+        # events (detail pages, charts, relationships), a song's producers
+        # and performers, and an album's songs.
+        db.Index("ix_produce_songs_producer_id",
+                 "producer_id", "performer_id", "song_id", "album_id"),
+        db.Index("ix_produce_songs_performer_id",
+                 "performer_id", "producer_id", "song_id", "album_id"),
+        db.Index("ix_produce_songs_song_id",
+                 "song_id", "producer_id", "performer_id", "album_id"),
+        db.Index("ix_produce_songs_album_id",
+                 "album_id", "song_id", "producer_id", "performer_id"),
+    )
 
     event_id = db.Column(db.Integer, autoincrement=True, nullable=False, primary_key=True)
     producer_id = db.Column(db.Integer, db.ForeignKey('producers.producer_id'), nullable=False)
@@ -131,22 +200,212 @@ class ProduceSong(db.Model):
 
         return f"<ProduceSong event_id={self.event_id} producer_id={self.producer_id} performer_id={self.performer_id} song_id={self.song_id} album_id={self.album_id}>"
 
+class ProducerPerformerCount(db.Model):
+    """Number of produce_songs events per producer and performer.
+
+    Maintained by summary.py so chart endpoints don't aggregate events.
+    """
+
+    __tablename__ = "producer_performer_counts"
+    __table_args__ = (
+        # Serves the performer to producer lookups.
+        db.Index("ix_producer_performer_counts_performer_id",
+                 "performer_id", "producer_id", "song_count"),
+    )
+
+    producer_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    performer_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    song_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+
+        return f"<ProducerPerformerCount producer_id={self.producer_id} performer_id={self.performer_id} song_count={self.song_count}>"
+
+
+class ProducerYearCount(db.Model):
+    """Number of produce_songs events per producer and song release year.
+
+    Maintained by summary.py so chart endpoints don't aggregate events.
+    """
+
+    __tablename__ = "producer_year_counts"
+
+    producer_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    song_release_year = db.Column(db.Integer, nullable=False, primary_key=True)
+    song_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+
+        return f"<ProducerYearCount producer_id={self.producer_id} song_release_year={self.song_release_year} song_count={self.song_count}>"
+
+
+class SeedFile(db.Model):
+    """Fingerprint of a seed file as of the last incremental sync."""
+
+    __tablename__ = "seed_files"
+
+    table_name = db.Column(db.Text, nullable=False, primary_key=True)
+    file_digest = db.Column(db.Text, nullable=False)
+    synced_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+
+        return f"<SeedFile table_name={self.table_name} file_digest={self.file_digest} synced_at={self.synced_at}>"
+
+
+class SeedRow(db.Model):
+    """Fingerprint of a seed row, keyed by its table and Genius id."""
+
+    __tablename__ = "seed_rows"
+
+    table_name = db.Column(db.Text, nullable=False, primary_key=True)
+    row_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    row_digest = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+
+        return f"<SeedRow table_name={self.table_name} row_id={self.row_id} row_digest={self.row_digest}>"
+
+class CatalogVersion(db.Model):
+    """Version number of the catalog, bumped whenever seed.py changes it.
+
+    Anything built from the catalog tables (indexes, caches) keys off this
+    number to know when to rebuild.
+    """
+
+    __tablename__ = "catalog_version"
+
+    version_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+
+        return f"<CatalogVersion version={self.version} updated_at={self.updated_at}>"
+
+    @classmethod
+    def current(cls):
+        """Return the current catalog version number (0 if never seeded)."""
+
+        query = bakery(lambda session: session.query(cls.version))
+        query += lambda q: q.filter(cls.version_id == 1)
+
+        version = query(db.session()).scalar()
+
+        return version or 0
+
+    @classmethod
+    def bump(cls):
+        """Increment the catalog version; return the new version number."""
+
+        catalog_version = cls.query.get(1)
+
+        if catalog_version is None:
+            catalog_version = cls(version_id=1, version=0)
+            db.session.add(catalog_version)
+
+        catalog_version.version += 1
+        # Naive UTC, which is how werkzeug reads Last-Modified datetimes.
+        catalog_version.updated_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+        return catalog_version.version
+
+
+class SchemaMigration(db.Model):
+    """A migration from migrate.py that has been applied to the database."""
+
+    __tablename__ = "schema_migrations"
+
+    name = db.Column(db.Text, nullable=False, primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+
+        return f"<SchemaMigration name={self.name} applied_at={self.applied_at}>"
+
+
+class PerformerBio(db.Model):
+    """Performer bio from the Genius API, cached with the time it was fetched."""
+
+    __tablename__ = "performer_bios"
+
+    performer_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    bio = db.Column(db.Text, nullable=False, default="")
+    fetched_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+
+        return f"<PerformerBio performer_id={self.performer_id} fetched_at={self.fetched_at}>"
+
+
+class PageBoundary(db.Model):
+    """The (sort value, id) key a list page starts after, for one page size.
+
+    Stored by pagination.py for one catalog version when seed.py publishes
+    it, alongside the current version's until the version is bumped.
+    """
+
+    __tablename__ = "page_boundaries"
+
+    list_name = db.Column(db.Text, nullable=False, primary_key=True)
+    catalog_version = db.Column(db.Integer, nullable=False, primary_key=True)
+    per_page = db.Column(db.Integer, nullable=False, primary_key=True)
+    page = db.Column(db.Integer, nullable=False, primary_key=True)
+    sort_value = db.Column(db.Text, nullable=False)
+    boundary_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+
+        return f"<PageBoundary list_name={self.list_name} per_page={self.per_page} page={self.page}>"
+
+
+class RelatedEntity(db.Model):
+    """A producer's or performer's rank-th most similar producer or performer.
+
+    Precomputed by recommend.py for one catalog version; the next version's
+    are stored alongside the current one's until the version is bumped.
+    """
+
+    __tablename__ = "related_entities"
+
+    entity_type = db.Column(db.Text, nullable=False, primary_key=True)
+    catalog_version = db.Column(db.Integer, nullable=False, primary_key=True)
+    entity_id = db.Column(db.Integer, nullable=False, primary_key=True)
+    rank = db.Column(db.Integer, nullable=False, primary_key=True)
+    related_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+
+        return f"<RelatedEntity entity_type={self.entity_type} entity_id={self.entity_id} rank={self.rank} related_id={self.related_id}>"
+
 # may add Users class in 3.0
 
 
+# The trigram indexes need pg_trgm installed before the tables are created.
+event.listen(
+    db.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
 
 ##############################################################################
 
-def connect_to_db(app):
-    """Connect the database to Flask app."""
+def connect_to_db(app, db_uri=None, replica_uris=()):
+    """Connect the database to Flask app.
+
+    db_uri defaults to DATABASE_URL; SELECTs go to replica_uris, if given.
+    """
 
     # Configure to use database.
     # Creates database when entering psql music at commandline.
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///music' 
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri or DATABASE_URL
     app.config['SQLALCHEMY_ECHO'] = False
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.app = app
     db.init_app(app)
+    db.init_replicas(app, list(replica_uris))
 
 
 if __name__ == "__main__":
@@ -155,9 +414,3 @@ if __name__ == "__main__":
     from server import app
     connect_to_db(app)
     print("Connected to DB.")
-
-
-
-
-
-
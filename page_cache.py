@@ -0,0 +1,199 @@
+"""Rendered pages and fragments, cached until the catalog changes.
+
+The detail and list pages only change when seed.py loads the catalog, so
+their HTML is kept under a key naming the page (e.g. "producer-5" or
+"songs-3-100") and the catalog version; views opt in with the
+@pages.cached(make_key) decorator.  A hit costs one dictionary lookup:
+no ORM loading and no Jinja rendering.  The version is checked at most
+every VERSION_CHECK_INTERVAL seconds, and when seed.py bumps it every entry
+is dropped.
+
+Pages are kept in memory in an LRU of PAGE_CACHE_SIZE entries; a size of 0
+turns the cache off, so every request renders (bench_routes.py does this to
+time the views themselves).  If
+PAGE_CACHE_DIR is set they are also written there, one file per page under
+a directory per catalog version, so workers on the same box share renders
+and a restarted worker starts warm.
+
+Responses that aren't rendered (redirects, 404s) are never cached; a
+streamed page is cached once the whole of it has been sent.
+"""
+
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from model import CatalogVersion
+
+# Pages kept in memory per worker.
+PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", 2000))
+
+# Directory shared by the workers for rendered pages; unset keeps them in
+# memory only.
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR")
+
+# Seconds between checks of the catalog version.
+VERSION_CHECK_INTERVAL = 30
+
+
+class PageCache(object):
+    """LRU of rendered HTML keyed by page and catalog version, optionally
+    backed by a directory on local disk.
+    """
+
+    def __init__(self, size=PAGE_CACHE_SIZE, directory=PAGE_CACHE_DIR):
+        self.size = size
+        self.directory = directory
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._checked_at = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        """Drop every page if the catalog version has changed."""
+
+        if time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = time.monotonic()
+        version = CatalogVersion.current()
+
+        if version != self.version:
+            with self._lock:
+                self._pages.clear()
+                self.version = version
+
+            self._remove_old_versions()
+
+    def _version_dir(self):
+        return os.path.join(self.directory, f"v{self.version}")
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+        return os.path.join(self._version_dir(), f"{digest}.html")
+
+    def _remove_old_versions(self):
+        """Delete other versions' directories; another worker may be doing
+        the same, so missing files are fine.
+        """
+
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+
+        current = f"v{self.version}"
+
+        for name in os.listdir(self.directory):
+            if name.startswith("v") and name != current:
+                shutil.rmtree(os.path.join(self.directory, name),
+                              ignore_errors=True)
+
+    def get(self, key):
+        """Return the cached HTML for key, or None."""
+
+        self._check_version()
+
+        with self._lock:
+            html = self._pages.get(key)
+
+            if html is not None:
+                self._pages.move_to_end(key)
+                return html
+
+        if self.directory:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    html = f.read()
+            except OSError:
+                return None
+
+            self._remember(key, html)
+
+        return html
+
+    def set(self, key, html):
+        """Cache html under key for the current catalog version."""
+
+        self._remember(key, html)
+
+        if self.directory:
+            # Write to a temporary file and rename it, so other workers
+            # never read half a page.
+            try:
+                os.makedirs(self._version_dir(), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=self._version_dir())
+
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(html)
+
+                os.replace(temp_path, self._path(key))
+            except OSError:
+                pass
+
+    def _remember(self, key, html):
+        with self._lock:
+            self._pages[key] = html
+            self._pages.move_to_end(key)
+
+            if len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def render(self, key, render):
+        """Return the HTML cached under key, calling render() for it on a
+        miss.  render() returns the HTML or a streamed Response.
+        """
+
+        if not self.size:
+            return render()
+
+        html = self.get(key)
+
+        if html is not None:
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        html = render()
+
+        if isinstance(html, str):
+            self.set(key, html)
+            return html
+
+        # A streamed response: cache the page once it has all been sent.
+        response = html
+        response.response = self._tee(key, response.response)
+
+        return response
+
+    def _tee(self, key, chunks):
+        """Yield chunks, then cache them joined under key."""
+
+        sent = []
+
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+
+        self.set(key, "".join(sent))
+
+    def cached(self, make_key):
+        """Decorate a view returning HTML to cache it under
+        make_key(**view_args).
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def cached_view(**view_args):
+                return self.render(make_key(**view_args),
+                                   lambda: view(**view_args))
+
+            return cached_view
+
+        return decorator
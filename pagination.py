@@ -0,0 +1,172 @@
+"""Keyset (seek) pagination for the producer, performer, song and album lists.
+
+Instead of loading a whole table and slicing it, each page is fetched with
+
+    WHERE (sort_column, id) > (last key on the previous page)
+    ORDER BY sort_column, id LIMIT per_page
+
+which an index on (sort_column, id) answers by reading just per_page rows,
+whatever the page number.  The key each page starts after is found when
+seed.py publishes a catalog version, with one pass over that index per size
+in PAGE_SIZES, and stored in page_boundaries; a request looks up its page's
+key by primary key.  The row count is cached per worker until seed.py bumps
+the catalog version.
+"""
+
+import time
+
+from flask import request
+from sqlalchemy import func, literal, select, tuple_
+
+from model import CatalogVersion, PageBoundary, db
+
+# Rows per page unless the request asks for another of PAGE_SIZES.
+PER_PAGE = 100
+PAGE_SIZES = (25, 50, 100, 200)
+
+# Seconds between checks of the catalog version.
+VERSION_CHECK_INTERVAL = 30
+
+
+def page_args():
+    """Return (page, per_page) from the request; per_page is PER_PAGE
+    unless the request asks for one of PAGE_SIZES.
+    """
+
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", PER_PAGE, type=int)
+
+    if per_page not in PAGE_SIZES:
+        per_page = PER_PAGE
+
+    return max(page, 1), per_page
+
+
+class KeysetPagination(object):
+    """Pages through model ordered by sort_column, with id_column breaking ties.
+
+    name identifies the list's stored page boundaries.
+    """
+
+    def __init__(self, name, model, sort_column, id_column):
+        self.name = name
+        self.model = model
+        self.sort_column = sort_column
+        self.id_column = id_column
+
+        self._version = None
+        self._checked_at = 0
+        self._total = None
+
+    def _check_version(self):
+        """Forget the cached count if the catalog has changed.
+
+        The version is checked at most every VERSION_CHECK_INTERVAL seconds.
+        """
+
+        if time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = time.monotonic()
+        version = CatalogVersion.current()
+
+        if version != self._version:
+            self._version, self._total = version, None
+
+    def total(self):
+        """Return the number of rows, counted once per catalog version."""
+
+        self._check_version()
+
+        if self._total is None:
+            self._total = db.session.query(func.count(self.id_column)).scalar()
+
+        return self._total
+
+    def store_boundaries(self, version):
+        """Store the key that starts every page after the first, for each of
+        PAGE_SIZES, as the page boundaries of catalog version.
+
+        One row_number() pass over the (sort_column, id) index per page
+        size, run by the database; seed.py calls this before publishing the
+        version.
+        """
+
+        boundaries = PageBoundary.__table__
+
+        # Keep the previous version's, which servers read until the bump.
+        db.session.execute(boundaries.delete().where(
+            (boundaries.c.list_name == self.name) &
+            (boundaries.c.catalog_version != version - 1)
+        ))
+
+        row_number = func.row_number().over(
+            order_by=(self.sort_column, self.id_column)
+        ).label("row_number")
+
+        numbered = select([
+            self.sort_column.label("sort_value"),
+            self.id_column.label("id_value"),
+            row_number,
+        ]).alias("numbered")
+
+        for per_page in PAGE_SIZES:
+            # The row ending page n is the boundary of page n + 1.
+            db.session.execute(boundaries.insert().from_select(
+                ["list_name", "catalog_version", "per_page", "page",
+                 "sort_value", "boundary_id"],
+                select([
+                    literal(self.name), literal(version), literal(per_page),
+                    numbered.c.row_number / per_page + 1,
+                    numbered.c.sort_value, numbered.c.id_value,
+                ]).where(numbered.c.row_number % per_page == 0)
+            ))
+
+        db.session.commit()
+
+    def boundary(self, page, per_page):
+        """Return the (sort value, id) page starts after, or None if the
+        catalog version's boundaries weren't stored.
+        """
+
+        self._check_version()
+
+        return db.session.query(
+            PageBoundary.sort_value, PageBoundary.boundary_id
+        ).filter(
+            PageBoundary.list_name == self.name,
+            PageBoundary.catalog_version == self._version,
+            PageBoundary.per_page == per_page,
+            PageBoundary.page == page
+        ).first()
+
+    def page(self, page, per_page, *options):
+        """Return the model objects on page (counting from 1)."""
+
+        if per_page not in PAGE_SIZES:
+            raise ValueError(f"Unsupported page size {per_page}, expected one "
+                             f"of {', '.join(map(str, PAGE_SIZES))}")
+
+        query = self.model.query.order_by(self.sort_column, self.id_column)
+
+        if page > 1:
+            offset = (page - 1) * per_page
+
+            if offset >= self.total():
+                return []
+
+            boundary = self.boundary(page, per_page)
+
+            if boundary is None:
+                # Not stored for this version (seeded before boundaries
+                # were): correct, but deep pages read every row before them.
+                query = query.offset(offset)
+            else:
+                sort_value, id_value = boundary
+
+                query = query.filter(
+                    tuple_(self.sort_column, self.id_column) >
+                    tuple_(sort_value, id_value)
+                )
+
+        return query.options(*options).limit(per_page).all()
@@ -0,0 +1,130 @@
+"""Development and test guard against N+1 queries and budget overruns.
+
+With QUERY_GUARD set ("log" or "raise"), every request's statements, as
+counted by query_stats.py, are checked when it finishes:
+
+    - the same statement run N_PLUS_ONE_THRESHOLD or more times, differing
+      only in its parameters, is an N+1: a relationship loaded row by row;
+    - any statement run while a template renders is a lazy load the view's
+      loader options missed;
+    - a view with a QUERY_BUDGETS entry may not run more queries or read
+      more rows than it allows.
+
+"log" logs each problem; "raise" makes the request fail with
+QueryGuardError, so check_queries.py (and any test client) stops on it.
+"""
+
+import logging
+import os
+
+from flask import before_render_template, current_app, g
+from flask import request, template_rendered
+
+from query_stats import QUERY_BUDGETS, after_response, current_stats
+
+logger = logging.getLogger(__name__)
+
+# "log" or "raise"; unset or empty leaves the guard off.
+QUERY_GUARD = os.environ.get("QUERY_GUARD", "")
+
+# Runs of one statement in a request that count as an N+1.
+N_PLUS_ONE_THRESHOLD = 3
+
+
+class QueryGuardError(Exception):
+    """A request ran an N+1, queried from a template or broke its budget."""
+
+
+def _start_template(app, template, context, **extra):
+    stats = current_stats()
+
+    if stats is not None:
+        g.setdefault("query_guard_renders", []).append(
+            [template.name or "a template string", len(stats.statements), None]
+        )
+
+
+def _finish_template(app, template, context, **extra):
+    stats = current_stats()
+
+    # Close the innermost open render: templates can render others.
+    for render in reversed(g.get("query_guard_renders", [])):
+        if render[2] is None and stats is not None:
+            render[2] = len(stats.statements)
+            break
+
+
+def find_problems(endpoint, stats, renders=()):
+    """Return a description of each problem with a request's queries.
+
+    renders are (template name, index of the first statement run while it
+    rendered, index after the last).
+    """
+
+    problems = []
+    runs = {}
+
+    for statement, seconds in stats.statements:
+        runs[statement] = runs.get(statement, 0) + 1
+
+    for statement, count in runs.items():
+        if count >= N_PLUS_ONE_THRESHOLD:
+            problems.append(f"N+1: {count} runs of "
+                            f"{' '.join(statement.split())[:200]}")
+
+    for template_name, start, end in renders:
+        if end is not None and end > start:
+            problems.append(f"{end - start} queries while rendering "
+                            f"{template_name}")
+
+    budget = QUERY_BUDGETS.get(endpoint)
+
+    if budget:
+        if stats.queries > budget["queries"]:
+            problems.append(f"{stats.queries} queries, budget {budget['queries']}")
+        if stats.rows > budget["rows"]:
+            problems.append(f"{stats.rows} rows, budget {budget['rows']}")
+
+    return problems
+
+
+@after_response
+def _check_request(response):
+    stats = current_stats()
+
+    if stats is None or request.endpoint is None:
+        return response
+
+    problems = find_problems(request.endpoint, stats,
+                             g.get("query_guard_renders", ()))
+
+    if not problems:
+        return response
+
+    message = f"{request.full_path} ({request.endpoint}): " + "; ".join(problems)
+
+    if current_app.config.get("QUERY_GUARD") == "raise":
+        raise QueryGuardError(message)
+
+    logger.warning(message)
+
+    return response
+
+
+def init_query_guard(app, mode=None):
+    """Check app's requests in mode ("log" or "raise"), QUERY_GUARD if not
+    given; does nothing if both are empty.
+
+    Call after init_query_stats, whose counts it checks.
+    """
+
+    mode = mode or app.config.get("QUERY_GUARD") or QUERY_GUARD
+
+    if not mode:
+        return
+
+    app.config["QUERY_GUARD"] = mode
+    app.after_request(_check_request)
+
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_finish_template, app)
@@ -0,0 +1,198 @@
+"""Per-request SQL query counts, rows and time, tracked per view.
+
+SQLAlchemy engine events count every statement a request runs, the time it
+spends in the database and the rows it reads back; mapper events count the
+ORM objects it loads.  Totals are kept per endpoint, and requests to views
+with a QUERY_BUDGETS entry that go over it are logged.
+
+A page streamed with streamed_response() is still rendering when the
+after_request handlers run, so handlers wrapped with after_response() wait
+to run until the last of it has been sent.
+"""
+
+import functools
+import logging
+import threading
+import time
+
+from flask import Response, g, has_request_context, request, stream_with_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+logger = logging.getLogger(__name__)
+
+# Most queries and rows read per request for views that must stay bounded,
+# whatever the size of the entity shown.
+QUERY_BUDGETS = {
+    "producer_list": {"queries": 5, "rows": 5000},
+    "producer_detail": {"queries": 4, "rows": 20000},
+    "producer_charts": {"queries": 3, "rows": 5000},
+    "performer_list": {"queries": 5, "rows": 5000},
+    "performer_detail": {"queries": 4, "rows": 20000},
+    "performer_charts": {"queries": 2, "rows": 5000},
+    "song_list": {"queries": 6, "rows": 5000},
+    "song_detail": {"queries": 5, "rows": 2000},
+    "album_list": {"queries": 5, "rows": 5000},
+    "return_search_result": {"queries": 4, "rows": 1000},
+}
+
+
+class ViewStats(object):
+    """Running totals of requests, queries, rows and time for one view."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.rows = 0
+        self.max_rows = 0
+        self.objects = 0
+        self.sql_seconds = 0.0
+
+    def add(self, request_stats):
+        self.requests += 1
+        self.queries += request_stats.queries
+        self.max_queries = max(self.max_queries, request_stats.queries)
+        self.rows += request_stats.rows
+        self.max_rows = max(self.max_rows, request_stats.rows)
+        self.objects += request_stats.objects
+        self.sql_seconds += request_stats.sql_seconds
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class RequestStats(object):
+    """Queries, rows, ORM objects and SQL time for the current request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.objects = 0
+        self.sql_seconds = 0.0
+        self.statements = []
+
+
+# Totals per endpoint, for every request since the worker started.
+view_stats = {}
+_view_stats_lock = threading.Lock()
+
+
+def current_stats():
+    """Return the current request's RequestStats, or None outside a request."""
+
+    if not has_request_context():
+        return None
+
+    return g.get("query_stats")
+
+
+def after_response(handler):
+    """Wrap an after_request handler to run after a streamed_response() has
+    been sent, rather than before it renders; other responses are handled
+    as usual.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(response):
+        deferred = g.get("after_stream")
+
+        if deferred is None:
+            return handler(response)
+
+        deferred.append(handler)
+
+        return response
+
+    return wrapper
+
+
+def streamed_response(chunks, **kwargs):
+    """Return a Response sending chunks with the request context still
+    pushed, then running the after_response() handlers.
+    """
+
+    # Handlers run in the order Flask called them on the response.
+    g.after_stream = []
+
+    def send():
+        yield from chunks
+
+        for handler in g.after_stream:
+            handler(response)
+
+    response = Response(stream_with_context(send()), **kwargs)
+
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = current_stats()
+
+    if stats is None:
+        return
+
+    elapsed = time.perf_counter() - context._query_stats_start
+
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    stats.statements.append((statement, elapsed))
+
+    # Drivers report the rows a SELECT returned as its rowcount (sqlite3
+    # reports -1, so rows go uncounted there).
+    if cursor.rowcount and cursor.rowcount > 0 and cursor.description:
+        stats.rows += cursor.rowcount
+
+
+def _on_load(target, context):
+    stats = current_stats()
+
+    if stats is not None:
+        stats.objects += 1
+
+
+def _start_request():
+    g.query_stats = RequestStats()
+
+
+@after_response
+def _finish_request(response):
+    # Left on g for later after_request handlers, like metrics.py's.
+    stats = g.get("query_stats")
+    endpoint = request.endpoint
+
+    if stats is None or endpoint is None:
+        return response
+
+    with _view_stats_lock:
+        view_stats.setdefault(endpoint, ViewStats()).add(stats)
+
+    budget = QUERY_BUDGETS.get(endpoint)
+
+    if budget and (stats.queries > budget["queries"] or
+                   stats.rows > budget["rows"]):
+        logger.warning("%s over budget: %d queries, %d rows (budget %d, %d)",
+                       request.path, stats.queries, stats.rows,
+                       budget["queries"], budget["rows"])
+
+    return response
+
+
+def init_query_stats(app):
+    """Track queries per request for app's views."""
+
+    # Listen on every engine, so this can run before connect_to_db.
+    if not event.contains(Engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Mapper, "load", _on_load)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
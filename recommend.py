@@ -0,0 +1,282 @@
+"""Related producers and performers, precomputed from produce_songs.
+
+Performers are compared by how often they work with each producer, and
+producers by how often they work with each performer, using the sparse
+affinity matrices in affinity.py (TF-IDF weighted, cosine similarity).
+Neighbours for every entity are stored in the related_entities table for the
+catalog version, so they are computed once per seed, not per request, and
+after the first seed only for the entities new events affect.  seed.py
+stores them for the next version before it bumps the catalog version, so
+servers find them as soon as they see the bump.
+
+Each worker loads the table into arrays once per catalog version, rebuilding
+in the background when the version changes; lookups are a dictionary access.
+Servers never compute related entities themselves: until a version's rows
+are stored, lookups return no related entities.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from affinity import AffinityMatrix
+from model import CatalogVersion, Performer, Producer, RelatedEntity, db
+
+# Related entities kept per producer and performer.
+RELATED_COUNT = 5
+
+# How producers and performers are weighted before they are compared; see
+# affinity.WEIGHTINGS.
+WEIGHTING = "tfidf"
+
+# Entity type, affinity matrix row and column keys, and the entity's id and
+# name columns.
+RECOMMENDERS = {
+    "performer": ("performer_id", "producer_id",
+                  Performer.performer_id, Performer.performer_name),
+    "producer": ("producer_id", "performer_id",
+                 Producer.producer_id, Producer.producer_name),
+}
+
+# Seconds between checks of the catalog version.
+VERSION_CHECK_INTERVAL = 30
+
+
+def precompute_related(entity_type, version=None, weighting=WEIGHTING):
+    """Compute entity_type's related entities and store them for version.
+
+    Starts from the affinity matrix saved by the last run, if any, and
+    refreshes it with the events added since.
+    """
+
+    row_key, column_key, *_ = RECOMMENDERS[entity_type]
+
+    if version is None:
+        version = CatalogVersion.current()
+
+    matrix = AffinityMatrix(row_key, column_key, weighting, RELATED_COUNT)
+
+    if matrix.load():
+        matrix.refresh()
+    else:
+        matrix.build()
+
+    matrix.save()
+    neighbours = matrix.related()
+
+    # Keep the previous version's rows, which servers read until the bump.
+    RelatedEntity.query.filter(
+        RelatedEntity.entity_type == entity_type,
+        RelatedEntity.catalog_version != version - 1
+    ).delete(synchronize_session=False)
+
+    db.session.bulk_insert_mappings(RelatedEntity, [
+        {"entity_type": entity_type, "entity_id": entity_id, "rank": rank,
+         "related_id": related_id, "catalog_version": version}
+        for entity_id, related_ids in neighbours.items()
+        for rank, related_id in enumerate(related_ids)
+    ])
+    db.session.commit()
+
+    return neighbours
+
+
+def precompute_all(version=None, weighting=WEIGHTING):
+    """Compute and store related producers and performers."""
+
+    for entity_type in RECOMMENDERS:
+        neighbours = precompute_related(entity_type, version, weighting)
+        print(f"Related {entity_type}s: {len(neighbours)} computed")
+
+
+class RelatedEntities(object):
+    """One entity type's related entities, as arrays in memory."""
+
+    def __init__(self, neighbours, names):
+        entity_ids = sorted(neighbours)
+
+        self.positions = {entity_id: i for i, entity_id in enumerate(entity_ids)}
+        self.names = names
+
+        # Row i holds the related ids of entity_ids[i], padded with 0.
+        self.related = np.zeros((len(entity_ids), RELATED_COUNT), dtype=np.int64)
+        self.counts = np.zeros(len(entity_ids), dtype=np.int64)
+
+        for i, entity_id in enumerate(entity_ids):
+            related_ids = neighbours[entity_id][:RELATED_COUNT]
+            self.related[i, :len(related_ids)] = related_ids
+            self.counts[i] = len(related_ids)
+
+    def lookup(self, entity_id):
+        """Return [(related id, name)] for entity_id, most similar first."""
+
+        position = self.positions.get(entity_id)
+
+        if position is None:
+            return []
+
+        return [(int(related_id), self.names.get(int(related_id), ""))
+                for related_id in self.related[position, :self.counts[position]]]
+
+
+def load_related(entity_type, version):
+    """Return entity_type's RelatedEntities for version, or None if they
+    haven't been precomputed.
+    """
+
+    *_, id_column, name_column = RECOMMENDERS[entity_type]
+
+    rows = db.session.query(
+        RelatedEntity.entity_id, RelatedEntity.related_id
+    ).filter(
+        RelatedEntity.entity_type == entity_type,
+        RelatedEntity.catalog_version == version
+    ).order_by(
+        RelatedEntity.entity_id, RelatedEntity.rank
+    ).all()
+
+    if not rows:
+        return None
+
+    neighbours = {}
+
+    for entity_id, related_id in rows:
+        neighbours.setdefault(entity_id, []).append(related_id)
+
+    names = dict(db.session.query(id_column, name_column))
+
+    return RelatedEntities(neighbours, names)
+
+
+class RecommendationService(object):
+    """Holds a worker's related entities and keeps them in step with the catalog."""
+
+    def __init__(self, app):
+        self.app = app
+        self.related = None
+        self.version = None
+        self.complete = False
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def build(self):
+        """Load every entity type's related entities and swap them in.
+
+        Entity types not yet precomputed for the version get none, and the
+        next check loads them again.
+        """
+
+        with self.app.app_context():
+            version = CatalogVersion.current()
+            related = {entity_type: load_related(entity_type, version)
+                       for entity_type in RECOMMENDERS}
+            db.session.remove()
+
+        complete = all(related.values())
+        empty = RelatedEntities({}, {})
+        related = {entity_type: entity_related or empty
+                   for entity_type, entity_related in related.items()}
+
+        self.related, self.version, self.complete = related, version, complete
+        self._checked_at = time.monotonic()
+
+    def build_and_wait(self):
+        """Build on another thread and wait for it.
+
+        Scoped sessions are per thread, and build() removes its session when
+        done; run on a request's thread, that would detach the request's
+        objects.
+        """
+
+        errors = []
+
+        def build():
+            try:
+                self.build()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=build)
+        thread.start()
+        thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def build_in_background(self):
+        """Build on a daemon thread, unless a build is running."""
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                self.build()
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def refresh_if_stale(self):
+        """Reload in the background if the catalog version has changed, or
+        if some related entities weren't stored yet at the last load.
+
+        The version is checked at most every VERSION_CHECK_INTERVAL seconds;
+        lookups keep using the loaded related entities until the reload is
+        done.
+        """
+
+        if time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = time.monotonic()
+
+        if not self.complete or CatalogVersion.current() != self.version:
+            self.build_in_background()
+
+    def loaded_version(self):
+        """Return the catalog version of the related entities, loading them
+        if needed, or None while some aren't stored yet.
+
+        Pages showing related entities are cached under it, so they're
+        rendered again once the rest arrive.
+        """
+
+        if self.related is None:
+            with self._lock:
+                if self.related is None:
+                    self.build_and_wait()
+        else:
+            self.refresh_if_stale()
+
+        return self.version if self.complete else None
+
+    def lookup(self, entity_type, entity_id):
+        """Return [(related id, name)] for an entity, loading if needed."""
+
+        self.loaded_version()
+
+        return self.related[entity_type].lookup(entity_id)
+
+
+if __name__ == "__main__":
+    # Precompute related entities for the current catalog.
+
+    import argparse
+
+    from affinity import WEIGHTINGS
+    from model import connect_to_db
+    from server import app
+
+    parser = argparse.ArgumentParser(description="Precompute related entities.")
+    parser.add_argument("--weighting", choices=WEIGHTINGS, default=WEIGHTING,
+                        help="how event counts are weighted")
+    args = parser.parse_args()
+
+    connect_to_db(app)
+    db.create_all()
+    precompute_all(weighting=args.weighting)
@@ -0,0 +1,253 @@
+"""Catalog search for /search_result.
+
+Matches are case-insensitive substrings of producer and performer names and
+song and album titles.  On Postgres, the trigram GIN indexes defined in
+model.py let each ILIKE '%term%' lookup use an index instead of scanning the
+table.
+
+Results are bounded: each entity type returns at most SEARCH_LIMIT matches
+per page, ranked exact match first, then prefix match, then any other
+substring match, alphabetized within each rank.  All four types are fetched
+in one UNION ALL query, with the performer shown beside each song and album
+looked up only for the rows returned.  The database does all the ordering,
+numbering each type's matches in its own collation, so pages never skip or
+repeat a match.
+
+Terms shorter than SHORT_TERM_LENGTH match too much of the catalog for a
+trigram index to narrow down, and ranking every match would sort most of
+each table.  They match prefixes only, and only the first
+SHORT_TERM_CANDIDATES prefix matches of each type, alphabetically, are
+ranked; later ones can't be paged to.
+
+The query takes the search string and page as bound parameters, so it is
+built once per combination of entity types and term length and compiled to
+SQL once per database; each search only binds new values.  Both are kept in
+LRU caches of SEARCH_CACHE_SIZE entries.
+"""
+
+from sqlalchemy import Integer, Text, bindparam, case, cast, func
+from sqlalchemy import literal_column, null, select, union_all, util
+
+from model import Album, Performer, Producer, ProduceSong, Song, db
+
+# Matches returned per entity type per page.
+SEARCH_LIMIT = 20
+
+# Entity type, id column, searched column, image column and the produce_songs
+# column used to find the performer shown beside the match (if any).
+SEARCH_COLUMNS = [
+    ("producers", Producer.producer_id, Producer.producer_name,
+     Producer.producer_img_url, None),
+    ("performers", Performer.performer_id, Performer.performer_name,
+     Performer.performer_img_url, None),
+    ("songs", Song.song_id, Song.song_title, None, ProduceSong.song_id),
+    ("albums", Album.album_id, Album.album_title, Album.cover_art_url,
+     ProduceSong.album_id),
+]
+
+ENTITY_TYPES = [entity_type for entity_type, *_ in SEARCH_COLUMNS]
+
+# Terms shorter than this match prefixes only.
+SHORT_TERM_LENGTH = 3
+
+# Prefix matches of a short term ranked per entity type.
+SHORT_TERM_CANDIDATES = 1000
+
+# Search statements, and compiled statements, kept.
+SEARCH_CACHE_SIZE = 50
+
+# Search statements by entity types and term length, and their SQL compiled per database.
+_search_statements = util.LRUCache(SEARCH_CACHE_SIZE)
+_compiled_searches = util.LRUCache(SEARCH_CACHE_SIZE)
+
+
+def escape_like(search_str):
+    """Escape LIKE wildcards in search_str so they match literally."""
+
+    return (search_str.replace("\\", "\\\\")
+                      .replace("%", "\\%")
+                      .replace("_", "\\_"))
+
+
+def like_pattern(search_str):
+    """Return an ILIKE pattern matching search_str anywhere in a string."""
+
+    return f"%{escape_like(search_str)}%"
+
+
+def prefix_pattern(search_str):
+    """Return an ILIKE pattern matching strings starting with search_str."""
+
+    return f"{escape_like(search_str)}%"
+
+
+def ranked_matches(entity_type, id_column, name_column, image_column,
+                   performer_key, short=False):
+    """Return a SELECT of one page of ranked matches for one entity type.
+
+    Takes the bound parameters search_str (lowercased), prefix_pattern,
+    like_pattern, fetch (rows to return) and offset.  Each match's position
+    numbers it in rank order.  short ranks just the first
+    SHORT_TERM_CANDIDATES prefix matches.
+    """
+
+    if image_column is None:
+        image_column = cast(null(), Text)
+
+    if short:
+        # Read in (name, id) order, which the list pages' index serves
+        # without sorting the matches.
+        candidates = select([
+            id_column.label("entity_id"),
+            name_column.label("name"),
+            image_column.label("image_url"),
+        ]).where(
+            name_column.ilike(bindparam("prefix_pattern"), escape="\\")
+        ).order_by(
+            name_column, id_column
+        ).limit(SHORT_TERM_CANDIDATES).alias(f"{entity_type}_candidates")
+
+        id_column = candidates.c.entity_id
+        name_column = candidates.c.name
+        image_column = candidates.c.image_url
+        matched = None
+    else:
+        matched = name_column.ilike(bindparam("like_pattern"), escape="\\")
+
+    rank = case([
+        (func.lower(name_column) == bindparam("search_str"), 0),
+        (name_column.ilike(bindparam("prefix_pattern"), escape="\\"), 1),
+    ], else_=2)
+
+    matches = select([
+        id_column.label("entity_id"),
+        name_column.label("name"),
+        image_column.label("image_url"),
+        rank.label("rank"),
+        func.row_number().over(
+            order_by=[rank, name_column, id_column]
+        ).label("position"),
+    ])
+
+    if matched is not None:
+        matches = matches.where(matched)
+
+    matches = matches.order_by(
+        rank, name_column, id_column
+    ).limit(
+        bindparam("fetch", type_=Integer)
+    ).offset(
+        bindparam("offset", type_=Integer)
+    ).alias(f"{entity_type}_matches")
+
+    # Look up the performer for just the page of matches.
+    if performer_key is None:
+        performer_id = cast(null(), Integer)
+        performer_name = cast(null(), Text)
+    else:
+        performer_id = select([
+            func.min(ProduceSong.performer_id)
+        ]).where(
+            performer_key == matches.c.entity_id
+        ).correlate(matches).as_scalar()
+
+        performer_name = select([
+            Performer.performer_name
+        ]).where(
+            Performer.performer_id == ProduceSong.performer_id
+        ).where(
+            performer_key == matches.c.entity_id
+        ).order_by(
+            ProduceSong.performer_id
+        ).limit(1).correlate(matches).as_scalar()
+
+    return select([
+        literal_column(f"'{entity_type}'", Text).label("entity_type"),
+        matches.c.entity_id,
+        matches.c.name,
+        matches.c.image_url,
+        matches.c.rank,
+        matches.c.position,
+        performer_id.label("performer_id"),
+        performer_name.label("performer_name"),
+    ])
+
+
+def search_catalog(search_str, entity_types=ENTITY_TYPES, page=1,
+                   limit=SEARCH_LIMIT):
+    """Return one page of ranked matches for each of entity_types.
+
+    The result maps each entity type to a dictionary with "matches" (rows
+    with entity_id, name, image_url, performer_id and performer_name) and
+    "more", which is True if there is another page.
+    """
+
+    short = len(search_str) < SHORT_TERM_LENGTH
+    key = (tuple(entity_types), short)
+    statement = _search_statements.get(key)
+
+    if statement is None:
+        statement = union_all(*[
+            ranked_matches(entity_type, id_column, name_column, image_column,
+                           performer_key, short)
+            for entity_type, id_column, name_column, image_column, performer_key
+            in SEARCH_COLUMNS
+            if entity_type in entity_types
+        ]).order_by(
+            literal_column("entity_type"), literal_column("position")
+        )
+        _search_statements[key] = statement
+
+    # One row more than limit is fetched to tell whether there is another
+    # page.
+    params = {
+        "search_str": search_str.lower(),
+        "prefix_pattern": prefix_pattern(search_str),
+        "like_pattern": like_pattern(search_str),
+        "fetch": limit + 1,
+        "offset": (page - 1) * limit,
+    }
+
+    connection = db.session.connection(clause=statement)
+    rows = connection.execution_options(
+        compiled_cache=_compiled_searches
+    ).execute(statement, params).fetchall()
+
+    results = {entity_type: {"matches": [], "more": False}
+               for entity_type in entity_types}
+
+    for row in rows:
+        result = results[row.entity_type]
+
+        if len(result["matches"]) < limit:
+            result["matches"].append(row)
+        else:
+            result["more"] = True
+
+    return results
+
+
+def create_search_indexes():
+    """Add the trigram indexes to a database created before they existed."""
+
+    if db.engine.dialect.name != "postgresql":
+        return
+
+    db.engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for entity_type, id_column, name_column, *_ in SEARCH_COLUMNS:
+        db.engine.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{entity_type}_{name_column.name}_trgm "
+            f"ON {entity_type} USING gin ({name_column.name} gin_trgm_ops)"
+        )
+
+
+if __name__ == "__main__":
+    # Build the search indexes on an existing database.
+
+    from model import connect_to_db
+    from server import app
+
+    connect_to_db(app)
+    create_search_indexes()
+    print("Search indexes created.")
@@ -1,26 +1,29 @@
-import datetime #imported for string to datetime conversions
+import argparse # command line switch between ORM and bulk loading
+import io # file-like wrapper for streaming rows into COPY
+import os # reject file paths
+import time # rows per second reporting
+from concurrent.futures import ProcessPoolExecutor # parallel table loads
 from sqlalchemy import func # will use when adding log-in functionality
 
 # import tables created in model.py
-from model import Producer, Performer, Song, Album, ProduceSong, connect_to_db, db
-from server import app
-
-def load_producers(producer_filename):
+from model import Producer, Performer, Song, Album, ProduceSong, CatalogVersion, connect_to_db, db
+from seed_records import COLUMNS, RejectFile, check_event_references, parse_records
+from seed_sync import get_known_ids, record_seed, sync_all
+from recommend import precompute_all
+from summary import refresh_summaries
+from server import app, list_pages
+
+def load_producers(producer_filename, rejects=None):
     """Load producers from producers.txt into database."""
 
     print("Producers")
 
-    # Complete the for loop defined for every line in producer_filename.
-    for i, row in enumerate(open(producer_filename)):
-        #strip each row of white space
-        row = row.rstrip()
-        # assign variables to strings from file, using the pipe character
-        # as a delimitor
-        producer_id, producer_name, producer_img_url, producer_tag_url = row.split("|")
-
-        if producer_tag_url == '':
-            producer_tag_url = None
+    # parse_records strips, splits and validates each line, skipping (and
+    # recording in rejects) any that can't be loaded.
+    records = parse_records(producer_filename, "producers", rejects)
 
+    for i, (producer_id, producer_name, producer_img_url,
+            producer_tag_url) in enumerate(records):
         producer = Producer(
             producer_id=producer_id,
             producer_name=producer_name,
@@ -39,15 +42,15 @@ def load_producers(producer_filename):
     db.session.commit()
 
 
-def load_performers(performer_filename):
+def load_performers(performer_filename, rejects=None):
     """Load performers from performers.txt into database."""
 
     print("Performers")
 
-    for i, row in enumerate(open(performer_filename)):
-        row = row.rstrip()
-        performer_id, performer_name, performer_img_url = row.split("|")
+    records = parse_records(performer_filename, "performers", rejects)
 
+    for i, (performer_id, performer_name,
+            performer_img_url) in enumerate(records):
         performer = Performer(
             performer_id=performer_id,
             performer_name=performer_name,
@@ -62,39 +65,19 @@ def load_performers(performer_filename):
     db.session.commit()
 
 
-def load_songs(song_filename):
+def load_songs(song_filename, rejects=None):
     """Load songs from songs.txt into database."""
 
     print("Songs")
 
-    for i, row in enumerate(open(song_filename)):
-        row = row.rstrip()
-        song_id, song_title, song_release_date_str, song_release_year_str, song_release_month_str, song_release_day_str, apple_music_player_url = row.split("|")
-
-        if not song_release_year_str or song_release_year_str in('None', 'None"', '') or len(song_release_year_str) != 4:
-            song_release_year_str = None
-
-        if not song_release_month_str or song_release_month_str in('None', 'None"', ''):
-            song_release_month_str = None
-        else:
-            if len(song_release_month_str) == 1:
-                song_release_month_str = "0" + song_release_month_str
-
-        if not song_release_day_str or song_release_day_str in('None', 'None"', ''):
-            song_release_day_str = None
-        else:
-            if len(song_release_day_str) == 1:
-                song_release_day_str = "0" + song_release_day_str
-
-        if song_release_year_str and song_release_month_str and song_release_day_str:
-            song_release_date_str = " ".join([song_release_year_str, song_release_month_str, song_release_day_str])
-            song_release_date = datetime.datetime.strptime(song_release_date_str, "%Y %m %d")
-
+    records = parse_records(song_filename, "songs", rejects)
 
+    for i, (song_id, song_title, apple_music_player_url, song_release_date,
+            song_release_year) in enumerate(records):
         song = Song(
             song_id=song_id, 
             song_title=song_title, 
-            song_release_year=song_release_year_str,
+            song_release_year=song_release_year,
             song_release_date=song_release_date, 
             apple_music_player_url=apple_music_player_url
         )
@@ -114,34 +97,15 @@ def load_songs(song_filename):
     db.session.commit()
 
 
-def load_albums(album_filename):
+def load_albums(album_filename, rejects=None):
     """Load albums from albums.txt into database."""
 
     print("Albums")
 
-    for i, row in enumerate(open(album_filename)):
-        row = row.rstrip()
-        album_id, album_title, cover_art_url, album_release_year_str, album_release_month_str, album_release_day_str = row.split("|")
-
-        if not album_release_year_str or album_release_year_str in('None', 'None"', ''):
-            album_release_year_str = None
-
-        if not album_release_month_str or album_release_month_str in('None', 'None"', ''):
-            album_release_month_str = None
-        else:
-            if len(album_release_month_str) == 1:
-                album_release_month_str = "0" + album_release_month_str
-
-        if not album_release_day_str or album_release_day_str in('None', 'None"', ''):
-            album_release_day_str = None
-        else:
-            if len(album_release_day_str) == 1:
-                album_release_day_str = "0" + album_release_day_str
-
-        if album_release_year_str and album_release_month_str and album_release_day_str:
-            album_release_date_str = " ".join([album_release_year_str, album_release_month_str, album_release_day_str])
-            album_release_date = datetime.datetime.strptime(album_release_date_str, "%Y %m %d")
+    records = parse_records(album_filename, "albums", rejects)
 
+    for i, (album_id, album_title, cover_art_url,
+            album_release_date) in enumerate(records):
         album = Album(
             album_id=album_id, 
             album_title=album_title, 
@@ -159,18 +123,17 @@ def load_albums(album_filename):
     db.session.commit()
 
 
-def load_events(event_filename):
+def load_events(event_filename, rejects=None):
     """Load events from events.txt into database."""
 
     print("Events")
 
-    for i, row in enumerate(open(event_filename)):
-        row = row.rstrip()
-        producer_id, performer_id, song_id, album_id = row.split("|")
-
-        if not album_id:
-            album_id = None
+    # Reject events that point at producers, performers, songs or albums that
+    # didn't make it into the database rather than failing on the foreign key.
+    records = parse_records(event_filename, "produce_songs", rejects,
+                            validate=check_event_references(get_known_ids()))
 
+    for i, (producer_id, performer_id, song_id, album_id) in enumerate(records):
         song = ProduceSong(
             producer_id=producer_id, 
             performer_id=performer_id, 
@@ -188,7 +151,293 @@ def load_events(event_filename):
     db.session.commit()
 
 
+##############################################################################
+# Bulk loading.
+# Rather than building one ORM object per line, stream each pipe-delimited file
+# straight into its table: COPY on Postgres, batched multi-row INSERTs anywhere
+# else.  Secondary indexes are dropped for the duration of the load and rebuilt
+# once the data is in.
+
+# Rows per INSERT statement when COPY isn't available.
+BULK_BATCH_SIZE = 5000
+
+# SQLite caps the number of bound parameters per statement.
+SQLITE_MAX_PARAMS = 999
+
+
+# Tables with no foreign keys between them, which can load side by side.
+INDEPENDENT_TABLES = ["producers", "performers", "songs", "albums"]
+
+
+def _copy_value(value):
+    """Format a single value for Postgres' COPY text format."""
+
+    if value is None:
+        return "\\N"
+
+    return (str(value).replace("\\", "\\\\")
+                      .replace("\t", "\\t")
+                      .replace("\n", "\\n")
+                      .replace("\r", "\\r"))
+
+
+class CopyStream(io.TextIOBase):
+    """Read-only file object that renders row tuples as COPY text on demand.
+
+    psycopg2's copy_expert pulls from this in chunks, so a file of any size is
+    streamed to the server without being held in memory.
+    """
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(_copy_value(value) for value in row) + "\n"
+                       for row in rows)
+        self._buffer = ""
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+                self.count += 1
+            except StopIteration:
+                break
+
+        if size < 0:
+            chunk, self._buffer = self._buffer, ""
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_rows(table, columns, rows):
+    """COPY rows into table on Postgres; return the number of rows loaded."""
+
+    stream = CopyStream(rows)
+    connection = db.engine.raw_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN",
+            stream
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+    return stream.count
+
+
+def insert_rows(table, columns, rows, batch_size=BULK_BATCH_SIZE):
+    """Insert rows with multi-row INSERT statements; return the row count."""
+
+    if db.engine.dialect.name == "sqlite":
+        batch_size = min(batch_size, SQLITE_MAX_PARAMS // len(columns))
+
+    count = 0
+    batch = []
+
+    with db.engine.begin() as connection:
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+
+            if len(batch) == batch_size:
+                connection.execute(table.insert().values(batch))
+                count += len(batch)
+                batch = []
+
+        if batch:
+            connection.execute(table.insert().values(batch))
+            count += len(batch)
+
+    return count
+
+
+def drop_indexes(table):
+    """Drop table's secondary indexes; return them so they can be rebuilt."""
+
+    indexes = list(table.indexes)
+
+    for index in indexes:
+        index.drop(db.engine)
+
+    return indexes
+
+
+def create_indexes(indexes):
+    """Rebuild indexes dropped by drop_indexes."""
+
+    for index in indexes:
+        index.create(db.engine)
+
+
+def bulk_load_table(table, filename, rejects=None, validate=None):
+    """Stream filename into table; return (rows loaded, seconds taken)."""
+
+    start_time = time.perf_counter()
+
+    indexes = drop_indexes(table)
+    columns = COLUMNS[table.name]
+    rows = parse_records(filename, table.name, rejects, validate)
+
+    if db.engine.dialect.name == "postgresql":
+        count = copy_rows(table, columns, rows)
+    else:
+        count = insert_rows(table, columns, rows)
+
+    load_time = time.perf_counter() - start_time
+
+    create_indexes(indexes)
+
+    if db.engine.dialect.name == "postgresql":
+        db.engine.execute(f"ANALYZE {table.name}")
+
+    total_time = time.perf_counter() - start_time
+    rate = count / load_time if load_time else float(count)
+
+    print(f"{table.name}: {count} rows in {total_time:.2f}s "
+          f"({rate:,.0f} rows/s, indexes {total_time - load_time:.2f}s)")
+
+    return count, total_time
+
+
+def reject_filename(reject_dir, table_name):
+    """Return the reject file path for table_name."""
+
+    return os.path.join(reject_dir, f"{table_name}.rejects.txt")
+
+
+def _init_worker(db_uri):
+    """Give each worker process its own connections to the database."""
+
+    connect_to_db(app, db_uri)
+
+    # Connections inherited from the parent over fork must not be shared.
+    db.engine.dispose()
+
+
+def _bulk_load_worker(table_name, filename, reject_dir):
+    """Load one table in a worker process; return (table, rows, seconds, rejects)."""
+
+    table = db.metadata.tables[table_name]
+    rejects = RejectFile(reject_filename(reject_dir, table_name))
+
+    try:
+        count, seconds = bulk_load_table(table, filename, rejects)
+    finally:
+        rejects.close()
+
+    return table_name, count, seconds, rejects.count
+
+
+def _bulk_load_events(event_filename, reject_dir):
+    """Load events, rejecting any that reference rows that weren't loaded."""
+
+    rejects = RejectFile(reject_filename(reject_dir, "produce_songs"))
+
+    try:
+        count, seconds = bulk_load_table(
+            ProduceSong.__table__, event_filename, rejects,
+            validate=check_event_references(get_known_ids())
+        )
+    finally:
+        rejects.close()
+
+    return "produce_songs", count, seconds, rejects.count
+
+
+def bulk_load(filenames, reject_dir="seed_rejects", workers=4):
+    """Bulk load every seed file, reporting rows per second for each table.
+
+    filenames maps table name to the seed file for that table.  Producers,
+    performers, songs and albums load at the same time in up to workers
+    processes; events are applied once they are all in, so the load takes
+    as long as the slowest table rather than the sum of all of them.  Rows
+    that can't be loaded are written to one reject file per table in
+    reject_dir.
+    """
+
+    start_time = time.perf_counter()
+
+    # SQLite allows only one writer at a time.
+    if db.engine.dialect.name == "sqlite":
+        workers = 1
+
+    if workers > 1:
+        db_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+
+        # Release the parent's pooled connections before forking.
+        db.engine.dispose()
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(db_uri,)) as executor:
+            futures = [executor.submit(_bulk_load_worker, table_name,
+                                       filenames[table_name], reject_dir)
+                       for table_name in INDEPENDENT_TABLES]
+
+            results = [future.result() for future in futures]
+    else:
+        results = [_bulk_load_worker(table_name, filenames[table_name],
+                                     reject_dir)
+                   for table_name in INDEPENDENT_TABLES]
+
+    results.append(_bulk_load_events(filenames["produce_songs"], reject_dir))
+
+    for table_name, count, seconds, reject_count in results:
+        if reject_count:
+            print(f"{table_name}: {reject_count} rows rejected, see "
+                  f"{reject_filename(reject_dir, table_name)}")
+
+    print(f"Loaded in {time.perf_counter() - start_time:.2f}s")
+
+
+def publish_catalog(summaries=True):
+    """Rebuild what's derived from a newly loaded catalog and bump the
+    catalog version; return the new version.
+
+    summaries=False skips rebuilding the chart summary tables, for loads
+    that keep them up to date themselves.  Related producers and performers
+    and list page boundaries are stored for the next version before it's
+    published, so servers never find the version without them.
+    """
+
+    if summaries:
+        refresh_summaries()
+
+    version = CatalogVersion.current() + 1
+
+    precompute_all(version)
+
+    for pagination in list_pages:
+        pagination.store_boundaries(version)
+
+    # Let running servers know to rebuild anything derived from the catalog.
+    version = CatalogVersion.bump()
+    print(f"Catalog version {version}")
+
+    return version
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the music database.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="stream files in with COPY/batched INSERTs")
+    parser.add_argument("--sync", action="store_true",
+                        help="upsert only new and changed rows and events")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="processes loading tables side by side (--bulk)")
+    parser.add_argument("--rejects", default="seed_rejects",
+                        help="directory for rows that couldn't be loaded")
+    args = parser.parse_args()
+
     connect_to_db(app)
     db.create_all()
 
@@ -197,8 +446,43 @@ if __name__ == "__main__":
     song_filename = "seed_data/songs.txt"
     album_filename = "seed_data/albums.txt"
     event_filename = "seed_data/events.txt"
-    load_producers(producer_filename)
-    load_performers(performer_filename)
-    load_songs(song_filename)
-    load_albums(album_filename)
-    load_events(event_filename)
+
+    filenames = {
+        "producers": producer_filename,
+        "performers": performer_filename,
+        "songs": song_filename,
+        "albums": album_filename,
+        "produce_songs": event_filename,
+    }
+
+    if args.sync:
+        rejects = RejectFile(os.path.join(args.rejects, "sync.rejects.txt"))
+
+        sync_all(filenames, rejects)
+
+        rejects.close()
+
+        # sync_all keeps the chart summary tables up to date.
+        publish_catalog(summaries=False)
+    elif args.bulk:
+        bulk_load(filenames, reject_dir=args.rejects, workers=args.workers)
+
+        # So the next --sync only writes what has changed since.
+        record_seed(filenames)
+        publish_catalog()
+    else:
+        rejects = RejectFile(os.path.join(args.rejects, "rejects.txt"))
+
+        load_producers(producer_filename, rejects)
+        load_performers(performer_filename, rejects)
+        load_songs(song_filename, rejects)
+        load_albums(album_filename, rejects)
+        load_events(event_filename, rejects)
+
+        rejects.close()
+
+        if rejects.count:
+            print(f"{rejects.count} rows rejected, see {rejects.reject_filename}")
+
+        record_seed(filenames)
+        publish_catalog()
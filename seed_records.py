@@ -0,0 +1,245 @@
+"""Streaming, validating parser for the pipe-delimited files in seed_data/."""
+
+import datetime
+import os
+
+# Values scraped from the Genius API that stand in for "no value".
+NULL_STRINGS = ('None', 'None"', '')
+
+
+class RejectedRow(ValueError):
+    """Raised by a row parser when a row can't be loaded."""
+
+
+class RejectFile(object):
+    """Append rejected rows, with file name, line number and reason, to a file.
+
+    Each line of the reject file reads:
+        <seed filename>:<line number>|<reason>|<original row>
+    The file is only created once the first row is rejected.
+    """
+
+    def __init__(self, reject_filename):
+        self.reject_filename = reject_filename
+        self.count = 0
+        self._file = None
+
+    def write(self, filename, line_number, row, reason):
+        if self._file is None:
+            directory = os.path.dirname(self.reject_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.reject_filename, "a")
+
+        self._file.write(f"{filename}:{line_number}|{reason}|{row}\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+##############################################################################
+# Field converters.
+
+def to_id(value, name):
+    """Return value as an int id."""
+
+    try:
+        return int(value)
+    except ValueError:
+        raise RejectedRow(f"{name} is not an integer: {value!r}")
+
+
+def to_text(value, name):
+    """Return value, which is required."""
+
+    if value in NULL_STRINGS:
+        raise RejectedRow(f"{name} is empty")
+
+    return value
+
+
+def to_optional_text(value):
+    """Return value, or None for the Genius null strings."""
+
+    if value in NULL_STRINGS:
+        return None
+
+    return value
+
+
+def to_year(value):
+    """Return a four digit year as an integer, or None."""
+
+    if value in NULL_STRINGS or len(value) != 4 or not value.isdigit():
+        return None
+
+    return int(value)
+
+
+def to_date(year_str, month_str, day_str, name):
+    """Return a datetime from year, month and day strings, or None if any of
+    them is missing.  Month and day may be one or two digits."""
+
+    if to_year(year_str) is None or month_str in NULL_STRINGS or day_str in NULL_STRINGS:
+        return None
+
+    date_str = " ".join([year_str, month_str.zfill(2), day_str.zfill(2)])
+
+    try:
+        return datetime.datetime.strptime(date_str, "%Y %m %d")
+    except ValueError:
+        raise RejectedRow(f"{name} is not a valid date: {date_str!r}")
+
+
+##############################################################################
+# Row parsers.
+# Each takes the row's fields and returns a tuple of column values in the
+# order of the matching COLUMNS entry, raising RejectedRow if it can't.
+
+COLUMNS = {
+    "producers": ["producer_id", "producer_name", "producer_img_url",
+                  "producer_tag_url"],
+    "performers": ["performer_id", "performer_name", "performer_img_url"],
+    "songs": ["song_id", "song_title", "apple_music_player_url",
+              "song_release_date", "song_release_year"],
+    "albums": ["album_id", "album_title", "cover_art_url",
+               "album_release_date"],
+    "produce_songs": ["producer_id", "performer_id", "song_id", "album_id"],
+}
+
+
+def parse_producer(fields):
+    producer_id, producer_name, producer_img_url, producer_tag_url = fields
+
+    return (to_id(producer_id, "producer_id"),
+            to_text(producer_name, "producer_name"),
+            to_optional_text(producer_img_url),
+            to_optional_text(producer_tag_url))
+
+
+def parse_performer(fields):
+    performer_id, performer_name, performer_img_url = fields
+
+    return (to_id(performer_id, "performer_id"),
+            to_text(performer_name, "performer_name"),
+            to_optional_text(performer_img_url))
+
+
+def parse_song(fields):
+    (song_id, song_title, song_release_date_str, song_release_year_str,
+     song_release_month_str, song_release_day_str,
+     apple_music_player_url) = fields
+
+    song_release_year = to_year(song_release_year_str)
+
+    return (to_id(song_id, "song_id"),
+            to_text(song_title, "song_title"),
+            apple_music_player_url,
+            to_date(song_release_year_str, song_release_month_str,
+                    song_release_day_str, "song_release_date"),
+            song_release_year)
+
+
+def parse_album(fields):
+    (album_id, album_title, cover_art_url, album_release_year_str,
+     album_release_month_str, album_release_day_str) = fields
+
+    return (to_id(album_id, "album_id"),
+            to_text(album_title, "album_title"),
+            to_optional_text(cover_art_url),
+            to_date(album_release_year_str, album_release_month_str,
+                    album_release_day_str, "album_release_date"))
+
+
+def parse_event(fields):
+    producer_id, performer_id, song_id, album_id = fields
+
+    return (to_id(producer_id, "producer_id"),
+            to_id(performer_id, "performer_id"),
+            to_id(song_id, "song_id"),
+            to_id(album_id, "album_id") if album_id else None)
+
+
+# Number of pipe-delimited fields per line.  Songs and albums carry their
+# release date as separate year, month and day fields.
+FIELD_COUNTS = {
+    "producers": 4,
+    "performers": 3,
+    "songs": 7,
+    "albums": 6,
+    "produce_songs": 4,
+}
+
+PARSERS = {
+    "producers": parse_producer,
+    "performers": parse_performer,
+    "songs": parse_song,
+    "albums": parse_album,
+    "produce_songs": parse_event,
+}
+
+
+def check_event_references(known_ids):
+    """Return a validator rejecting events whose ids weren't loaded.
+
+    known_ids maps "producers", "performers", "songs" and "albums" to sets of
+    the ids present in the database.
+    """
+
+    def check(record):
+        producer_id, performer_id, song_id, album_id = record
+
+        if producer_id not in known_ids["producers"]:
+            raise RejectedRow(f"unknown producer_id {producer_id}")
+        if performer_id not in known_ids["performers"]:
+            raise RejectedRow(f"unknown performer_id {performer_id}")
+        if song_id not in known_ids["songs"]:
+            raise RejectedRow(f"unknown song_id {song_id}")
+        if album_id is not None and album_id not in known_ids["albums"]:
+            raise RejectedRow(f"unknown album_id {album_id}")
+
+    return check
+
+
+def parse_records(filename, table_name, rejects=None, validate=None):
+    """Yield validated, normalised column tuples for each row of filename.
+
+    Rows with the wrong number of fields, or that the table's parser (or the
+    optional validate callable) rejects, are written to rejects with their
+    line number and skipped, so one bad row doesn't end the load.  Without a
+    RejectFile, bad rows raise RejectedRow.
+    """
+
+    parse_row = PARSERS[table_name]
+    field_count = FIELD_COUNTS[table_name]
+
+    with open(filename) as seed_file:
+        for line_number, row in enumerate(seed_file, start=1):
+            row = row.rstrip("\r\n")
+
+            if not row.strip():
+                continue
+
+            fields = row.split("|")
+
+            try:
+                if len(fields) != field_count:
+                    raise RejectedRow(
+                        f"expected {field_count} fields, found {len(fields)}"
+                    )
+
+                record = parse_row(fields)
+
+                if validate is not None:
+                    validate(record)
+            except RejectedRow as error:
+                if rejects is None:
+                    raise RejectedRow(f"{filename}:{line_number}: {error}")
+
+                rejects.write(filename, line_number, row, error)
+                continue
+
+            yield record
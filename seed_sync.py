@@ -0,0 +1,290 @@
+"""Incremental sync of seed_data/ into an already seeded database.
+
+Rather than recreating every table, each seed file and each of its rows is
+fingerprinted.  Files that haven't changed since the last sync are skipped;
+otherwise only producers, performers, songs and albums whose rows are new or
+different are written, keyed by their Genius ids, and produce_songs is
+brought in line by inserting and deleting just the events that differ.
+Producers, performers, songs and albums dropped from their files are kept:
+events and other tables may still refer to them, so sync never deletes them.
+
+seed.py's full and bulk loads fingerprint the files they load (record_seed),
+so the first sync after one only writes what has changed since.
+
+Every table is synced in its own transaction, so the site keeps serving the
+previous data until each one commits.
+"""
+
+import datetime
+import hashlib
+from collections import Counter
+
+from sqlalchemy import bindparam
+
+from model import Album, Performer, Producer, ProduceSong, SeedFile, SeedRow
+from model import Song, db
+from seed_records import COLUMNS, check_event_references, parse_records
+from summary import apply_event_changes, refresh_summaries
+
+# Tables synced by primary key, in dependency order.
+ENTITY_TABLES = ["producers", "performers", "songs", "albums"]
+
+# Rows per executemany batch.
+SYNC_BATCH_SIZE = 1000
+
+
+def file_digest(filename):
+    """Return the SHA-1 hex digest of filename's contents."""
+
+    digest = hashlib.sha1()
+
+    with open(filename, "rb") as seed_file:
+        for chunk in iter(lambda: seed_file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def row_digest(record):
+    """Return a fingerprint of a parsed record."""
+
+    return hashlib.sha1(repr(record).encode("utf-8")).hexdigest()
+
+
+def file_unchanged(table_name, digest):
+    """Return True if table_name's file matches the fingerprint on record."""
+
+    seed_file = SeedFile.query.get(table_name)
+
+    return seed_file is not None and seed_file.file_digest == digest
+
+
+def record_file(connection, table_name, digest):
+    """Store the fingerprint of table_name's file."""
+
+    seed_files = SeedFile.__table__
+
+    connection.execute(
+        seed_files.delete().where(seed_files.c.table_name == table_name)
+    )
+    connection.execute(seed_files.insert().values(
+        table_name=table_name,
+        file_digest=digest,
+        synced_at=datetime.datetime.now()
+    ))
+
+
+def _batches(items, size=SYNC_BATCH_SIZE):
+    """Yield successive lists of up to size items."""
+
+    batch = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def sync_entities(table_name, filename, rejects=None):
+    """Upsert the new and changed rows of one entity table.
+
+    Returns (inserted, updated) row counts.
+    """
+
+    table = db.metadata.tables[table_name]
+    seed_rows = SeedRow.__table__
+    columns = COLUMNS[table_name]
+    primary_key = table.c[columns[0]]
+
+    digest = file_digest(filename)
+
+    if file_unchanged(table_name, digest):
+        return 0, 0
+
+    known_digests = dict(
+        db.session.query(SeedRow.row_id, SeedRow.row_digest)
+                  .filter(SeedRow.table_name == table_name)
+    )
+    existing_ids = {id for id, in db.session.query(primary_key)}
+    db.session.commit()
+
+    inserts = []
+    updates = []
+
+    for record in parse_records(filename, table_name, rejects):
+        fingerprint = row_digest(record)
+        row_id = record[0]
+
+        if known_digests.get(row_id) == fingerprint and row_id in existing_ids:
+            continue
+
+        values = dict(zip(columns, record))
+
+        if row_id in existing_ids:
+            updates.append((values, fingerprint))
+        else:
+            inserts.append((values, fingerprint))
+
+    update_table = table.update().where(
+        primary_key == bindparam("b_" + primary_key.name)
+    ).values({name: bindparam(name) for name in columns[1:]})
+
+    with db.engine.begin() as connection:
+        for batch in _batches(inserts):
+            connection.execute(table.insert(), [values for values, _ in batch])
+
+        for batch in _batches(updates):
+            connection.execute(update_table, [
+                dict(values, **{"b_" + primary_key.name: values[primary_key.name]})
+                for values, _ in batch
+            ])
+
+        # Replace the fingerprints of every row written.
+        for batch in _batches(inserts + updates):
+            row_ids = [values[primary_key.name] for values, _ in batch]
+
+            connection.execute(seed_rows.delete().where(
+                (seed_rows.c.table_name == table_name) &
+                (seed_rows.c.row_id.in_(row_ids))
+            ))
+            connection.execute(seed_rows.insert(), [
+                {"table_name": table_name,
+                 "row_id": values[primary_key.name],
+                 "row_digest": fingerprint}
+                for values, fingerprint in batch
+            ])
+
+        record_file(connection, table_name, digest)
+
+    return len(inserts), len(updates)
+
+
+def get_known_ids():
+    """Return the sets of producer, performer, song and album ids loaded."""
+
+    return {
+        "producers": {id for id, in db.session.query(Producer.producer_id)},
+        "performers": {id for id, in db.session.query(Performer.performer_id)},
+        "songs": {id for id, in db.session.query(Song.song_id)},
+        "albums": {id for id, in db.session.query(Album.album_id)},
+    }
+
+
+def record_seed(filenames):
+    """Store the fingerprints of seed files just loaded in full and of every
+    row in them, as sync_entities() and sync_events() would have.
+    """
+
+    seed_rows = SeedRow.__table__
+
+    with db.engine.begin() as connection:
+        for table_name in ENTITY_TABLES:
+            filename = filenames[table_name]
+
+            # The last row for an id is the one loaded.
+            digests = {record[0]: row_digest(record)
+                       for record in parse_records(filename, table_name)}
+
+            connection.execute(
+                seed_rows.delete().where(seed_rows.c.table_name == table_name)
+            )
+
+            for batch in _batches(digests.items()):
+                connection.execute(seed_rows.insert(), [
+                    {"table_name": table_name, "row_id": row_id,
+                     "row_digest": fingerprint}
+                    for row_id, fingerprint in batch
+                ])
+
+            record_file(connection, table_name, file_digest(filename))
+
+        record_file(connection, "produce_songs",
+                    file_digest(filenames["produce_songs"]))
+
+
+def sync_events(filename, rejects=None, known_ids=None):
+    """Apply the difference between events.txt and produce_songs.
+
+    Events have no id of their own in the seed file, so they are compared
+    as (producer_id, performer_id, song_id, album_id) tuples, duplicates
+    included.  Returns (inserted, deleted) row counts.
+    """
+
+    events = ProduceSong.__table__
+    digest = file_digest(filename)
+
+    if file_unchanged("produce_songs", digest):
+        return 0, 0
+
+    validate = check_event_references(known_ids) if known_ids else None
+    wanted = Counter(parse_records(filename, "produce_songs", rejects, validate))
+
+    # Walk the current events once, keeping the ids of surplus copies.
+    surplus_ids = []
+    surplus_events = []
+    stored = Counter()
+
+    for event_id, *event in db.session.query(
+            ProduceSong.event_id,
+            ProduceSong.producer_id,
+            ProduceSong.performer_id,
+            ProduceSong.song_id,
+            ProduceSong.album_id
+    ).yield_per(SYNC_BATCH_SIZE):
+        event = tuple(event)
+        stored[event] += 1
+
+        if stored[event] > wanted[event]:
+            surplus_ids.append(event_id)
+            surplus_events.append(event)
+
+    db.session.commit()
+
+    additions = []
+
+    for event, count in (wanted - stored).items():
+        additions.extend([event] * count)
+
+    columns = COLUMNS["produce_songs"]
+
+    with db.engine.begin() as connection:
+        for batch in _batches(surplus_ids):
+            connection.execute(events.delete().where(events.c.event_id.in_(batch)))
+
+        for batch in _batches(additions):
+            connection.execute(events.insert(),
+                               [dict(zip(columns, event)) for event in batch])
+
+        # Keep the chart summary tables in step with the events.
+        apply_event_changes(connection, additions, surplus_events)
+
+        record_file(connection, "produce_songs", digest)
+
+    return len(additions), len(surplus_ids)
+
+
+def sync_all(filenames, rejects=None):
+    """Incrementally sync every seed file, printing what changed.
+
+    filenames maps table name to the seed file for that table.
+    """
+
+    for table_name in ENTITY_TABLES:
+        inserted, updated = sync_entities(table_name, filenames[table_name],
+                                          rejects)
+
+        print(f"{table_name}: {inserted} inserted, {updated} updated")
+
+        # Changed release years move events between producer_year_counts rows.
+        if table_name == "songs" and updated:
+            refresh_summaries(years_only=True)
+
+    inserted, deleted = sync_events(filenames["produce_songs"], rejects,
+                                    get_known_ids())
+
+    print(f"produce_songs: {inserted} inserted, {deleted} deleted")
@@ -1,35 +1,118 @@
+import hashlib
+
 # For feeding variables to templates.
 from jinja2 import StrictUndefined
 
 # For helpful debugging.
-from flask import Flask, redirect, render_template, request, session, flash
-from flask import jsonify
-from flask_paginate import Pagination, get_page_args
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Flask, abort, redirect, render_template, request, flash
+from flask import before_render_template, jsonify, template_rendered
+from flask_paginate import Pagination
 
 # Tables for jQuery and SQLAlchemy queries.
-from model import connect_to_db, db
+from sqlalchemy import bindparam
+
+from model import bakery, connect_to_db, db
 from model import Producer, Performer, Song, Album, ProduceSong
-from sqlalchemy import cast, Numeric
-from sqlalchemy.ext import baked
-# For API calls.
-import requests
-# For Chart.js color generation.
-import random
-import pandas as pd    # data formatting
-import numpy as np     # numeric library
-from sklearn.neighbors import KNeighborsClassifier  # machine learning
-from sklearn.externals import joblib
-from sklearn.metrics import confusion_matrix
+from search import ENTITY_TYPES, search_catalog
+from autocomplete import AutocompleteService
+from pagination import KeysetPagination, page_args
+from query_stats import init_query_stats, streamed_response
+from query_guard import init_query_guard
+from metrics import init_metrics, metrics_response
+from charts import cached_json, performer_frequency, producer_frequency
+from charts import producer_productivity
+from catalog_cache import CatalogCache
+from lazy_service import LazyService, lazy_function
+from page_cache import PageCache
 
 # Create Flask app.
 app = Flask(__name__)
 app.jinja_env.undefined = StrictUndefined
 app.jinja_env.auto_reload = True
 
+# Template writes per chunk when streaming list pages.
+STREAM_BUFFER = 50
+
 # Required for Flask sessions and debug toolbar use
 app.secret_key = "ABC"
 
+# Count queries, rows and SQL time per request for every view.
+init_query_stats(app)
+
+# In development and tests, flag N+1s and budget overruns (QUERY_GUARD).
+init_query_guard(app)
+
+# Export latency, SQL and template render metrics on /metrics.
+init_metrics(app)
+
+# The services below need numpy, scipy or requests, so their modules are
+# imported by the first request that uses them (see lazy_service.py).
+
+# Performer bios from Genius, served from cache and refreshed in the background.
+bios = LazyService("bio_service", "BioService", app)
+
+# Related producers and performers, loaded once per catalog version.
+recommendations = LazyService("recommend", "RecommendationService", app)
+
+# Producer-performer collaboration graph behind /data.json and /path.json.
+collaboration_graph = CatalogCache(app, lazy_function("graph", "load_graph"))
+
+# Per-producer song counts, performer counts and years behind
+# /producer_bubbles.json.
+producer_activity = CatalogCache(app, lazy_function("bubbles",
+                                                    "load_producer_activity"))
+
+# Rendered detail and list pages, kept until the catalog changes.
+pages = PageCache()
+
+# In-memory prefix index behind /autocomplete.json.
+autocomplete = AutocompleteService(app)
+
+# Keyset paginators for the list pages.
+producer_pages = KeysetPagination("producers", Producer, Producer.producer_name,
+                                  Producer.producer_id)
+performer_pages = KeysetPagination("performers", Performer,
+                                   Performer.performer_name,
+                                   Performer.performer_id)
+song_pages = KeysetPagination("songs", Song, Song.song_title, Song.song_id)
+album_pages = KeysetPagination("albums", Album, Album.album_title, Album.album_id)
+
+# Their page boundaries are stored by seed.py as it publishes the catalog.
+list_pages = [producer_pages, performer_pages, song_pages, album_pages]
+
+
+def render_list(template_name, **context):
+    """Render a list template, streamed to the client as it renders when
+    the app is configured with STREAM_TEMPLATES (see wsgi.py).
+    """
+
+    if not app.config.get("STREAM_TEMPLATES"):
+        return render_template(template_name, **context)
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+
+    # Send a chunk every few dozen template writes rather than each one.
+    stream.enable_buffering(STREAM_BUFFER)
+
+    def render():
+        # Signalled as render_template does, so metrics.py times the render
+        # and query_guard.py sees the queries run while it renders.
+        before_render_template.send(app, template=template, context=context)
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+
+    return streamed_response(render(), mimetype="text/html")
+
+
+@app.before_first_request
+def warm_autocomplete():
+    """Build the autocomplete index in the background as the worker starts."""
+
+    autocomplete.build_in_background()
+
+
 @app.route("/")
 def index():
     """Show homepage."""
@@ -54,111 +137,203 @@ def return_search_result():
     """Return user's search results."""
 
     # Search string user enters gathered from the form on the homepage.
-    search_str = request.args.get("search_str")
+    search_str = request.args.get("search_str", "")
+
+    # "Load more" links page through a single entity type.
+    entity_type = request.args.get("type")
+    page = request.args.get("page", 1, type=int)
+
+    if entity_type in ENTITY_TYPES:
+        entity_types = [entity_type]
+    else:
+        entity_types = ENTITY_TYPES
+        page = 1
 
-    # Return the producer(s), performer(s), song(s), and album(s)
-    # that match the search string (not case-sensitive), alphabetized.
+    # Return the top producer(s), performer(s), song(s), and album(s) that
+    # match the search string (not case-sensitive): exact matches, then
+    # prefix matches, then the rest, alphabetized.
     if len(search_str) > 0:
-        sql_search_str = f"%{search_str}%"
-
-        producers = Producer.query.order_by(
-            "producer_name"
-        ).filter(
-            Producer.producer_name.ilike(sql_search_str)
-        ).all()
-
-        performers = Performer.query.order_by(
-            "performer_name"
-        ).filter(
-            Performer.performer_name.ilike(sql_search_str)
-        ).all()
-
-        songs = Song.query.order_by(
-            "song_title"
-        ).filter(
-            Song.song_title.ilike(sql_search_str)
-        ).options(
-            db.joinedload(
-                "performers"
-            )
-        ).all()
-
-        albums = Album.query.order_by(
-            "album_title"
-        ).filter(
-            Album.album_title.ilike(sql_search_str)
-        ).options(
-            db.joinedload(
-                "performers"
-            )
-        ).all()
+        results = search_catalog(search_str, entity_types, max(page, 1))
     else:
-        producers = None
-        performers = None
-        songs = None
-        albums = None
+        results = {}
 
     return render_template("search_result.html",
-                            producers=producers,
-                            performers=performers,
-                            songs=songs,
-                            albums=albums
+                            search_str=search_str,
+                            page=page,
+                            producers=results.get("producers"),
+                            performers=results.get("performers"),
+                            songs=results.get("songs"),
+                            albums=results.get("albums")
                           )
 
 
 
+@app.route("/metrics")
+def metrics():
+    """Return request, SQL and template metrics for Prometheus."""
+
+    return metrics_response()
+
+
+@app.route("/autocomplete.json")
+def autocomplete_json():
+    """Return the top producers, performers, songs and albums whose names
+    start with q, for the search bar's typeahead."""
+
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", 10, type=int)
+
+    results = [
+        {"type": entity_type, "id": entity_id, "name": name, "url": url}
+        for entity_type, entity_id, name, url, popularity
+        in autocomplete.lookup(query, limit)
+    ]
+
+    return jsonify({"query": query, "results": results})
+
+
 @app.route("/producers")
+@pages.cached(lambda: "producers-%d-%d" % page_args())
 def producer_list():
     """Show list of producers."""
 
-    # Query for all producers in database; return results alphabetized.
-    producers = Producer.query.order_by("producer_name").all()
-
-    page, per_page, offset = get_page_args(
-            page_parameter="page", per_page_parameter="per_page"
-        )
-
-    per_page = 100
+    page, per_page = page_args()
 
-    offset = (page - 1) * per_page
-    total = len(producers)
+    # Return only the requested page of producers, alphabetized.
+    producers = producer_pages.page(page, per_page)
 
-    pagination_producers = producers[offset : offset + per_page]
     pagination = Pagination(
-        page=page, per_page=per_page, total=total, css_framework="bootstrap4"
+        page=page, per_page=per_page, total=producer_pages.total(),
+        css_framework="bootstrap4"
     )
 
-    return render_template(
+    return render_list(
         "producer_list.html", 
-        producers=pagination_producers,
+        producers=producers,
         page=page,
         per_page=per_page,
         pagination=pagination
     )
 
 
+def get_or_404(model, entity_id):
+    """Return the model row with primary key entity_id, or abort with a 404."""
+
+    # Baked once per model: the model is part of the key.
+    query = bakery(lambda session: session.query(model), model)
+    entity = query(db.session()).get(entity_id)
+
+    if entity is None:
+        abort(404)
+
+    return entity
+
+
+def album_timeline(event_column, entity_id):
+    """Return album years, albums by year and singles for a producer or
+    performer.
+
+    event_column is the ProduceSong column (producer_id or performer_id) to
+    match entity_id against.  One column-restricted query reads the entity's
+    events, so the row count is the number of events rather than the product
+    of albums, songs and producers.  Returns:
+        album_years: release years in descending order
+        timeline: (year, albums) pairs in the same order; each album has
+                  album_id, album_title, cover_art_url, performer_id,
+                  performer_name and songs
+        singles: songs that aren't on a dated album
+    Each song has song_id, song_title, performer_id and performer_name.
+    """
+
+    # Baked once per event column: the column's name is part of the key.
+    query = bakery(lambda session: session.query(
+        ProduceSong.album_id,
+        Album.album_title,
+        Album.cover_art_url,
+        Album.album_release_date,
+        ProduceSong.song_id,
+        Song.song_title,
+        ProduceSong.performer_id,
+        Performer.performer_name
+    ).join(
+        Song, Song.song_id == ProduceSong.song_id
+    ).join(
+        Performer, Performer.performer_id == ProduceSong.performer_id
+    ).outerjoin(
+        Album, Album.album_id == ProduceSong.album_id
+    ).order_by(
+        ProduceSong.event_id
+    ))
+    query.add_criteria(lambda q: q.filter(event_column == bindparam("entity_id")),
+                       event_column.key)
+
+    events = query(db.session()).params(entity_id=entity_id).all()
+
+    albums = {}
+    singles = {}
+    album_song_ids = set()
+
+    for event in events:
+        song = {
+            "song_id": event.song_id,
+            "song_title": event.song_title,
+            "performer_id": event.performer_id,
+            "performer_name": event.performer_name,
+        }
+
+        if event.album_id is None or event.album_release_date is None:
+            singles.setdefault(event.song_id, song)
+            continue
+
+        album = albums.setdefault(event.album_id, {
+            "album_id": event.album_id,
+            "album_title": event.album_title,
+            "cover_art_url": event.cover_art_url,
+            "year": event.album_release_date.strftime("%Y"),
+            "performer_id": event.performer_id,
+            "performer_name": event.performer_name,
+            "songs": {},
+        })
+        album["songs"].setdefault(event.song_id, song)
+        album_song_ids.add(event.song_id)
+
+    album_years = sorted(set(album["year"] for album in albums.values()),
+                         reverse=True)
+
+    timeline = []
+
+    for year in album_years:
+        year_albums = []
+
+        for album in albums.values():
+            if album["year"] == year:
+                year_albums.append(dict(album, songs=list(album["songs"].values())))
+
+        timeline.append((year, year_albums))
+
+    singles = [song for song_id, song in singles.items()
+               if song_id not in album_song_ids]
+
+    return album_years, timeline, singles
+
+
 # Each producer's page's url will include the producer's database id.
 @app.route("/producers/<int:producer_id>")
+@pages.cached(lambda producer_id: f"producer-{producer_id}-"
+                                  f"{recommendations.loaded_version()}")
 def producer_detail(producer_id):
     """Show producer's details."""
 
     # URL from which to make API calls.
     # URL = f"https://genius.com/api/artists/{producer_id}"
 
-    # Method "joinedload" employed to reduce # of queries run for output.
-    producer = Producer.query.options(db.joinedload("albums")
-                                        .joinedload("songs")
-                                        .joinedload("producers")
-                                    ).get(producer_id)
+    producer = get_or_404(Producer, producer_id)
 
-    all_producers = Producer.query.all()
-
-    albums = producer.albums # list
-    
-    # Return the album release years in descending chronological order.
-    album_years = sorted(set([album.album_release_date.strftime("%Y")
-                              for album in albums]
-                             ),reverse=True)
+    # The producer's albums, grouped by release year in descending
+    # chronological order, and songs without an album, from one
+    # column-restricted query over the producer's events.
+    album_years, timeline, singles = album_timeline(ProduceSong.producer_id,
+                                                    producer_id)
 
     # j = requests.get(URL).json()
 
@@ -166,331 +341,151 @@ def producer_detail(producer_id):
     # if j["meta"]["status"] == 200:
     #     bio = j["response"]["artist"].get("description_preview","")
 
-    # Store producer_id in session.
-    session["producer_id"] = producer_id
-
-    # Return related performers with knn ML algorithm.
-    # data = pd.read_csv('seed_data/scores.csv')
-    # d = data.pivot(index='producer_id', columns='performer_id', values='score')
-    # knn
-    # model = joblib.load('static/model/trained-model_producers.pkl')
-
-    # Shape model to the dimensions of the dataset.
-    # dist, ind = model.kneighbors(d.loc[producer_id,:].values.reshape(1, -1))
-    # related_producers = [list(d.index)[i] for i in ind[0]]
-    # # The producer being searched is included in the neighbors list.  Remove it
-    # # before passing list to Jinja with pop left equivalent method.
-    # related_producers.pop(0)
-
-    # Calculate page_runtime.
-    # print(f"total_time = {end_time - start_time}")
+    # Related producers, precomputed with kNN.
+    related_producers = recommendations.lookup("producer", producer_id)
 
     return render_template("producer.html",
                             producer=producer,
-                            all_producers=all_producers,
-                            album_years=album_years
+                            album_years=album_years,
+                            timeline=timeline,
+                            singles=singles,
                             # bio=bio,
-                            # related_producers=related_producers
+                            related_producers=related_producers
                           )
 
 
-@app.route("/producer-frequency.json")
-def generate_producer_performer_frequency_donut_chart():
-    """Create producer to performer frequency donut chart."""
-
-    # Retrieve producer_id from the session for producer_song_tuples query.
-    producer_id = session["producer_id"]
-
-    # Create list of tuples; value @ 1st index = performer_name; 
-    # value @ 2nd = song count.
-    producer_song_tuples = db.session.query(
-        Performer.performer_name, 
-        db.func.count(ProduceSong.song_id)
-    ).join(
-        ProduceSong
-    ).filter(
-        ProduceSong.producer_id == producer_id
-    ).group_by(
-        Performer.performer_name
-    ).order_by(
-        Performer.performer_name
-    ).all()
-
-    # Loop through range of song tuple to feed labels (performer_name) 
-    # and data (song counts) to dictionary.
-    labels = []
-    data = []
-    background_color = []
-
-    for producer_song in producer_song_tuples:
-        performer, song_count = producer_song
-
-        labels.append(performer)
-        data.append(song_count)
-
-        # Generate chart colors using random's randint method.
-        random_red = random.randint(0,255)
-        random_green = random.randint(0,255)
-        random_blue = random.randint(0,255)
-        random_color = f"rgba({random_red},{random_green},{random_blue},1)"
-
-        background_color.append(random_color)
-
-    # Dictionary Chart.js will use to create donut chart.
-    return jsonify({
-        "labels": labels,
-        "datasets": [
-            {
-                "data": data,
-                "backgroundColor": background_color,
-                # "hoverBackgroundColor": []
-            }
-        ]
-    })
-
+@app.route("/producers/<int:producer_id>/charts.json")
+def producer_charts(producer_id):
+    """Return the producer's frequency donut and productivity line chart data."""
 
-@app.route("/producer-productivity.json")
-def producer_productivity_data():
-    """Return producer productivity JSON for line Chartjs data viz."""
-    
-    # Get producer_id from id stored in session.
-    producer_id = session["producer_id"]
-
-    # Return tuples of song_release_year and song counts for every producer from 
-    # the years 1900 - 2019.  Correcting for year data pulled from Genius API 
-    # that may be an incorrect year.
-    producer_song_tuples = db.session.query(
-        Song.song_release_year, db.func.count(ProduceSong.song_id)
-    ).join(
-        ProduceSong
-    ).filter(
-        ProduceSong.producer_id == producer_id,
-        Song.song_release_year != None,
-        cast(Song.song_release_year, Numeric(10, 4)) > 1900,
-        cast(Song.song_release_year, Numeric(10, 4)) < 2019
-    ).group_by(
-        Song.song_release_year
-    ).order_by(
-        Song.song_release_year
-    ).all()
-
-    # Loop through producer song tuples, making the value of the 1st index in
-    # the tuple (year) the labels and the 2nd index value (song counts) the data
-    labels = []
-    data = []
-
-    for producer_song in producer_song_tuples:
-        year, song_count = producer_song
-
-        labels.append(year)
-        data.append(song_count)
-
-    # Dictionary Chart.js will use to create line chart.
-    return jsonify({
-        "labels": labels,
-        "datasets": [
-            {
-                "label": "Number of Songs Produced",
-                "fill": True,
-                "lineTension": 0.5,
-                "backgroundColor": "rgba(0,255,0,0.1)",
-                "borderColor": "rgba(220,220,220,1)",
-                "borderCapStyle": 'butt',
-                "borderDash": [],
-                "borderDashOffset": 0.0,
-                "borderJoinStyle": 'miter',
-                "pointBorderColor": "rgba(220,220,220,1)",
-                "pointBackgroundColor": "green",
-                "pointBorderWidth": 1,
-                "pointHoverRadius": 5,
-                "pointHoverBackgroundColor": "green",
-                "pointHoverBorderColor": "rgba(220,220,220,1)",
-                "pointHoverBorderWidth": 2,
-                "pointRadius": 3,
-                "pointHitRadius": 10,
-                "data": data,
-                "spanGaps": False
-            }
-        ]
+    return cached_json(f"producer-{producer_id}-charts", lambda: {
+        "frequency": producer_frequency(producer_id),
+        "productivity": producer_productivity(producer_id),
     })
 
 
 @app.route("/performers")
+@pages.cached(lambda: "performers-%d-%d" % page_args())
 def performer_list():
     """Show list of performers."""
 
-    # Return producers in database; return results alphabetized.
-    performers = Performer.query.all()
-
-    page, per_page, offset = get_page_args(
-            page_parameter="page", per_page_parameter="per_page"
-        )
-
-    per_page = 100
+    page, per_page = page_args()
 
-    offset = (page - 1) * per_page
-    total = len(performers)
+    # Return only the requested page of performers, alphabetized.
+    performers = performer_pages.page(page, per_page)
 
-    pagination_performers = performers[offset : offset + per_page]
     pagination = Pagination(
-        page=page, per_page=per_page, total=total, css_framework="bootstrap4"
+        page=page, per_page=per_page, total=performer_pages.total(),
+        css_framework="bootstrap4"
     )
 
-    return render_template(
+    return render_list(
         "performer_list.html", 
-        performers=pagination_performers,
+        performers=performers,
         page=page,
         per_page=per_page,
         pagination=pagination
     )
 
+def performer_page_key(performer_id):
+    """Return the page cache key for a performer's page.
+
+    The bio arrives from Genius in the background, and related performers
+    may not be stored yet, so the key changes once they do.
+    """
+
+    bio = bios.get(performer_id)
+    bio_digest = hashlib.sha1(bio.encode("utf-8")).hexdigest()[:12]
+    related_version = recommendations.loaded_version()
+
+    return f"performer-{performer_id}-{bio_digest}-{related_version}"
+
+
 # Each performer's page's url will include the performer's database id.
 @app.route("/performers/<int:performer_id>", methods=["GET"])
+@pages.cached(performer_page_key)
 def performer_detail(performer_id):
     """Show performer's detail."""
 
-    URL = "https://genius.com/api/artists/" + str(performer_id)
-
-    performer = Performer.query.options(db.joinedload("albums")
-                                          .joinedload("songs")
-                                          .joinedload("producers")
-                                        ).get(performer_id)
-
-    all_performers = Performer.query.all()
-
-    albums = performer.albums
+    performer = get_or_404(Performer, performer_id)
 
-    # Return a set of performer's album release years in descending order.
-    album_years = sorted(set([album.album_release_date.strftime("%Y")
-                         for album in albums]
-                        ),reverse=True)
+    # The performer's albums by release year, and songs without an album.
+    album_years, timeline, singles = album_timeline(ProduceSong.performer_id,
+                                                    performer_id)
 
-    # Store performer_id in session.
-    session["performer_id"] = performer_id
+    # Cached Genius bio; never waits on the API.
+    bio = bios.get(performer_id)
 
-    # API call for producer bio.
-    r = requests.get(URL)
-    j = r.json()
-    
-    # If url request is successful and the bio JSON key exists, return that key
-    # value (description_preview); otherwise, return an empty string.
-    if j["meta"]["status"] == 200:
-        bio = j["response"]["artist"].get("description_preview","")
-
-    # Return related performers with knn ML algorithm.
-    data = pd.read_csv('seed_data/scores.csv')
-    d = data.pivot(index='performer_id', columns='producer_id', values='score')
-    # knn
-    model = joblib.load('static/model/trained-model.pkl')
-
-    # The performer being searched is included in the neighbors list.  Remove it
-    # before passing list to Jinja with pop left equivalent method.
-    # For future development: cache values to prevent doing operations in server.
-    dist, ind = model.kneighbors(d.loc[performer_id,:].values.reshape(1, -1))
-    related_performers = [list(d.index)[i] for i in ind[0]]
-    related_performers.pop(0)
+    # Related performers, precomputed with kNN.
+    related_performers = recommendations.lookup("performer", performer_id)
 
     return render_template("performer.html",
                             performer=performer,
-                            all_performers=all_performers,
                             album_years=album_years,
+                            timeline=timeline,
+                            singles=singles,
                             bio=bio,
                             related_performers=related_performers
                           )
 
 
-@app.route("/performer-frequency.json")
-def generate_performer_producer_frequency_donut_chart():
-    """Create JSON of performer to producer frequency."""
-
-    # Retrieve performer_id from session.
-    performer_id = session["performer_id"]
+@app.route("/performers/<int:performer_id>/charts.json")
+def performer_charts(performer_id):
+    """Return the performer's frequency donut chart data."""
 
-    # Return tuples of producer_names and song_counts for performer.
-    performer_producer_tuples = db.session.query(
-        Producer.producer_name, 
-        db.func.count(ProduceSong.song_id)
-    ).join(
-        ProduceSong
-    ).filter(
-        ProduceSong.performer_id == performer_id
-    ).group_by(
-        Producer.producer_name
-    ).order_by(
-        Producer.producer_name
-    ).all()
-
-    # Loop through range of song_count tuple to feed data to chart, setting 
-    # labels as the producer name and the song counts for each producer as the 
-    # data.
-    labels = []
-    data = []
-    background_color = []
-
-    for performer_producer in performer_producer_tuples:
-        producer, song_count = performer_producer
-
-        labels.append(producer)
-        data.append(song_count)
-
-        # Generate chart colors using random's randint method.
-        random_red = random.randint(0,255)
-        random_green = random.randint(0,255)
-        random_blue = random.randint(0,255)
-        random_color = f"rgba({random_red},{random_green},{random_blue},1)"
-
-        background_color.append(random_color)
-
-    # Dictionary Chart.js will use to create donut chart.
-    return jsonify({
-                "labels": labels,
-                "datasets": [
-                    {
-                        "data": data,
-                        "backgroundColor": background_color,
-                        # "hoverBackgroundColor": []
-                    }]
-            })
+    return cached_json(f"performer-{performer_id}-charts", lambda: {
+        "frequency": performer_frequency(performer_id),
+    })
 
 
 @app.route("/songs")
+@pages.cached(lambda: "songs-%d-%d" % page_args())
 def song_list():
     """Show list of songs."""
 
-    # SQLALchemy query to return all song titles.
-    songs = Song.query.order_by("song_title").all()
-
-    page, per_page, offset = get_page_args(
-            page_parameter="page", per_page_parameter="per_page"
-        )
-
-    per_page = 100
+    page, per_page = page_args()
 
-    offset = (page - 1) * per_page
-    total = len(songs)
+    # Return only the requested page of songs, alphabetized, with their
+    # performers fetched in one more query.
+    songs = song_pages.page(page, per_page, db.selectinload("performers"))
 
-    pagination_songs = songs[offset : offset + per_page]
     pagination = Pagination(
-        page=page, per_page=per_page, total=total, css_framework="bootstrap4"
+        page=page, per_page=per_page, total=song_pages.total(),
+        css_framework="bootstrap4"
     )
 
-    return render_template("song_list.html", 
-                            songs=pagination_songs,
-                            page=page,
-                            per_page=per_page,
-                            pagination=pagination
-                          )
+    return render_list("song_list.html", 
+                        songs=songs,
+                        page=page,
+                        per_page=per_page,
+                        pagination=pagination
+                      )
 
 
 # Each song's page's URL will include the song's database id.
 @app.route("/songs/<int:song_id>", methods=["GET"])
+@pages.cached(lambda song_id: f"song-{song_id}")
 def song_detail(song_id):
     """Show song detail."""
 
-    # Return song objects using producers' and songs' relationship.
-    song = Song.query.options(db.joinedload("producers")
-                                .joinedload("songs")
-                               ).get(song_id)
+    # Return the song with just the producer, performer and album columns
+    # song.html shows, each relationship fetched in one batched query.
+    query = bakery(lambda session: session.query(Song).options(
+        db.selectinload("producers").load_only(
+            "producer_id", "producer_name", "producer_img_url"
+        ),
+        db.selectinload("performers").load_only(
+            "performer_id", "performer_name"
+        ),
+        db.selectinload("albums").load_only(
+            "album_id", "album_title"
+        )
+    ))
+
+    song = query(db.session()).get(song_id)
+
+    if song is None:
+        abort(404)
 
     return render_template("song.html",
                             song=song
@@ -498,46 +493,108 @@ def song_detail(song_id):
 
 
 @app.route("/albums")
+@pages.cached(lambda: "albums-%d-%d" % page_args())
 def album_list():
     """Show list of albums."""
 
-    # Return album objects using performers' and albums' relationship, ordering
-    # results by album title.
-    albums = Album.query.options(db.joinedload("performers")
-                                   .joinedload("albums")
-                                  ).order_by('album_title').all()
-
-    page, per_page, offset = get_page_args(
-            page_parameter="page", per_page_parameter="per_page"
-        )
-
-    per_page = 100
+    page, per_page = page_args()
 
-    offset = (page - 1) * per_page
-    total = len(albums)
+    # Return only the requested page of albums, ordered by album title.  The
+    # list shows album fields only, so no relationships are loaded.
+    albums = album_pages.page(page, per_page)
 
-    pagination_albums = albums[offset : offset + per_page]
     pagination = Pagination(
-        page=page, per_page=per_page, total=total, css_framework="bootstrap4"
+        page=page, per_page=per_page, total=album_pages.total(),
+        css_framework="bootstrap4"
     )
 
-    return render_template("album_list.html", 
-                            albums=pagination_albums,
-                            page=page,
-                            per_page=per_page,
-                            pagination=pagination
-                          )
+    return render_list("album_list.html", 
+                        albums=albums,
+                        page=page,
+                        per_page=per_page,
+                        pagination=pagination
+                      )
 
 @app.route("/data.json")
 def get_graph_data():
-    """JSON read to create music industry D3 Chart."""
+    """JSON read to create music industry D3 Chart.
+
+    With type and id, returns that producer's or performer's collaborators
+    up to depth hops away; otherwise the most connected producers and
+    performers (of one type if type is given).  year_from and year_to count
+    only songs released in those years.  max_nodes and max_edges bound the
+    response.
+    """
+
+    from graph import DEFAULT_EDGES, DEFAULT_NODES, NODE_TYPES
+
+    graph = collaboration_graph.get()
+
+    node_type = request.args.get("type")
+    entity_id = request.args.get("id", type=int)
+
+    if node_type is not None and node_type not in NODE_TYPES:
+        abort(400)
+
+    centre = None
+
+    if entity_id is not None:
+        centre = graph.node(node_type or "producer", entity_id)
+
+        if centre is None:
+            abort(404)
+
+    return jsonify(graph.subgraph(
+        centre=centre,
+        depth=request.args.get("depth", 1, type=int),
+        max_nodes=request.args.get("max_nodes", DEFAULT_NODES, type=int),
+        max_edges=request.args.get("max_edges", DEFAULT_EDGES, type=int),
+        year_from=request.args.get("year_from", type=int),
+        year_to=request.args.get("year_to", type=int),
+        node_type=node_type
+    ))
+
+
+@app.route("/path.json")
+def get_collaboration_path():
+    """Return the shortest chain of collaborations between two producers or
+    performers, given as from and to ids like "producer-5".
+    """
+
+    from graph import DEFAULT_HOPS, path_json
+
+    graph = collaboration_graph.get()
+
+    source = graph.parse_node(request.args.get("from", ""))
+    target = graph.parse_node(request.args.get("to", ""))
+
+    if source is None or target is None:
+        abort(404)
+
+    path, reason = graph.shortest_path(
+        source, target,
+        max_hops=request.args.get("max_hops", DEFAULT_HOPS, type=int)
+    )
+
+    return jsonify(path_json(graph, path, reason))
+
+
+@app.route("/producer_bubbles.json")
+def get_producer_bubbles():
+    """JSON read to create the producer bubble chart.
+
+    Returns the top producers by songs produced, each with its performer
+    count and first and last release years.  year_from and year_to count
+    only songs released in those years.
+    """
 
-    # Call helper functions.
-    # Read filename fed in as argument.
-    nodes, paths = make_nodes_and_paths("static/output_for_network.csv")
-    # Create a json object of the list of nodes and list of paths.
-    return jsonify({"nodes":nodes, "paths":paths}) 
+    from bubbles import DEFAULT_TOP
 
+    return jsonify(producer_activity.get().bubbles(
+        top=request.args.get("top", DEFAULT_TOP, type=int),
+        year_from=request.args.get("year_from", type=int),
+        year_to=request.args.get("year_to", type=int)
+    ))
 
 
 ################################################################################
@@ -549,7 +606,8 @@ if __name__ == "__main__":
 
     connect_to_db(app)
 
-    # Using the DebugToolbar.
+    # Using the DebugToolbar, only imported for the development server.
+    from flask_debugtoolbar import DebugToolbarExtension
     DebugToolbarExtension(app)
 
     app.run(host="0.0.0.0")
\ No newline at end of file
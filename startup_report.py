@@ -0,0 +1,119 @@
+"""Report how long a worker takes to import server.py and how much memory
+it holds afterwards.
+
+Imports the app in a fresh interpreter run with -X importtime, then prints
+the wall time of the import, the process's resident set size before and
+after, which of the heavyweight libraries got imported (server.py should
+import none of them until a request needs one), and the slowest of the
+modules it imports.
+
+    $ python3 startup_report.py
+    $ python3 startup_report.py --module wsgi --top 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Libraries a worker serving only lists, search and charts shouldn't need.
+HEAVY_MODULES = ["numpy", "scipy", "pandas", "sklearn", "requests",
+                 "flask_debugtoolbar"]
+
+# Run in the child: import the module and print its measurements as JSON.
+CHILD_SCRIPT = """
+import json, resource, sys, time
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 2 ** 20
+
+before = rss_mb()
+started = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - started
+
+print(json.dumps({
+    "seconds": seconds,
+    "rss_before_mb": before,
+    "rss_after_mb": rss_mb(),
+    "modules": len(sys.modules),
+    "heavy": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def parse_import_times(stderr, module):
+    """Return [(cumulative microseconds, name)] for the modules module
+    imports directly, from -X importtime output, slowest first.
+    """
+
+    children = []
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+
+        if not cumulative.strip().isdigit():
+            continue
+
+        # Each level of nesting indents the name two more spaces, and a
+        # module's line comes after those of the modules it imports.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+
+        if depth == 1:
+            children.append((int(cumulative), name))
+        elif depth == 0:
+            if name == module:
+                return sorted(children, reverse=True)
+
+            children = []
+
+    return []
+
+
+def startup_report(module="server"):
+    """Import module in a child interpreter; return its measurements and
+    the times of its imports.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT, module]
+        + HEAVY_MODULES,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["import_times"] = parse_import_times(result.stderr, module)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="server",
+                        help="module to import, e.g. server or wsgi")
+    parser.add_argument("--top", type=int, default=15,
+                        help="slowest of the module's imports to list")
+    args = parser.parse_args()
+
+    report = startup_report(args.module)
+
+    print(f"import {args.module}: {report['seconds']:.2f}s, "
+          f"{report['modules']} modules")
+    print(f"RSS: {report['rss_before_mb']:.0f} MB before, "
+          f"{report['rss_after_mb']:.0f} MB after")
+    print(f"Heavy modules loaded: {', '.join(report['heavy']) or 'none'}")
+    print("Slowest imports:")
+
+    for microseconds, name in report["import_times"][:args.top]:
+        print(f"    {microseconds / 1000:8.1f} ms  {name}")
@@ -0,0 +1,27 @@
+// Suggest producers, performers, songs and albums as the user types in a
+// search bar, using the in-memory index behind /autocomplete.json.
+
+let autocompleteRequest = null;
+
+$("input.autocomplete").on("input", function () {
+  let query = $(this).val();
+  let datalist = $("#" + $(this).attr("list"));
+
+  // Only the latest keystroke's suggestions matter.
+  if (autocompleteRequest) {
+    autocompleteRequest.abort();
+  }
+
+  if (!query) {
+    datalist.empty();
+    return;
+  }
+
+  autocompleteRequest = $.get("/autocomplete.json", {q: query}, function (data) {
+    datalist.empty();
+
+    for (let result of data.results) {
+      datalist.append($("<option>").attr("value", result.name));
+    }
+  });
+});
@@ -2,14 +2,15 @@ const options = {
   responsive: true
 };
 
-// Make donut chart of number of songs created per producer.
+// Make donut chart of number of songs created per producer.  The canvas's
+// data-charts-url is the performer's /performers/<id>/charts.json.
 let ctx_donut = $("#performer_song_donutChart").get(0).getContext("2d");
 
-$.get("/performer-frequency.json", function (data) {
+$.get($("#performer_song_donutChart").data("charts-url"), function (data) {
   let myDonutChart = new Chart(ctx_donut, {
                                           type: 'doughnut',
-                                          data: data,
+                                          data: data.frequency,
                                           options: options
                                         });
   // $('#performer_song_donutLegend').html(myDonutChart.generateLegend());
-});
\ No newline at end of file
+});
@@ -2,27 +2,25 @@ const options = {
   responsive: true
 };
 
-// Make donut chart of number of songs created per performer.
 let ctx_donut = $("#producer_song_donutChart").get(0).getContext("2d");
+let ctx_line = $("#producer_song_lineChart").get(0).getContext("2d");
 
-$.get("/producer-frequency.json", function (data) {
+// Both charts' data comes from one response, addressed by the producer's id.
+$.get($("#producer_song_donutChart").data("charts-url"), function (data) {
+  // Make donut chart of number of songs created per performer.
   let myDonutChart = new Chart(ctx_donut, {
                                           type: 'doughnut',
-                                          data: data,
+                                          data: data.frequency,
                                           options: options
                                         });
   // bottom legend
   // $('#producer_song_donutLegend').html(myDonutChart.generateLegend());
-});
 
-// Make line chart of number of songs created over time, 
-// performer agnostic.
-let ctx_line = $("#producer_song_lineChart").get(0).getContext("2d");
-
-$.get("/producer-productivity.json", function (data) {
+  // Make line chart of number of songs created over time, 
+  // performer agnostic.
   let myLineChart = Chart.Line(ctx_line, {
-                                data: data,
+                                data: data.productivity,
                                 options: options
                             });
   // $("#producer_song_lineLegend").html(myLineChart.generateLegend());
-});
\ No newline at end of file
+});
@@ -0,0 +1,132 @@
+"""Summary tables behind the producer and performer chart endpoints.
+
+producer_performer_counts holds the number of events per producer and
+performer (indexed both ways), and producer_year_counts the number of events
+per producer and song release year, so each chart is an indexed lookup of
+one producer's or performer's rows instead of a GROUP BY over produce_songs.
+
+seed.py rebuilds both tables after a full load; incremental syncs adjust
+the counts for just the events added and removed.
+"""
+
+from collections import Counter
+
+from sqlalchemy import select
+
+from model import ProduceSong, ProducerPerformerCount, ProducerYearCount, Song, db
+
+performer_counts = ProducerPerformerCount.__table__
+year_counts = ProducerYearCount.__table__
+
+
+def refresh_summaries(connection=None, years_only=False):
+    """Rebuild the summary tables from produce_songs.
+
+    With years_only, only producer_year_counts is rebuilt (for when song
+    release years change but events don't).
+    """
+
+    if connection is None:
+        with db.engine.begin() as connection:
+            return refresh_summaries(connection, years_only)
+
+    if not years_only:
+        connection.execute(performer_counts.delete())
+        connection.execute(performer_counts.insert().from_select(
+            ["producer_id", "performer_id", "song_count"],
+            select([
+                ProduceSong.producer_id,
+                ProduceSong.performer_id,
+                db.func.count(ProduceSong.event_id),
+            ]).group_by(
+                ProduceSong.producer_id, ProduceSong.performer_id
+            )
+        ))
+
+    connection.execute(year_counts.delete())
+    connection.execute(year_counts.insert().from_select(
+        ["producer_id", "song_release_year", "song_count"],
+        select([
+            ProduceSong.producer_id,
+            Song.song_release_year,
+            db.func.count(ProduceSong.event_id),
+        ]).select_from(
+            ProduceSong.__table__.join(Song.__table__)
+        ).where(
+            Song.song_release_year != None
+        ).group_by(
+            ProduceSong.producer_id, Song.song_release_year
+        )
+    ))
+
+
+def _apply_deltas(connection, table, key_columns, deltas):
+    """Add deltas ({key tuple: change in count}) to table's song_count."""
+
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+
+        match = db.and_(*[table.c[column] == value
+                          for column, value in zip(key_columns, key)])
+
+        updated = connection.execute(
+            table.update().where(match).values(song_count=table.c.song_count + delta)
+        ).rowcount
+
+        if not updated and delta > 0:
+            connection.execute(table.insert().values(
+                song_count=delta, **dict(zip(key_columns, key))
+            ))
+
+    # Drop pairs with no events left.
+    connection.execute(table.delete().where(table.c.song_count <= 0))
+
+
+def apply_event_changes(connection, added, removed):
+    """Adjust the summary tables for events added and removed.
+
+    added and removed are lists of (producer_id, performer_id, song_id,
+    album_id) tuples.
+    """
+
+    pair_deltas = Counter()
+    song_deltas = Counter()
+
+    for sign, events in ((1, added), (-1, removed)):
+        for producer_id, performer_id, song_id, album_id in events:
+            pair_deltas[producer_id, performer_id] += sign
+            song_deltas[producer_id, song_id] += sign
+
+    _apply_deltas(connection, performer_counts,
+                  ("producer_id", "performer_id"), pair_deltas)
+
+    song_ids = list(set(song_id for producer_id, song_id in song_deltas))
+    years = {}
+
+    for start in range(0, len(song_ids), 500):
+        years.update(connection.execute(
+            select([Song.song_id, Song.song_release_year])
+            .where(Song.song_id.in_(song_ids[start:start + 500]))
+        ).fetchall())
+
+    year_deltas = Counter()
+
+    for (producer_id, song_id), delta in song_deltas.items():
+        if years.get(song_id) is not None:
+            year_deltas[producer_id, years[song_id]] += delta
+
+    _apply_deltas(connection, year_counts,
+                  ("producer_id", "song_release_year"), year_deltas)
+
+
+if __name__ == "__main__":
+    # Rebuild the summary tables on an existing database.
+
+    from model import connect_to_db
+    from server import app
+
+    connect_to_db(app)
+    db.create_all()
+    refresh_summaries()
+    print("Summary tables refreshed.")
@@ -0,0 +1,104 @@
+"""Production entry point for the app.
+
+server.py's __main__ block runs Flask's single-process development server
+with the debug toolbar and template auto-reload.  This module instead builds
+server.app for production, where configure_app():
+
+    - connects to DATABASE_URL, sending reads to DATABASE_REPLICA_URLS if
+      set (see db_routing.py), and checks the connection once, so a bad URI
+      fails at boot, not on the first request;
+    - turns template auto-reload off, so templates are no longer stat'ed on
+      every render, and caches compiled templates as bytecode in
+      JINJA_CACHE_DIR, so new workers don't recompile them;
+    - streams the large list pages to the client as they render.
+
+Run it under gunicorn with gunicorn_config.py, which preloads the app once
+in the master and forks WEB_WORKERS workers with WEB_THREADS threads each:
+
+    $ gunicorn -c gunicorn_config.py wsgi:app
+
+or, without gunicorn, in one threaded process:
+
+    $ python3 wsgi.py
+
+The engine is created in the master but holds no connections when workers
+fork: configure_app() empties its pool, and each worker empties it again after
+the fork, so no two processes share a database socket.
+"""
+
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+from model import connect_to_db, db
+
+# Comma-separated read replicas of DATABASE_URL.
+DATABASE_REPLICA_URLS = [
+    uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if uri
+]
+
+# Directory for compiled templates; unset uses the system temp directory.
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR")
+
+# Address the threaded fallback server listens on.
+WEB_HOST = os.environ.get("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("WEB_PORT", 5000))
+
+
+def configure_app(db_uri=None, replica_uris=DATABASE_REPLICA_URLS):
+    """Configure server.app for production and return it.
+
+    This isn't a factory: server.app is a module-level app, so this
+    connects it to the database and registers the replicas once per
+    process, when this module is imported, and raises RuntimeError if
+    called again.
+    """
+
+    from server import app
+
+    if app.config.get("PRODUCTION_CONFIGURED"):
+        raise RuntimeError("server.app is already configured for production")
+
+    app.config["PRODUCTION_CONFIGURED"] = True
+
+    app.debug = False
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+    app.jinja_env.auto_reload = False
+
+    if JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    else:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+    # Send list pages as they render instead of building them whole.
+    app.config["STREAM_TEMPLATES"] = True
+
+    connect_to_db(app, db_uri, replica_uris)
+
+    # Create the engine and check the database now; then leave no
+    # connections in the pool for forked workers to inherit.
+    with app.app_context():
+        db.session.execute("SELECT 1")
+        db.session.remove()
+        dispose_engine()
+
+    return app
+
+
+def dispose_engine():
+    """Drop any pooled connections inherited from the parent process, to
+    the primary and any replicas.
+    """
+
+    from server import app
+
+    for bind in [None] + list(app.config.get("SQLALCHEMY_BINDS") or {}):
+        db.get_engine(app, bind=bind).dispose()
+
+
+app = configure_app()
+
+
+if __name__ == "__main__":
+    app.run(host=WEB_HOST, port=WEB_PORT, threaded=True)